@@ -1,6 +1,6 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, ImageDraw
 import os
 import cv2
 import numpy as np
@@ -9,13 +9,17 @@ import tempfile
 import io
 from io import BytesIO
 import plotly.graph_objects as go
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 from googleapiclient.discovery import build
 import json
 import shutil
 import uuid
+import queue
+import threading
+from detection_service import DetectionClient
+from annotations import Annotations
 
 class CloudImageApp:
     def __init__(self, root):
@@ -27,12 +31,15 @@ class CloudImageApp:
             "Hyaline Membranes": (255, 0, 0),
             "Proteinaceous Debris": (0, 0, 255)
         }
+        # radio options that run a different detector but annotate an existing class
+        self.feature_classes = {"Neutrophils (model)": "Neutrophils"}
         self.service_account_file = "lunginsightcloud-fa31002e7988.json"
         self.scopes = ['https://www.googleapis.com/auth/drive']
         self.input_folder_id = "1kTVr2h11XlnV3xntxjZbPNZebJ8vr5SX"
         self.output_folder_id = "1XrfiMR4nLvKb2kx7MiwwBfdZlpOmT9ub"
         self.coordinates_folder_id = "1XrfiMR4nLvKb2kx7MiwwBfdZlpOmT9ub"
         self.interobplt_thresh = 1
+        self.detection_client = DetectionClient(os.environ.get("DETECTION_SERVICE_URL", "http://127.0.0.1:8765"))
         self.current_image_info = {}
         self.rectangles = []
         self.image_index = 0
@@ -46,6 +53,8 @@ class CloudImageApp:
         self.current_image = None
         self.current_feature = "Neutrophils"
         self.image_processed = False
+        self.processing_executor = ThreadPoolExecutor(max_workers=1)
+        self.processing_job = None
         self.user_name = self.get_username()
         if not self.user_name:
             self.root.quit()
@@ -85,11 +94,13 @@ class CloudImageApp:
         self.feature_frame.pack(pady=5)
         ttk.Label(self.feature_frame, text="Feature:").pack(side=tk.LEFT)
         ttk.Radiobutton(self.feature_frame, text="Neutrophils", variable=self.feature_type, 
-                        value="Neutrophils").pack(side=tk.LEFT, padx=5)
+                        value="Neutrophils", command=self.on_feature_change).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(self.feature_frame, text="Neutrophils (model)", variable=self.feature_type,
+                        value="Neutrophils (model)", command=self.on_feature_change).pack(side=tk.LEFT, padx=5)
         ttk.Radiobutton(self.feature_frame, text="Hyaline Membranes", variable=self.feature_type,
-                        value="Hyaline Membranes").pack(side=tk.LEFT, padx=5)
+                        value="Hyaline Membranes", command=self.on_feature_change).pack(side=tk.LEFT, padx=5)
         ttk.Radiobutton(self.feature_frame, text="Proteinaceous Debris", variable=self.feature_type,
-                        value="Proteinaceous Debris").pack(side=tk.LEFT, padx=5)
+                        value="Proteinaceous Debris", command=self.on_feature_change).pack(side=tk.LEFT, padx=5)
         self.button_frame = ttk.Frame(self.main_frame)
         self.button_frame.pack(pady=5)
         self.continue_button = ttk.Button(self.button_frame, text="Process", command=self.on_continue)
@@ -99,6 +110,8 @@ class CloudImageApp:
         self.continue_button.pack(side=tk.LEFT, padx=5)
         self.next_button.pack(side=tk.LEFT, padx=5)
         self.variability_button.pack(side=tk.LEFT, padx=5)
+        self.progress_label = ttk.Label(self.main_frame, text="")
+        self.progress_label.pack(pady=2)
 
     def save_final_image(self):
         try:
@@ -394,6 +407,7 @@ class CloudImageApp:
             return False
 
     def load_image(self):
+        self.cancel_processing()
         self.current_image_info = self.image_list[self.image_index]
         temp_image_path = os.path.join(self.temp_dir, self.current_image_info['name'])
         self.feature_type.set("Neutrophils")
@@ -424,111 +438,250 @@ class CloudImageApp:
             messagebox.showerror("Error", f"Failed to display image: {str(e)}")
 
     def on_continue(self):
-        self.current_feature = self.feature_type.get()
-        if self.current_feature == "Neutrophils":
+        selection = self.feature_type.get()
+        self.current_feature = self.selected_class()
+        if selection == "Neutrophils":
             self.process_neutrophils()
-        elif self.current_feature == "Hyaline Membranes":
+        elif selection == "Neutrophils (model)":
+            self.process_neutrophils_model()
+        elif selection == "Hyaline Membranes":
             self.process_hyaline_membranes()
-        elif self.current_feature == "Proteinaceous Debris":
+        elif selection == "Proteinaceous Debris":
             self.process_proteinaceous_debris()
         else:
             messagebox.showerror("Error", "Unknown feature type selected")
             return
         self.feature_type.set("Neutrophils")
+        if self.processing_job is not None:
+            # compare later radio changes against what the radio shows, not the reset-away selection
+            self.processing_job["selection"] = self.feature_type.get()
 
     def process_neutrophils(self):
-        try:
-            tile = cv2.imread(self.current_image_path)
-            image_intact = tile.copy()
-            tile[tile > 220] = 255
-            gray_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(gray_tile, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            mask = np.zeros_like(gray_tile)
-            cv2.drawContours(mask, contours, -1, 255, thickness=cv2.FILLED)
-            internal_mask = cv2.bitwise_not(mask)
-            internal_only = cv2.bitwise_and(thresh, thresh, mask=internal_mask)
-            internal_contours, _ = cv2.findContours(internal_only, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                perimeter = cv2.arcLength(contour, True)
-                if perimeter == 0:
-                    continue
-                circularity = 4 * np.pi * (area / (perimeter * perimeter))
-                if 300 < area < 900 and 0.5 < circularity < 1:
-                    x, y, w, h = cv2.boundingRect(contour)
-                    k = 1.05
-                    padding = int(k * np.sqrt(area))
-                    center_x = x + w // 2
-                    center_y = y + h // 2
-                    radius = padding
-                    radius = min(radius, center_x, center_y, tile.shape[1] - center_x, tile.shape[0] - center_y)
-                    neighborhood_mask = np.zeros_like(thresh, dtype=np.uint8)
-                    cv2.circle(neighborhood_mask, (center_x, center_y), radius, 255, thickness=-1)
-                    neighborhood = cv2.bitwise_and(thresh, thresh, mask=neighborhood_mask)
-                    total_pixels = cv2.countNonZero(neighborhood_mask)
-                    light_areas_mask = cv2.inRange(tile, (200, 200, 200), (255, 255, 255))
-                    neighborhood_light = cv2.bitwise_and(light_areas_mask, light_areas_mask, mask=neighborhood_mask)
-                    white_pixels = cv2.countNonZero(neighborhood_light)
-                    white_percentage = white_pixels / total_pixels
-                    score = self.calculate_score(area, circularity, white_percentage)
-                    if score < 0.15:
-                        continue
-                    color = self.feature_colors["Neutrophils"]
-                    cv2.rectangle(tile, (x, y), (x + w, y + h), color, 2)
-                    score_text = f"{score * 100:.2f}%"
-                    text_position = (x, y - 10)
-                    cv2.putText(tile, score_text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
-                    self.rectangles.append((x, y, x + w, y + h, "Neutrophils"))
-            processed_path = os.path.join(self.processed_dir, self.current_image_info['name'])
-            cv2.imwrite(processed_path, tile)
-            self.update_coordinates_file()
-            self.display_image(processed_path)
-            self.show_post_processing_options()
-        except Exception as e:
-            messagebox.showerror("Processing Error", f"Neutrophil processing failed: {str(e)}")
+        self.start_processing("Neutrophils", self.detect_neutrophils, "Neutrophil processing failed")
 
-    def process_hyaline_membranes(self):
-        try:
-            tile = cv2.imread(self.current_image_path)
-            image_intact = tile.copy()
-            hsv_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)
-            lower_pink = np.array([140, 50, 50])
-            upper_pink = np.array([170, 255, 255])
-            pink_mask = cv2.inRange(hsv_tile, lower_pink, upper_pink)
-            kernel = np.ones((5, 5), np.uint8)
-            pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_CLOSE, kernel)
-            pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_OPEN, kernel)
-            contours, _ = cv2.findContours(pink_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                perimeter = cv2.arcLength(contour, True)
-                if area < 500 or perimeter == 0:
-                    continue
+    def detect_neutrophils(self, tile, cancelled, emit):
+        image_intact = tile.copy()
+        tile[tile > 220] = 255
+        gray_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(gray_tile, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        mask = np.zeros_like(gray_tile)
+        cv2.drawContours(mask, contours, -1, 255, thickness=cv2.FILLED)
+        internal_mask = cv2.bitwise_not(mask)
+        internal_only = cv2.bitwise_and(thresh, thresh, mask=internal_mask)
+        internal_contours, _ = cv2.findContours(internal_only, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for i, contour in enumerate(contours):
+            if cancelled.is_set():
+                return None
+            if i % 50 == 0:
+                emit(("progress", i, len(contours)))
+            area = cv2.contourArea(contour)
+            perimeter = cv2.arcLength(contour, True)
+            if perimeter == 0:
+                continue
+            circularity = 4 * np.pi * (area / (perimeter * perimeter))
+            if 300 < area < 900 and 0.5 < circularity < 1:
                 x, y, w, h = cv2.boundingRect(contour)
-                elongation = max(w, h) / min(w, h) if min(w, h) > 0 else 0
-                mask = np.zeros_like(pink_mask)
-                cv2.drawContours(mask, [contour], -1, 255, thickness=cv2.FILLED)
-                mean_color = cv2.mean(hsv_tile, mask=mask)[:3]
-                hue_score = 1.0 if 140 <= mean_color[0] <= 170 else 0.5
-                score = self.calculate_hyaline_score(area, elongation, hue_score)
-                if score < 0.3:
+                k = 1.05
+                padding = int(k * np.sqrt(area))
+                center_x = x + w // 2
+                center_y = y + h // 2
+                radius = padding
+                radius = min(radius, center_x, center_y, tile.shape[1] - center_x, tile.shape[0] - center_y)
+                neighborhood_mask = np.zeros_like(thresh, dtype=np.uint8)
+                cv2.circle(neighborhood_mask, (center_x, center_y), radius, 255, thickness=-1)
+                neighborhood = cv2.bitwise_and(thresh, thresh, mask=neighborhood_mask)
+                total_pixels = cv2.countNonZero(neighborhood_mask)
+                light_areas_mask = cv2.inRange(tile, (200, 200, 200), (255, 255, 255))
+                neighborhood_light = cv2.bitwise_and(light_areas_mask, light_areas_mask, mask=neighborhood_mask)
+                white_pixels = cv2.countNonZero(neighborhood_light)
+                white_percentage = white_pixels / total_pixels
+                score = self.calculate_score(area, circularity, white_percentage)
+                if score < 0.15:
                     continue
-                color = self.feature_colors.get("Hyaline Membranes", (0, 255, 255))
+                color = self.feature_colors["Neutrophils"]
                 cv2.rectangle(tile, (x, y), (x + w, y + h), color, 2)
                 score_text = f"{score * 100:.2f}%"
                 text_position = (x, y - 10)
                 cv2.putText(tile, score_text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
-                self.rectangles.append((x, y, x + w, y + h, "Hyaline Membranes"))
-            processed_path = os.path.join(self.processed_dir, self.current_image_info['name'])
-            cv2.imwrite(processed_path, tile)
-            self.update_coordinates_file()
-            self.display_image(processed_path)
-            self.show_post_processing_options()
+                emit(("detection", (x, y, x + w, y + h, "Neutrophils")))
+        emit(("progress", len(contours), len(contours)))
+        return tile
+
+    def process_neutrophils_model(self):
+        self.start_processing("Neutrophils", self.detect_neutrophils_model, "Model-based neutrophil detection failed")
+
+    def detect_neutrophils_model(self, tile, cancelled, emit):
+        if not self.detection_client.available():
+            raise RuntimeError(f"Detection service not reachable at {self.detection_client.url}. "
+                               "Start it with: python detection_service.py <model.onnx>")
+        detections = self.detection_client.detect_bytes(cv2.imencode(".png", tile)[1].tobytes())
+        if cancelled.is_set():
+            return None
+        for x1, y1, x2, y2, class_name in detections:
+            color = self.feature_colors.get(class_name, (0, 255, 0))
+            cv2.rectangle(tile, (x1, y1), (x2, y2), color, 2)
+            emit(("detection", (x1, y1, x2, y2, class_name)))
+        return tile
+
+    def process_hyaline_membranes(self):
+        self.start_processing("Hyaline Membranes", self.detect_hyaline_membranes, "Hyaline membrane processing failed")
+
+    def detect_hyaline_membranes(self, tile, cancelled, emit):
+        image_intact = tile.copy()
+        hsv_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)
+        lower_pink = np.array([140, 50, 50])
+        upper_pink = np.array([170, 255, 255])
+        pink_mask = cv2.inRange(hsv_tile, lower_pink, upper_pink)
+        kernel = np.ones((5, 5), np.uint8)
+        pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_CLOSE, kernel)
+        pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_OPEN, kernel)
+        contours, _ = cv2.findContours(pink_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for i, contour in enumerate(contours):
+            if cancelled.is_set():
+                return None
+            if i % 50 == 0:
+                emit(("progress", i, len(contours)))
+            area = cv2.contourArea(contour)
+            perimeter = cv2.arcLength(contour, True)
+            if area < 500 or perimeter == 0:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            elongation = max(w, h) / min(w, h) if min(w, h) > 0 else 0
+            mask = np.zeros_like(pink_mask)
+            cv2.drawContours(mask, [contour], -1, 255, thickness=cv2.FILLED)
+            mean_color = cv2.mean(hsv_tile, mask=mask)[:3]
+            hue_score = 1.0 if 140 <= mean_color[0] <= 170 else 0.5
+            score = self.calculate_hyaline_score(area, elongation, hue_score)
+            if score < 0.3:
+                continue
+            color = self.feature_colors.get("Hyaline Membranes", (0, 255, 255))
+            cv2.rectangle(tile, (x, y), (x + w, y + h), color, 2)
+            score_text = f"{score * 100:.2f}%"
+            text_position = (x, y - 10)
+            cv2.putText(tile, score_text, text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+            emit(("detection", (x, y, x + w, y + h, "Hyaline Membranes")))
+        emit(("progress", len(contours), len(contours)))
+        return tile
+
+    def start_processing(self, feature, detect, error_title):
+        """
+        Run detect(tile, cancelled, emit) on the worker thread. It reports ("progress", done, total)
+        and ("detection", rect) through emit; poll_processing picks these up on the Tk thread via
+        root.after, so detections appear on the image as they are found.
+        """
+        self.cancel_processing()
+        self.current_feature = feature
+        job = {"feature": feature, "selection": self.feature_type.get(), "error_title": error_title,
+               "cancel": threading.Event(), "lock": threading.Lock(), "written": False, "queue": queue.Queue(), "rectangles": [], "image_path": self.current_image_path,
+               "processed_path": os.path.join(self.processed_dir, self.current_image_info['name'])}
+        try:
+            with Image.open(job["image_path"]) as image:
+                self.stream_scale = (1280 / image.width, 512 / image.height)
+                self.stream_image = image.convert("RGB").resize((1280, 512))
         except Exception as e:
-            messagebox.showerror("Processing Error", f"Hyaline membrane processing failed: {str(e)}")
+            messagebox.showerror("Processing Error", f"{error_title}: {str(e)}")
+            return
+        self.processing_job = job
+        self.continue_button.state(["disabled"])
+        self.progress_label.config(text=f"Processing {feature}...")
+
+        def work():
+            try:
+                tile = detect(cv2.imread(job["image_path"]), job["cancel"], job["queue"].put)
+                if tile is None or job["cancel"].is_set():
+                    return
+                # write beside the target and publish under the lock, so a cancel that lands during
+                # the write never leaves a processed file behind
+                part_path = job["processed_path"] + ".part.png"
+                cv2.imwrite(part_path, tile)
+                with job["lock"]:
+                    if job["cancel"].is_set():
+                        os.remove(part_path)
+                        return
+                    os.replace(part_path, job["processed_path"])
+                    job["written"] = True
+                job["queue"].put(("done", job["processed_path"]))
+            except Exception as e:
+                job["queue"].put(("error", str(e)))
+
+        self.processing_executor.submit(work)
+        self.root.after(50, self.poll_processing, job)
+
+    def poll_processing(self, job):
+        if job is not self.processing_job:
+            return
+        new_rectangles = []
+        while True:
+            try:
+                message = job["queue"].get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "detection":
+                job["rectangles"].append(message[1])
+                self.rectangles.append(message[1])
+                new_rectangles.append(message[1])
+            elif message[0] == "progress":
+                self.progress_label.config(text=f"{job['feature']}: {message[1]}/{message[2]} contours, "
+                                                f"{len(job['rectangles'])} found")
+            elif message[0] == "done":
+                self.finish_processing(job, message[1])
+                return
+            elif message[0] == "error":
+                self.processing_job = None
+                self.reset_processing_widgets()
+                messagebox.showerror("Processing Error", f"{job['error_title']}: {message[1]}")
+                return
+        if new_rectangles:
+            self.draw_streamed_detections(new_rectangles)
+        self.root.after(50, self.poll_processing, job)
+
+    def draw_streamed_detections(self, rectangles):
+        draw = ImageDraw.Draw(self.stream_image)
+        scale_x, scale_y = self.stream_scale
+        for x1, y1, x2, y2, class_name in rectangles:
+            blue, green, red = self.feature_colors.get(class_name, (0, 255, 0))
+            draw.rectangle([x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y], outline=(red, green, blue), width=2)
+        self.image_tk = ImageTk.PhotoImage(self.stream_image)
+        if hasattr(self, 'image_label') and self.image_label.winfo_exists():
+            self.image_label.config(image=self.image_tk)
+
+    def finish_processing(self, job, processed_path):
+        self.processing_job = None
+        self.reset_processing_widgets()
+        self.update_coordinates_file()
+        self.display_image(processed_path)
+        self.show_post_processing_options()
+
+    def cancel_processing(self):
+        job = self.processing_job
+        if job is None:
+            return
+        with job["lock"]:
+            job["cancel"].set()
+            if job["written"] and os.path.exists(job["processed_path"]):
+                os.remove(job["processed_path"])
+        self.processing_job = None
+        for rect in job["rectangles"]:
+            if rect in self.rectangles:
+                self.rectangles.remove(rect)
+        self.reset_processing_widgets()
+
+    def reset_processing_widgets(self):
+        try:
+            self.continue_button.state(["!disabled"])
+            self.progress_label.config(text="")
+        except (AttributeError, tk.TclError):
+            pass
+
+    def on_feature_change(self):
+        if self.processing_job is not None and self.processing_job["selection"] != self.feature_type.get():
+            self.cancel_processing()
+            if hasattr(self, 'current_image_path'):
+                self.display_image(self.current_image_path)
 
     def process_proteinaceous_debris(self):
+        self.cancel_processing()
         try:
             original_path = os.path.join(self.temp_dir, self.current_image_info['name'])
             processed_path = os.path.join(self.processed_dir, self.current_image_info['name'])
@@ -564,17 +717,9 @@ class CloudImageApp:
 
     def load_coordinates(self, image_name):
         coord_file = os.path.join(self.coords_dir, f"{os.path.splitext(image_name)[0]}_coords.txt")
-        rectangles = []
-        if os.path.exists(coord_file):
-            with open(coord_file, "r") as file:
-                for line in file:
-                    parts = line.strip().split(',')
-                    if len(parts) == 5:
-                        x1, y1, x2, y2 = map(int, parts[:4])
-                        class_name = parts[4]
-                        color = self.feature_colors.get(class_name, (0, 255, 0))
-                        rectangles.append((x1, y1, x2, y2, class_name))
-        return rectangles
+        if not os.path.exists(coord_file):
+            return []
+        return Annotations.from_coords_file(coord_file).rectangles()
 
     def show_post_processing_options(self):
         self.continue_button.pack_forget()
@@ -633,6 +778,7 @@ class CloudImageApp:
             messagebox.showerror("Error", f"Failed to upload to cloud: {str(e)}")
 
     def load_next_image(self):
+        self.cancel_processing()
         if self.current_image_info:
             self.finalize_and_upload()
         self.image_index += 1
@@ -692,6 +838,7 @@ class CloudImageApp:
             raise
 
     def on_edit(self):
+        self.cancel_processing()
         processed_path = os.path.join(self.processed_dir, self.current_image_info['name'])
         if not os.path.exists(processed_path):
             original_path = os.path.join(self.temp_dir, self.current_image_info['name'])
@@ -754,8 +901,12 @@ class CloudImageApp:
             self.save_rectangle(scaled_start_x, scaled_start_y, scaled_end_x, scaled_end_y)
             self.redraw_image()
 
+    def selected_class(self):
+        selection = self.feature_type.get()
+        return self.feature_classes.get(selection, selection)
+
     def save_rectangle(self, x1, y1, x2, y2):
-        class_name = self.feature_type.get()
+        class_name = self.selected_class()
         new_rect = (x1, y1, x2, y2, class_name)
         if new_rect not in self.rectangles:
             self.rectangles.append(new_rect)
@@ -844,6 +995,8 @@ class CloudImageApp:
             pass
 
     def on_close(self):
+        self.cancel_processing()
+        self.processing_executor.shutdown(wait=False)
         self.save_state()
         self.cleanup()
         self.root.quit()
@@ -1087,12 +1240,8 @@ class CloudImageApp:
                             coord_path = os.path.join(temp_dir, observer, coord_file)
                             boxes = []
                             if os.path.exists(coord_path):
-                                with open(coord_path, 'r') as f:
-                                    for line in f:
-                                        parts = line.strip().split(',')
-                                        if len(parts) >= 5 and parts[4] == feature:
-                                            x1, y1, x2, y2 = map(int, parts[:4])
-                                            boxes.append([x1, y1, x2, y2])
+                                labels = Annotations.from_coords_file(coord_path).of_class(feature)
+                                boxes = np.rint(labels.boxes).astype(int).tolist()
                             observer_boxes[observer] = boxes
                         if not all(observer_boxes[obs] for obs in observers):
                             common_count = 0
@@ -0,0 +1,314 @@
+import os
+import json
+
+import numpy as np
+
+# class ids of the annotation app's features, as in its inter-observer analysis
+CLASS_NAMES = ("Neutrophils", "Hyaline Membranes", "Proteinaceous Debris")
+SPACES = ("pixel", "yolo")
+COLUMNS = {"boxes": np.float64, "class_ids": np.int16, "scores": np.float32, "tile_ids": np.int32, "sizes": np.int32}
+META_FILE = "meta.json"
+
+
+def class_id(class_name, class_names=CLASS_NAMES):
+    return class_names.index(class_name) if class_name in class_names else -1
+
+
+def extend_class_names(class_names, new_names):
+    """
+    class_names followed by the names of new_names it does not hold yet, in first-seen order.
+    """
+    class_names = list(class_names)
+    for name in new_names:
+        if name not in class_names:
+            class_names.append(name)
+    return tuple(class_names)
+
+
+def parse_coords_text(text, default_class="Neutrophils", class_names=CLASS_NAMES):
+    """
+    App _coords.txt content ("x1,y1,x2,y2[,class]" per line) -> (N, 4) pixel boxes, (N,) class ids
+    and the class names they index: class_names plus any name it lacks (e.g. a feature added to
+    the app later), so unknown classes are kept rather than lost.
+    """
+    rows = [line.split(",", 4) for line in text.splitlines()]
+    rows = [row for row in rows if len(row) >= 4]
+    if not rows:
+        return np.zeros((0, 4)), np.zeros(0, dtype=np.int16), tuple(class_names)
+    boxes = np.array([row[:4] for row in rows], dtype=float)
+    names = [row[4].strip() if len(row) == 5 else default_class for row in rows]
+    class_names = extend_class_names(class_names, names)
+    ids = np.array([class_names.index(name) for name in names], dtype=np.int16)
+    return boxes, ids, class_names
+
+
+def parse_yolo_text(text):
+    """
+    YOLO label content -> (N, 4) normalized x1, y1, x2, y2 boxes, (N,) class ids.
+    A sixth column, as written by save_txt with save_conf, is returned as scores.
+    """
+    first = next((line for line in text.splitlines() if line.strip()), "")
+    width = len(first.split()) or 5
+    values = text.split()
+    if not values:
+        return np.zeros((0, 4)), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.float32)
+    rows = np.array(values, dtype=float).reshape(-1, width)
+    centers, sizes = rows[:, 1:3], rows[:, 3:5]
+    boxes = np.hstack([centers - sizes / 2, centers + sizes / 2])
+    scores = rows[:, 5] if width >= 6 else np.ones(len(rows))
+    return boxes, rows[:, 0].astype(np.int16), scores.astype(np.float32)
+
+
+class Annotations:
+    """
+    Boxes of any number of tiles in flat arrays: boxes (N, 4) x1, y1, x2, y2, class_ids (N,),
+    scores (N,) (1 for ground truth) and tile_ids (N,) indexing tiles (tile stems) and sizes
+    ((T, 2) width, height of each tile). Boxes are in pixels of their tile or, with space
+    "yolo", normalized to [0, 1]; conversions between the two and to other tile sizes are one
+    array operation over every box. Rows are kept grouped by tile, so tile(name) is a slice.
+    """
+
+    def __init__(self, boxes, class_ids, tiles, tile_ids=None, sizes=None, scores=None, space="pixel",
+                 class_names=CLASS_NAMES):
+        if space not in SPACES:
+            raise ValueError(f"Unknown coordinate space: {space}")
+        self.boxes = np.asarray(boxes, dtype=COLUMNS["boxes"]).reshape(-1, 4)
+        count = len(self.boxes)
+        self.class_ids = np.asarray(class_ids, dtype=COLUMNS["class_ids"]).reshape(count)
+        self.tiles = list(tiles)
+        self.tile_ids = (np.zeros(count, dtype=COLUMNS["tile_ids"]) if tile_ids is None
+                         else np.asarray(tile_ids, dtype=COLUMNS["tile_ids"]).reshape(count))
+        self.scores = (np.ones(count, dtype=COLUMNS["scores"]) if scores is None
+                       else np.asarray(scores, dtype=COLUMNS["scores"]).reshape(count))
+        self.sizes = (np.zeros((len(self.tiles), 2), dtype=COLUMNS["sizes"]) if sizes is None
+                      else np.asarray(sizes, dtype=COLUMNS["sizes"]).reshape(len(self.tiles), 2))
+        self.space = space
+        self.class_names = tuple(class_names)
+        if count and np.any(np.diff(self.tile_ids) < 0):
+            order = np.argsort(self.tile_ids, kind="stable")
+            self.boxes, self.class_ids = self.boxes[order], self.class_ids[order]
+            self.tile_ids, self.scores = self.tile_ids[order], self.scores[order]
+        self.offsets = np.searchsorted(self.tile_ids, np.arange(len(self.tiles) + 1))
+        self.lookup = {name: i for i, name in enumerate(self.tiles)}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __repr__(self):
+        return f"Annotations({len(self)} boxes, {len(self.tiles)} tiles, {self.space})"
+
+    def copy_with(self, **columns):
+        fields = dict(boxes=self.boxes, class_ids=self.class_ids, tiles=self.tiles, tile_ids=self.tile_ids,
+                      sizes=self.sizes, scores=self.scores, space=self.space, class_names=self.class_names)
+        fields.update(columns)
+        return Annotations(**fields)
+
+    def counts(self):
+        """
+        Boxes per tile, (T,).
+        """
+        return np.diff(self.offsets)
+
+    def tile(self, name):
+        """
+        Annotations of one tile (by stem or index); the arrays are views into this container.
+        """
+        i = self.lookup[name] if isinstance(name, str) else int(name)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return Annotations(self.boxes[start:stop], self.class_ids[start:stop], [self.tiles[i]], None,
+                           self.sizes[i:i + 1], self.scores[start:stop], self.space, self.class_names)
+
+    def select(self, mask):
+        mask = np.asarray(mask)
+        return self.copy_with(boxes=self.boxes[mask], class_ids=self.class_ids[mask], tile_ids=self.tile_ids[mask],
+                              scores=self.scores[mask])
+
+    def of_class(self, class_name_or_id):
+        if isinstance(class_name_or_id, str):
+            if class_name_or_id not in self.class_names:
+                return self.select(np.zeros(len(self), dtype=bool))
+            class_name_or_id = self.class_names.index(class_name_or_id)
+        return self.select(self.class_ids == class_name_or_id)
+
+    def with_class_names(self, class_names):
+        """
+        The same boxes with class ids indexing class_names, which must hold every name of this container.
+        """
+        class_names = tuple(class_names)
+        if class_names[:len(self.class_names)] == self.class_names:
+            return self.copy_with(class_names=class_names)
+        remap = np.array([class_names.index(name) for name in self.class_names], dtype=COLUMNS["class_ids"])
+        known = (self.class_ids >= 0) & (self.class_ids < len(remap))
+        class_ids = np.where(known, remap[np.clip(self.class_ids, 0, max(len(remap) - 1, 0))], self.class_ids)
+        return self.copy_with(class_ids=class_ids, class_names=class_names)
+
+    def box_sizes(self):
+        """
+        (N, 4) width, height, width, height of each box's tile, to scale boxes in one multiply.
+        """
+        sizes = self.sizes[self.tile_ids].astype(float)
+        if len(sizes) and not sizes.all():
+            raise ValueError("Tile sizes are needed to convert between pixel and YOLO coordinates")
+        return np.tile(sizes, 2)
+
+    def to_yolo(self):
+        if self.space == "yolo":
+            return self
+        return self.copy_with(boxes=self.boxes / self.box_sizes(), space="yolo")
+
+    def to_pixel(self):
+        if self.space == "pixel":
+            return self
+        return self.copy_with(boxes=self.boxes * self.box_sizes(), space="pixel")
+
+    def resized(self, width, height):
+        """
+        Pixel boxes after resizing every tile to width x height, e.g. (1024, 1024) for YOLO
+        or (1280, 512) for the app display.
+        """
+        boxes = self.to_yolo().boxes * np.array([width, height, width, height], dtype=float)
+        sizes = np.tile(np.array([[width, height]], dtype=COLUMNS["sizes"]), (len(self.tiles), 1))
+        return self.copy_with(boxes=boxes, sizes=sizes, space="pixel")
+
+    def xywh(self):
+        """
+        (N, 4) x_center, y_center, width, height in the container's space.
+        """
+        return np.hstack([(self.boxes[:, :2] + self.boxes[:, 2:]) / 2, self.boxes[:, 2:] - self.boxes[:, :2]])
+
+    def rectangles(self):
+        """
+        [(x1, y1, x2, y2, class name)] with integer pixel coordinates, as the app keeps them.
+        """
+        boxes = np.rint(self.to_pixel().boxes).astype(int).tolist()
+        names = [self.class_names[i] if 0 <= i < len(self.class_names) else str(i) for i in self.class_ids.tolist()]
+        return [tuple(box) + (name,) for box, name in zip(boxes, names)]
+
+    def coords_text(self):
+        return "".join(f"{x1},{y1},{x2},{y2},{name}\n" for x1, y1, x2, y2, name in self.rectangles())
+
+    def yolo_text(self, class_ids=None):
+        """
+        YOLO label lines, centers and sizes clipped to [0, 1]; class_ids optionally renumbers,
+        e.g. {1: 0} to train on hyaline membranes alone.
+        """
+        ids = self.class_ids.tolist() if class_ids is None else [class_ids[i] for i in self.class_ids.tolist()]
+        rows = np.clip(self.to_yolo().xywh(), 0, 1).tolist()
+        return "\n".join(f"{i} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for i, (x, y, w, h) in zip(ids, rows))
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        One container out of per-tile ones, tile ids renumbered in order.
+        """
+        parts = list(parts)
+        if not parts:
+            return cls(np.zeros((0, 4)), np.zeros(0), [])
+        shift = np.cumsum([0] + [len(part.tiles) for part in parts[:-1]])
+        space = parts[0].space
+        parts = [part if part.space == space else (part.to_yolo() if space == "yolo" else part.to_pixel())
+                 for part in parts]
+        class_names = parts[0].class_names
+        for part in parts[1:]:
+            class_names = extend_class_names(class_names, part.class_names)
+        parts = [part.with_class_names(class_names) for part in parts]
+        return cls(np.concatenate([part.boxes for part in parts]),
+                   np.concatenate([part.class_ids for part in parts]),
+                   [name for part in parts for name in part.tiles],
+                   np.concatenate([part.tile_ids + offset for part, offset in zip(parts, shift)]),
+                   np.concatenate([part.sizes for part in parts]),
+                   np.concatenate([part.scores for part in parts]), space, class_names)
+
+    @classmethod
+    def from_coords_file(cls, path, width=0, height=0, default_class="Neutrophils"):
+        """
+        App _coords.txt, pixel boxes; width and height of the tile are only needed for YOLO conversions.
+        """
+        with open(path, "r") as f:
+            boxes, ids, class_names = parse_coords_text(f.read(), default_class)
+        name = os.path.basename(path)
+        name = name[:-len("_coords.txt")] if name.endswith("_coords.txt") else os.path.splitext(name)[0]
+        return cls(boxes, ids, [name], sizes=[(width, height)], class_names=class_names)
+
+    @classmethod
+    def from_yolo_file(cls, path, width=0, height=0):
+        """
+        YOLO label file, normalized boxes; to_pixel needs the tile's width and height.
+        """
+        with open(path, "r") as f:
+            boxes, ids, scores = parse_yolo_text(f.read())
+        return cls(boxes, ids, [os.path.splitext(os.path.basename(path))[0]], sizes=[(width, height)],
+                   scores=scores, space="yolo")
+
+    @classmethod
+    def load_dir(cls, directory, format="yolo", sizes=None, recursive=True):
+        """
+        Every label file under directory in one container, tiles in sorted path order. format is
+        "yolo" (*.txt) or "coords" (*_coords.txt). sizes is one (width, height) for all tiles or
+        {tile stem: (width, height)}.
+        """
+        suffix = "_coords.txt" if format == "coords" else ".txt"
+        paths = []
+        for folder, _, files in os.walk(directory):
+            paths += [os.path.join(folder, name) for name in files if name.endswith(suffix)]
+            if not recursive:
+                break
+        paths.sort()
+
+        tiles, texts = [], []
+        for path in paths:
+            name = os.path.basename(path)
+            tiles.append(name[:-len(suffix)] if format == "coords" else os.path.splitext(name)[0])
+            with open(path, "r") as f:
+                texts.append(f.read())
+        if sizes is None:
+            tile_sizes = np.zeros((len(tiles), 2))
+        elif isinstance(sizes, dict):
+            tile_sizes = np.array([sizes.get(name, (0, 0)) for name in tiles]).reshape(-1, 2)
+        else:
+            tile_sizes = np.tile(np.asarray(sizes).reshape(1, 2), (len(tiles), 1))
+
+        class_names = CLASS_NAMES
+        if format == "coords":
+            # each file extends the names seen so far, so earlier ids stay valid
+            parsed = []
+            for text in texts:
+                parsed.append(parse_coords_text(text, class_names=class_names))
+                class_names = parsed[-1][2]
+            boxes = [p[0] for p in parsed]
+            ids = [p[1] for p in parsed]
+            scores = [np.ones(len(p[0])) for p in parsed]
+            space = "pixel"
+        else:
+            parsed = [parse_yolo_text(text) for text in texts]
+            boxes, ids, scores = [p[0] for p in parsed], [p[1] for p in parsed], [p[2] for p in parsed]
+            space = "yolo"
+        counts = [len(b) for b in boxes]
+        return cls(np.concatenate(boxes) if boxes else np.zeros((0, 4)),
+                   np.concatenate(ids) if ids else np.zeros(0), tiles,
+                   np.repeat(np.arange(len(tiles)), counts), tile_sizes,
+                   np.concatenate(scores) if scores else np.zeros(0), space, class_names)
+
+    def save(self, directory):
+        """
+        One .npy per column plus meta.json, so load(mmap=True) maps the arrays instead of reading them.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for column in COLUMNS:
+            temp_path = os.path.join(directory, column + ".part.npy")
+            np.save(temp_path, getattr(self, column))
+            os.replace(temp_path, os.path.join(directory, column + ".npy"))
+        meta = {"space": self.space, "class_names": list(self.class_names), "tiles": self.tiles}
+        temp_path = os.path.join(directory, META_FILE + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(directory, META_FILE))
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, META_FILE), "r") as f:
+            meta = json.load(f)
+        columns = {column: np.load(os.path.join(directory, column + ".npy"), mmap_mode="r" if mmap else None)
+                   for column in COLUMNS}
+        return cls(tiles=meta["tiles"], space=meta["space"], class_names=meta["class_names"], **columns)
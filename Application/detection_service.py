@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CLASS_NAMES = {0: "Neutrophils"}
+YOLO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Yolo")
+
+
+def onnx_detector(onnx_path, imgsz=1024, conf=0.25, iou=0.7, threads=None, batch_size=8):
+    """
+    Detector callable backed by Yolo/onnx_inference.OnnxDetector: list of BGR arrays -> list of
+    (boxes, scores, classes) in image pixels. Images are squashed to imgsz x imgsz like the
+    training tiles.
+    """
+    sys.path.append(YOLO_DIR)
+    from onnx_inference import OnnxDetector, squashed
+
+    return squashed(OnnxDetector(onnx_path, imgsz, conf, iou, threads=threads, batch_size=batch_size).predict, imgsz)
+
+
+def ultralytics_detector(weights_path, imgsz=1024, conf=0.25, iou=0.7, device=None):
+    sys.path.append(YOLO_DIR)
+    from onnx_inference import squashed
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+
+    def detect(images):
+        results = model.predict(source=list(images), imgsz=imgsz, conf=conf, iou=iou, device=device, verbose=False)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy().astype(int))
+                for r in results]
+
+    return squashed(detect, imgsz)
+
+
+def format_detections(boxes, classes, class_names=CLASS_NAMES):
+    """
+    One "x1,y1,x2,y2,class" line per box, the format of the app's _coords.txt files.
+    """
+    lines = []
+    for box, cls in zip(np.asarray(boxes).reshape(-1, 4), classes):
+        x1, y1, x2, y2 = (int(round(float(v))) for v in box)
+        lines.append(f"{x1},{y1},{x2},{y2},{class_names.get(int(cls), str(int(cls)))}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def parse_detections(text):
+    rectangles = []
+    for line in text.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) == 5:
+            x1, y1, x2, y2 = map(int, parts[:4])
+            rectangles.append((x1, y1, x2, y2, parts[4]))
+    return rectangles
+
+
+class PendingRequest:
+    def __init__(self, image):
+        self.image = image
+        self.arrived = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """
+    Collects concurrent requests into one detector call. A batch is run as soon as it holds
+    max_batch images or its oldest request has waited max_wait_ms, so a lone request pays at
+    most max_wait_ms extra and a burst of requests shares one forward pass.
+    """
+
+    def __init__(self, detect, max_batch=8, max_wait_ms=10):
+        self.detect = detect
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "batches": 0, "images_batched": 0, "batch_sizes": {},
+                      "queue_ms_total": 0.0, "inference_ms_total": 0.0, "latency_ms": []}
+        self.started = time.time()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, image, timeout=None):
+        """
+        Detections of one BGR image, (boxes, scores, classes); blocks until its batch is done.
+        """
+        request = PendingRequest(image)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Detection request timed out")
+        latency_ms = (time.perf_counter() - request.arrived) * 1000
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["latency_ms"].append(latency_ms)
+            del self.stats["latency_ms"][:-1000]
+            if request.error is not None:
+                self.stats["errors"] += 1
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = batch[0].arrived + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            start = time.perf_counter()
+            try:
+                results = self.detect([request.image for request in batch])
+            except Exception as e:
+                results = None
+                for request in batch:
+                    request.error = e
+            inference_ms = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.stats["batches"] += 1
+                self.stats["images_batched"] += len(batch)
+                self.stats["batch_sizes"][len(batch)] = self.stats["batch_sizes"].get(len(batch), 0) + 1
+                self.stats["queue_ms_total"] += sum((start - request.arrived) * 1000 for request in batch)
+                self.stats["inference_ms_total"] += inference_ms
+            for i, request in enumerate(batch):
+                if results is not None:
+                    request.result = results[i]
+                request.done.set()
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats, batch_sizes=dict(self.stats["batch_sizes"]), latency_ms=list(self.stats["latency_ms"]))
+        latency = np.array(stats.pop("latency_ms"))
+        batches = max(stats["batches"], 1)
+        stats["mean_batch_size"] = stats["images_batched"] / batches
+        stats["mean_queue_ms"] = stats.pop("queue_ms_total") / max(stats["images_batched"], 1)
+        stats["mean_inference_ms"] = stats.pop("inference_ms_total") / batches
+        for q in (50, 95, 99):
+            stats[f"latency_p{q}_ms"] = float(np.percentile(latency, q)) if len(latency) else 0.0
+        stats["queued"] = self.requests.qsize()
+        stats["uptime_sec"] = time.time() - self.started
+        stats["max_batch"] = self.max_batch
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect with an encoded PNG/JPEG body -> text/plain "x1,y1,x2,y2,class" lines.
+    GET /metrics -> JSON request and batch statistics. GET /health -> "ok".
+    """
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/detect":
+            return self.reply(404, "Not found\n")
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        if image is None:
+            return self.reply(400, "Body is not a decodable image\n")
+        try:
+            boxes, _, classes = self.server.batcher.submit(image, self.server.request_timeout)
+        except Exception as e:
+            return self.reply(500, f"Detection failed: {e}\n")
+        self.reply(200, format_detections(boxes, classes, self.server.class_names))
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self.reply(200, json.dumps(self.server.batcher.metrics(), indent=2) + "\n", "application/json")
+        elif path == "/health":
+            self.reply(200, "ok\n")
+        else:
+            self.reply(404, "Not found\n")
+
+    def reply(self, status, body, content_type="text/plain"):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(detect, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=8, max_wait_ms=10, request_timeout=60,
+                class_names=CLASS_NAMES):
+    server = ThreadingHTTPServer((host, port), DetectionHandler)
+    server.daemon_threads = True
+    server.batcher = DynamicBatcher(detect, max_batch, max_wait_ms)
+    server.request_timeout = request_timeout
+    server.class_names = class_names
+    return server
+
+
+class DetectionClient:
+    """
+    Client used by the app: detect(image_path) -> [(x1, y1, x2, y2, class name)].
+    """
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def detect_bytes(self, data):
+        request = urllib.request.Request(self.url + "/detect", data=data, method="POST",
+                                         headers={"Content-Type": "application/octet-stream"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return parse_detections(response.read().decode("utf-8"))
+
+    def detect(self, image_path):
+        with open(image_path, "rb") as f:
+            return self.detect_bytes(f.read())
+
+    def metrics(self):
+        with urllib.request.urlopen(self.url + "/metrics", timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def available(self):
+        try:
+            with urllib.request.urlopen(self.url + "/health", timeout=2) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local neutrophil detection service with dynamic batching.")
+    parser.add_argument("model", help="Exported .onnx model, or .pt weights (needs ultralytics)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--imgsz", type=int, default=1024)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="Latency budget for filling a batch")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--device", default=None)
+    args = parser.parse_args()
+
+    if args.model.endswith(".onnx"):
+        detect = onnx_detector(args.model, args.imgsz, args.conf, threads=args.threads, batch_size=args.max_batch)
+    else:
+        detect = ultralytics_detector(args.model, args.imgsz, args.conf, device=args.device)
+    server = make_server(detect, args.host, args.port, args.max_batch, args.max_wait_ms)
+    print(f"Serving {args.model} on http://{args.host}:{args.port} (POST /detect, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Application"))
+from annotations import Annotations
+from derivatives import file_hash, stat_signature, get_derivative
+
+MANIFEST_FILE = "conversion_manifest.json"
+
+
+def convert_to_yolo_format(x0, y0, x1, y1, img_width, img_height):
+    """
+    Convert (x0, y0, x1, y1) to YOLO format (x_center, y_center, width, height).
+    Coordinates are normalized to [0, 1].
+    """
+    x_center = (x0 + x1) / 2 / img_width
+    y_center = (y0 + y1) / 2 / img_height
+    width = (x1 - x0) / img_width
+    height = (y1 - y0) / img_height
+
+    x_center = max(0, min(1, x_center))
+    y_center = max(0, min(1, y_center))
+    width = max(0, min(1, width))
+    height = max(0, min(1, height))
+
+    return x_center, y_center, width, height
+
+
+def process_file(coord_file_path, tile_image_path, resized_subfolder_path, generated_subfolder_path,
+                 yolo_labels_subfolder_path, image_size=(1024, 1024), derivative_cache_dir=None):
+    """
+    Write the YOLO label, resized tile and mask for one coordinates file. Returns the paths written.
+    With derivative_cache_dir the resized tile is copied from the derivative cache, so the
+    full-resolution tile is only decoded once for all sizes.
+    """
+    base_name = os.path.basename(coord_file_path)[:-11]
+    with Image.open(tile_image_path) as img:
+        orig_w, orig_h = img.size
+        mask = np.zeros((orig_h, orig_w), dtype=np.uint8)
+        labels = Annotations.from_coords_file(coord_file_path, orig_w, orig_h)
+        line_count = len(labels)
+        for x0, y0, x1, y1, _ in labels.rectangles():
+            mask[y0:y1, x0:x1] = 255
+
+        # every box is a neutrophil for the detector, whatever feature it was drawn as
+        yolo_label_path = os.path.join(yolo_labels_subfolder_path, f"{base_name}_{line_count}.txt")
+        with open(yolo_label_path, "w") as yolo_file:
+            yolo_file.write(labels.copy_with(class_ids=np.zeros(line_count)).yolo_text())
+
+        mask_resized = Image.fromarray(mask).resize(image_size, Image.NEAREST)
+
+        resized_tile_path = os.path.join(resized_subfolder_path, f"{base_name}_{line_count}.png")
+        if derivative_cache_dir is not None:
+            shutil.copyfile(get_derivative(tile_image_path, image_size, derivative_cache_dir), resized_tile_path)
+        else:
+            img.resize(image_size).save(resized_tile_path)
+        output_file_path = os.path.join(generated_subfolder_path, f"{base_name}_mask_{line_count}.png")
+        mask_resized.save(output_file_path)
+    return [yolo_label_path, resized_tile_path, output_file_path]
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def find_pairs(path_to_tiles, path_to_coords):
+    """
+    Yield (key, coord_file_path, tile_image_path, subfolder) for every <observer>/<mouse>/*_coords.txt
+    that has a matching tile, mirroring the folder layout of the tiles.
+    """
+    for observer_folder in sorted(os.listdir(path_to_tiles)):
+        observer_path = os.path.join(path_to_tiles, observer_folder)
+        if not os.path.isdir(observer_path):
+            continue
+        for mouse_folder in sorted(os.listdir(observer_path)):
+            if not os.path.isdir(os.path.join(observer_path, mouse_folder)):
+                continue
+            subfolder = os.path.join(observer_folder, mouse_folder)
+            coords_subfolder_path = os.path.join(path_to_coords, subfolder)
+            tiles_subfolder_path = os.path.join(path_to_tiles, subfolder)
+            if not os.path.exists(coords_subfolder_path):
+                print(f"Skipping {subfolder} because no corresponding coordinates folder exists.")
+                continue
+            for coord_file in sorted(os.listdir(coords_subfolder_path)):
+                if not coord_file.endswith("_coords.txt"):
+                    continue
+                tile_image_path = os.path.join(tiles_subfolder_path, coord_file[:-11] + ".png")
+                if not os.path.exists(tile_image_path):
+                    print(f"Skipping {tile_image_path} because the corresponding tile image does not exist.")
+                    continue
+                yield os.path.join(subfolder, coord_file), os.path.join(coords_subfolder_path, coord_file), tile_image_path, subfolder
+
+
+def convert_all(path_to_tiles, path_to_coords, generated_dir, resized_tiles_dir, yolo_labels_dir,
+                image_size=(1024, 1024), workers=None, manifest_path=None, derivative_cache_dir=None):
+    """
+    Convert every coordinates/tile pair whose content changed since the last run.
+
+    The manifest stores the sha1 of each _coords.txt and tile (the tile hash is reused while
+    its size and mtime are unchanged), the image_size and the outputs written, so unchanged pairs are skipped
+    and outputs named after an old box count are removed. Returns a summary dict.
+    """
+    manifest_path = manifest_path or os.path.join(yolo_labels_dir, MANIFEST_FILE)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    manifest = load_manifest(manifest_path)
+    summary = {"skipped": 0, "converted": 0, "failed": 0, "empty": 0, "removed": 0}
+    seen = set()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for key, coord_file_path, tile_image_path, subfolder in find_pairs(path_to_tiles, path_to_coords):
+            seen.add(key)
+            entry = manifest.get(key, {})
+            coords_hash = file_hash(coord_file_path)
+            tile_stat = stat_signature(tile_image_path)
+            if entry.get("tile_stat") == tile_stat and "tile_hash" in entry:
+                tile_hash = entry["tile_hash"]
+            else:
+                tile_hash = file_hash(tile_image_path)
+            unchanged = (entry.get("coords_hash") == coords_hash and entry.get("tile_hash") == tile_hash
+                         and entry.get("image_size") == list(image_size))
+            if unchanged and all(os.path.exists(path) for path in entry.get("outputs", [])):
+                entry["tile_stat"] = tile_stat
+                summary["skipped"] += 1
+                continue
+            new_entry = {"coords_hash": coords_hash, "tile_hash": tile_hash, "tile_stat": tile_stat,
+                         "image_size": list(image_size), "outputs": []}
+            if os.path.getsize(coord_file_path) == 0:
+                print(f"Skipping {coord_file_path} because it is empty.")
+                summary["empty"] += 1
+                summary["removed"] += remove_outputs(entry.get("outputs", []))
+                manifest[key] = new_entry
+                continue
+
+            output_dirs = [os.path.join(root, subfolder) for root in (resized_tiles_dir, generated_dir, yolo_labels_dir)]
+            for output_dir in output_dirs:
+                os.makedirs(output_dir, exist_ok=True)
+            future = executor.submit(process_file, coord_file_path, tile_image_path, *output_dirs, image_size,
+                                     derivative_cache_dir)
+            futures[future] = (key, entry, new_entry)
+
+        try:
+            for future in as_completed(futures):
+                key, entry, new_entry = futures[future]
+                try:
+                    new_entry["outputs"] = future.result()
+                except Exception as e:
+                    print(f"Failed to convert {key}: {e}")
+                    summary["failed"] += 1
+                    continue
+                stale = [path for path in entry.get("outputs", []) if path not in new_entry["outputs"]]
+                summary["removed"] += remove_outputs(stale)
+                manifest[key] = new_entry
+                summary["converted"] += 1
+        finally:
+            save_manifest(manifest, manifest_path)
+
+    for key in [key for key in manifest if key not in seen]:
+        summary["removed"] += remove_outputs(manifest.pop(key).get("outputs", []))
+    save_manifest(manifest, manifest_path)
+    return summary
+
+
+def remove_outputs(paths):
+    removed = 0
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally convert _coords.txt annotations to masks, resized tiles and YOLO labels.")
+    parser.add_argument("--tiles", default="~/Documents/Code/Lung_Injury/Tiles/")
+    parser.add_argument("--coords", default="~/Documents/Code/Lung_Injury/Coordinates/")
+    parser.add_argument("--generated", default="~/Documents/Code/Lung_Injury/Generated_Masks")
+    parser.add_argument("--resized", default="~/Documents/Code/Lung_Injury/Resized_Tiles")
+    parser.add_argument("--yolo-labels", default="~/Documents/Code/Lung_Injury/YOLO_Labels")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--derivative-cache", default=None, help="Reuse resized tiles from this derivative cache")
+    args = parser.parse_args()
+
+    derivative_cache_dir = os.path.expanduser(args.derivative_cache) if args.derivative_cache else None
+    summary = convert_all(os.path.expanduser(args.tiles), os.path.expanduser(args.coords),
+                          os.path.expanduser(args.generated), os.path.expanduser(args.resized),
+                          os.path.expanduser(args.yolo_labels), (args.size, args.size), args.workers,
+                          derivative_cache_dir=derivative_cache_dir)
+    print(f"Skipped {summary['skipped']}, converted {summary['converted']}, failed {summary['failed']}, "
+          f"empty {summary['empty']}, removed {summary['removed']} stale outputs")
+
+
+if __name__ == "__main__":
+    main()
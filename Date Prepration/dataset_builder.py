@@ -0,0 +1,153 @@
+import os
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+IMAGES_FILE = "images.u8"
+LABELS_FILE = "labels.npy"
+META_FILE = "meta.json"
+METADATA_FILE = "metadata.csv"
+
+LABEL_NAMES = {"low": 0, "high": 1}
+
+
+def label_from_filename(file_name):
+    """
+    "..._low.png" / "..._high.png" -> 0 / 1, "..._<count>.png" -> count.
+    """
+    token = os.path.splitext(os.path.basename(file_name))[0].split("_")[-1]
+    if token in LABEL_NAMES:
+        return LABEL_NAMES[token]
+    return int(token)
+
+
+def collect_inputs(input_dir, extensions=(".png", ".jpg", ".jpeg")):
+    inputs = []
+    for subfolder in sorted(os.listdir(input_dir)):
+        subfolder_path = os.path.join(input_dir, subfolder)
+        if not os.path.isdir(subfolder_path):
+            continue
+        for root, _, files in os.walk(subfolder_path):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(extensions):
+                    inputs.append((os.path.join(root, file_name), subfolder))
+    return inputs
+
+
+def decode_into(images_path, shape, start, paths):
+    """
+    Decode and resize paths into rows start.. of the on-disk array. Returns indices that failed.
+    """
+    images = np.memmap(images_path, dtype=np.uint8, mode="r+", shape=shape)
+    height, width = shape[1], shape[2]
+    failed = []
+    for offset, path in enumerate(paths):
+        try:
+            with Image.open(path) as img:
+                img = img.convert("RGB")
+                if img.size != (width, height):
+                    img = img.resize((width, height))
+                images[start + offset] = np.asarray(img)
+        except (OSError, ValueError):
+            failed.append(start + offset)
+    images.flush()
+    del images
+    return failed
+
+
+def build_dataset(input_dir, output_dir, image_size=(256, 256), label_fn=label_from_filename,
+                  workers=None, chunk_size=64):
+    """
+    Build a uint8 (N, H, W, 3) image array on disk plus labels and per-image metadata.
+
+    Inputs are counted first so the array is allocated once; worker processes decode and
+    resize straight into it. Images that fail to decode, or whose file name label_fn cannot
+    read a label from (ValueError), count as failed and are compacted out at the end.
+    """
+    inputs = collect_inputs(input_dir)
+    if not inputs:
+        raise FileNotFoundError(f"No images found in {input_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    width, height = image_size
+    shape = (len(inputs), height, width, 3)
+    images_path = os.path.join(output_dir, IMAGES_FILE)
+    images = np.memmap(images_path, dtype=np.uint8, mode="w+", shape=shape)
+    del images
+
+    paths = [path for path, _ in inputs]
+    labels = {}
+    unlabeled = set()
+    for i, path in enumerate(paths):
+        try:
+            labels[i] = label_fn(path)
+        except ValueError:
+            unlabeled.add(i)
+    failed = set(unlabeled)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(decode_into, images_path, shape, start, paths[start:start + chunk_size])
+                   for start in range(0, len(paths), chunk_size)]
+        for future in futures:
+            failed.update(future.result())
+
+    keep = [i for i in range(len(inputs)) if i not in failed]
+    if failed:
+        images = np.memmap(images_path, dtype=np.uint8, mode="r+", shape=shape)
+        for new_index, old_index in enumerate(keep):
+            if new_index != old_index:
+                images[new_index] = images[old_index]
+        images.flush()
+        del images
+        with open(images_path, "r+b") as f:
+            f.truncate(len(keep) * height * width * 3)
+        for i in sorted(failed):
+            if i in unlabeled:
+                print(f"Skipping image without a label in its file name: {paths[i]}")
+            else:
+                print(f"Skipping image that could not be decoded: {paths[i]}")
+
+    labels = np.array([labels[i] for i in keep], dtype=np.int32)
+    np.save(os.path.join(output_dir, LABELS_FILE), labels)
+    with open(os.path.join(output_dir, METADATA_FILE), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["index", "path", "subfolder", "label"])
+        for new_index, old_index in enumerate(keep):
+            path, subfolder = inputs[old_index]
+            writer.writerow([new_index, path, subfolder, labels[new_index]])
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump({"shape": [len(keep), height, width, 3], "dtype": "uint8", "input_dir": input_dir}, f, indent=2)
+    return len(keep), len(failed)
+
+
+def open_dataset(dataset_dir):
+    """
+    Open a built dataset without copying: images is a read-only uint8 memmap.
+    Convert batches to float with images[i:j] / 255.0 only when they are used.
+    """
+    with open(os.path.join(dataset_dir, META_FILE), "r") as f:
+        meta = json.load(f)
+    images = np.memmap(os.path.join(dataset_dir, IMAGES_FILE), dtype=np.uint8, mode="r", shape=tuple(meta["shape"]))
+    labels = np.load(os.path.join(dataset_dir, LABELS_FILE), mmap_mode="r")
+    with open(os.path.join(dataset_dir, METADATA_FILE), "r", newline="") as f:
+        metadata = list(csv.DictReader(f))
+    return images, labels, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a memory-mapped uint8 image dataset from tile folders.")
+    parser.add_argument("input_dir", help="Folder of per-slide subfolders, e.g. Generated")
+    parser.add_argument("output_dir")
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    count, failed = build_dataset(args.input_dir, args.output_dir, (args.width, args.height), workers=args.workers)
+    print(f"Wrote {count} images to {args.output_dir} ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# 1024x1024 for YOLO, 256x256 for the low/high classifier, 1280x512 for the annotation app display
+DEFAULT_SIZES = [(1024, 1024), (256, 256), (1280, 512)]
+# bumped when derivatives are made differently, so stale cached files are not reused
+DERIVATIVE_VERSION = 2
+
+_hashes = {}
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def source_hash(source_path):
+    key = (os.path.abspath(source_path), tuple(stat_signature(source_path)))
+    digest = _hashes.get(key)
+    if digest is None:
+        digest = file_hash(source_path)
+        _hashes[key] = digest
+    return digest
+
+
+def derivative_path(cache_dir, digest, size):
+    width, height = size
+    return os.path.join(cache_dir, digest[:2], f"{digest}_{width}x{height}_v{DERIVATIVE_VERSION}.png")
+
+
+def plan_pyramid(sizes):
+    """
+    Order the target sizes largest first and pick, for each one, the smallest already
+    produced image with the same aspect ratio that is at least as large (or the source), so
+    every size is squashed from the source exactly once. Returns [(size, parent_size_or_None)].
+    """
+    plan = []
+    produced = []
+    for size in sorted(set(map(tuple, sizes)), key=lambda s: s[0] * s[1], reverse=True):
+        parents = [p for p in produced if p[0] >= size[0] and p[1] >= size[1] and p[0] * size[1] == p[1] * size[0]]
+        parent = min(parents, key=lambda p: p[0] * p[1]) if parents else None
+        plan.append((size, parent))
+        produced.append(size)
+    return plan
+
+
+def generate_derivatives(source_path, sizes=DEFAULT_SIZES, cache_dir="Derivatives", compress_level=1):
+    """
+    Decode source_path once and write every missing size into the cache.
+    Returns {size: derivative path}.
+    """
+    digest = source_hash(source_path)
+    paths = {tuple(size): derivative_path(cache_dir, digest, size) for size in sizes}
+    missing = [size for size, path in paths.items() if not os.path.exists(path)]
+    if not missing:
+        return paths
+
+    os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok=True)
+    with Image.open(source_path) as source:
+        source = source.convert("RGB")
+        images = {}
+        for size, parent in plan_pyramid(paths.keys()):
+            base = images[parent] if parent is not None else source
+            images[size] = base.resize(size) if base.size != size else base
+            if size in missing:
+                temp_path = paths[size] + f".{os.getpid()}.tmp"
+                images[size].save(temp_path, format="PNG", compress_level=compress_level)
+                os.replace(temp_path, paths[size])
+    return paths
+
+
+def get_derivative(source_path, size, cache_dir="Derivatives", sizes=DEFAULT_SIZES):
+    """
+    Path of source_path resized to size. On a miss, all of `sizes` are produced in the same pass.
+    """
+    path = derivative_path(cache_dir, source_hash(source_path), size)
+    if os.path.exists(path):
+        return path
+    wanted = list(sizes) if tuple(size) in map(tuple, sizes) else list(sizes) + [tuple(size)]
+    return generate_derivatives(source_path, wanted, cache_dir)[tuple(size)]
+
+
+def generate_all(source_paths, sizes=DEFAULT_SIZES, cache_dir="Derivatives", workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_derivatives, path, sizes, cache_dir) for path in source_paths]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode each tile once and cache every derived resolution.")
+    parser.add_argument("tiles_dir", help="Folder searched recursively for .png tiles")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--size", action="append", default=None, help="WIDTHxHEIGHT, may be repeated")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    sizes = [tuple(map(int, s.split("x"))) for s in args.size] if args.size else DEFAULT_SIZES
+    source_paths = [os.path.join(root, f) for root, _, files in os.walk(args.tiles_dir) for f in files if f.endswith(".png")]
+    generate_all(source_paths, sizes, args.cache_dir, args.workers)
+    print(f"Cached {len(sizes)} sizes for {len(source_paths)} tiles in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
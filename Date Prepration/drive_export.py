@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Application"))
+from annotations import Annotations, CLASS_NAMES, class_id
+from derivatives import stat_signature
+
+LEDGER_FILE = "export_ledger.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+class LocalSource:
+    """
+    The app's Drive layout on disk, for offline runs and tests: output_root/<observer>/<mouse>/
+    holds *_coords.txt and final tiles, input_root/<mouse>/ the raw tiles.
+    """
+
+    def __init__(self, output_root, input_root):
+        self.output_root = output_root
+        self.input_root = input_root
+
+    def list_outputs(self):
+        for observer in sorted(subfolders(self.output_root)):
+            for mouse in sorted(subfolders(os.path.join(self.output_root, observer))):
+                folder = os.path.join(self.output_root, observer, mouse)
+                for name in sorted(os.listdir(folder)):
+                    yield self.entry(os.path.join(folder, name), observer=observer, mouse=mouse, name=name)
+
+    def list_inputs(self):
+        for mouse in sorted(subfolders(self.input_root)):
+            folder = os.path.join(self.input_root, mouse)
+            for name in sorted(os.listdir(folder)):
+                yield self.entry(os.path.join(folder, name), mouse=mouse, name=name)
+
+    def entry(self, path, **fields):
+        size, mtime_ns = stat_signature(path)
+        return dict(fields, id=path, version=f"{size}:{mtime_ns}")
+
+    def download(self, entry, destination_path):
+        shutil.copyfile(entry["id"], destination_path)
+
+
+class DriveSource:
+    """
+    The app's output folder (<observer>/<mouse>/ with *_coords.txt and final tiles) and input
+    folder (<mouse>/ with raw tiles) on Google Drive. Each download thread gets its own client,
+    since a Drive service object must not be shared between threads.
+    """
+
+    def __init__(self, service_account_file, output_folder_id, input_folder_id,
+                 scopes=("https://www.googleapis.com/auth/drive",)):
+        self.service_account_file = service_account_file
+        self.output_folder_id = output_folder_id
+        self.input_folder_id = input_folder_id
+        self.scopes = list(scopes)
+        self.local = threading.local()
+
+    def service(self):
+        if not hasattr(self.local, "service"):
+            from oauth2client.service_account import ServiceAccountCredentials
+            from googleapiclient.discovery import build
+
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.service_account_file, self.scopes)
+            self.local.service = build("drive", "v3", credentials=credentials, cache_discovery=False)
+        return self.local.service
+
+    def children(self, folder_id, folders):
+        query = f"'{folder_id}' in parents and trashed=false and mimeType{'=' if folders else '!='}'{FOLDER_MIME}'"
+        page_token = None
+        while True:
+            response = self.service().files().list(
+                q=query, pageSize=1000, pageToken=page_token,
+                fields="nextPageToken, files(id, name, md5Checksum, modifiedTime)").execute()
+            yield from response.get("files", [])
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
+    def entry(self, item, **fields):
+        return dict(fields, name=item["name"], id=item["id"], version=item.get("md5Checksum") or item["modifiedTime"])
+
+    def list_outputs(self):
+        for observer in self.children(self.output_folder_id, folders=True):
+            for mouse in self.children(observer["id"], folders=True):
+                for item in self.children(mouse["id"], folders=False):
+                    yield self.entry(item, observer=observer["name"], mouse=mouse["name"])
+
+    def list_inputs(self):
+        for mouse in self.children(self.input_folder_id, folders=True):
+            for item in self.children(mouse["id"], folders=False):
+                yield self.entry(item, mouse=mouse["name"])
+
+    def download(self, entry, destination_path):
+        from googleapiclient.http import MediaIoBaseDownload
+
+        request = self.service().files().get_media(fileId=entry["id"])
+        with open(destination_path, "wb") as fh:
+            downloader = MediaIoBaseDownload(fh, request, chunksize=16 * 1024 * 1024)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
+
+
+def subfolders(path):
+    return [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]
+
+
+def load_ledger(ledger_path):
+    if not os.path.exists(ledger_path):
+        return {}
+    with open(ledger_path, "r") as f:
+        return json.load(f)
+
+
+def save_ledger(ledger, ledger_path):
+    temp_path = ledger_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(ledger, f, indent=1, sort_keys=True)
+    os.replace(temp_path, ledger_path)
+
+
+def plan_files(source, include_final=True):
+    """
+    {relative path under export_root: source entry} for every file the export mirrors:
+    Coordinates/<observer>/<mouse>/*_coords.txt, Final/<observer>/<mouse>/<tile> for the
+    app's annotated tiles, and Source/<mouse>/<tile> for each raw tile that has annotations.
+    """
+    files = {}
+    annotated = set()
+    for entry in source.list_outputs():
+        name = entry["name"]
+        if name.endswith("_coords.txt"):
+            files[os.path.join("Coordinates", entry["observer"], entry["mouse"], name)] = entry
+            annotated.add((entry["mouse"], name[:-len("_coords.txt")]))
+        elif include_final and name.lower().endswith(IMAGE_EXTENSIONS):
+            files[os.path.join("Final", entry["observer"], entry["mouse"], name)] = entry
+    for entry in source.list_inputs():
+        stem, extension = os.path.splitext(entry["name"])
+        if extension.lower() in IMAGE_EXTENSIONS and (entry["mouse"], stem) in annotated:
+            files[os.path.join("Source", entry["mouse"], entry["name"])] = entry
+    return files
+
+
+def fetch(source, entry, destination_path):
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    temp_path = destination_path + ".part"
+    source.download(entry, temp_path)
+    os.replace(temp_path, destination_path)
+    return destination_path
+
+
+def write_yolo_label(coord_file_path, tile_path, label_path, classes=("Neutrophils",)):
+    """
+    YOLO label of one _coords.txt against its raw tile; only the given classes, numbered in that order.
+    """
+    with Image.open(tile_path) as img:
+        width, height = img.size
+    labels = Annotations.from_coords_file(coord_file_path, width, height)
+    renumber = {class_id(name, labels.class_names): i for i, name in enumerate(classes)}
+    labels = labels.select(np.isin(labels.class_ids, list(renumber)))
+    os.makedirs(os.path.dirname(label_path), exist_ok=True)
+    with open(label_path, "w") as f:
+        f.write(labels.yolo_text(renumber))
+    return label_path
+
+
+def link_or_copy(source_path, target_path):
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+def outdated(target_path, input_paths):
+    """
+    Whether target_path is missing or older than any of the files it is built from.
+    """
+    if not os.path.exists(target_path):
+        return True
+    return os.stat(target_path).st_mtime_ns < max(os.stat(path).st_mtime_ns for path in input_paths)
+
+
+def build_datasets(export_root, ledger, changed, classes=("Neutrophils",)):
+    """
+    Refresh the per-observer views of the mirrored files for every annotation whose coordinates
+    or raw tile changed in this run, or whose views are missing or older than their inputs (an
+    earlier run that stopped after saving the ledger): Tiles/<observer>/<mouse>/<tile> (the
+    layout convert_all expects) and YOLO/<observer>/{images,labels}/<mouse>/ (the layout
+    folds.write_folds expects).
+    """
+    sources = {}
+    for path in ledger:
+        if path.startswith("Source" + os.sep):
+            _, mouse, name = path.split(os.sep)
+            sources[(mouse, os.path.splitext(name)[0])] = path
+    written = 0
+    for path in ledger:
+        if not path.startswith("Coordinates" + os.sep):
+            continue
+        _, observer, mouse, coord_name = path.split(os.sep)
+        stem = coord_name[:-len("_coords.txt")]
+        source_path = sources.get((mouse, stem))
+        if source_path is None:
+            continue
+        tile_name = os.path.basename(source_path)
+        raw_tile = os.path.join(export_root, source_path)
+        coord_file = os.path.join(export_root, path)
+        yolo_root = os.path.join(export_root, "YOLO", observer)
+        tiles_path = os.path.join(export_root, "Tiles", observer, mouse, tile_name)
+        image_path = os.path.join(yolo_root, "images", mouse, tile_name)
+        label_path = os.path.join(yolo_root, "labels", mouse, stem + ".txt")
+        if (path not in changed and source_path not in changed and not outdated(tiles_path, [raw_tile])
+                and not outdated(image_path, [raw_tile]) and not outdated(label_path, [coord_file, raw_tile])):
+            continue
+        link_or_copy(raw_tile, tiles_path)
+        link_or_copy(raw_tile, image_path)
+        write_yolo_label(coord_file, raw_tile, label_path, classes)
+        written += 1
+    return written
+
+
+def derived_paths(path):
+    """
+    Files build_datasets made from a mirrored _coords.txt, removed with it.
+    """
+    if not path.startswith("Coordinates" + os.sep):
+        return []
+    _, observer, mouse, coord_name = path.split(os.sep)
+    stem = coord_name[:-len("_coords.txt")]
+    paths = [os.path.join("YOLO", observer, "labels", mouse, stem + ".txt")]
+    for extension in IMAGE_EXTENSIONS:
+        paths += [os.path.join("Tiles", observer, mouse, stem + extension),
+                  os.path.join("YOLO", observer, "images", mouse, stem + extension)]
+    return paths
+
+
+def export_annotations(source, export_root, workers=8, include_final=True, classes=("Neutrophils",), save_every=50):
+    """
+    Mirror every observer's annotations into export_root and build the training layouts.
+
+    export_ledger.json keeps the source version (Drive md5, or size and mtime for a local
+    source) of each mirrored file, so only new or modified files are downloaded; files gone from
+    the source are deleted along with what was built from them. Downloads run in workers threads
+    and the ledger is saved as they finish, so an interrupted export resumes where it stopped.
+    Returns a summary dict.
+    """
+    os.makedirs(export_root, exist_ok=True)
+    ledger_path = os.path.join(export_root, LEDGER_FILE)
+    ledger = load_ledger(ledger_path)
+    files = plan_files(source, include_final)
+    summary = {"listed": len(files), "downloaded": 0, "unchanged": 0, "failed": 0, "removed": 0, "labels": 0}
+
+    pending = {}
+    for path, entry in files.items():
+        known = ledger.get(path)
+        if known and known["version"] == entry["version"] and os.path.exists(os.path.join(export_root, path)):
+            summary["unchanged"] += 1
+        else:
+            pending[path] = entry
+
+    changed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, source, entry, os.path.join(export_root, path)): path
+                   for path, entry in pending.items()}
+        try:
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Failed to download {path}: {e}")
+                    summary["failed"] += 1
+                    continue
+                ledger[path] = {"id": pending[path]["id"], "version": pending[path]["version"]}
+                changed.add(path)
+                summary["downloaded"] += 1
+                if summary["downloaded"] % save_every == 0:
+                    save_ledger(ledger, ledger_path)
+        finally:
+            save_ledger(ledger, ledger_path)
+
+    for path in [path for path in ledger if path not in files]:
+        for local_path in [path] + derived_paths(path):
+            full_path = os.path.join(export_root, local_path)
+            if os.path.exists(full_path):
+                os.remove(full_path)
+                summary["removed"] += 1
+        del ledger[path]
+    save_ledger(ledger, ledger_path)
+
+    summary["labels"] = build_datasets(export_root, ledger, changed, tuple(classes))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally export all observers' annotations into local training layouts.")
+    parser.add_argument("export_root", help="e.g. ~/Documents/Code/Lung_Injury/Export")
+    parser.add_argument("--local-output", default=None, help="Local copy of the output folder instead of Drive")
+    parser.add_argument("--local-input", default=None, help="Local copy of the input folder instead of Drive")
+    parser.add_argument("--service-account", default="../Application/lunginsightcloud-fa31002e7988.json")
+    parser.add_argument("--output-folder-id", default="1XrfiMR4nLvKb2kx7MiwwBfdZlpOmT9ub")
+    parser.add_argument("--input-folder-id", default="1kTVr2h11XlnV3xntxjZbPNZebJ8vr5SX")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--classes", nargs="+", default=["Neutrophils"], choices=CLASS_NAMES,
+                        help="Classes written to the YOLO labels, numbered in this order")
+    parser.add_argument("--no-final", action="store_true", help="Skip the app's annotated tiles")
+    args = parser.parse_args()
+
+    if args.local_output:
+        source = LocalSource(os.path.expanduser(args.local_output), os.path.expanduser(args.local_input))
+    else:
+        source = DriveSource(os.path.expanduser(args.service_account), args.output_folder_id, args.input_folder_id)
+    summary = export_annotations(source, os.path.expanduser(args.export_root), args.workers, not args.no_final,
+                                 args.classes)
+    print(f"Listed {summary['listed']}, downloaded {summary['downloaded']}, unchanged {summary['unchanged']}, "
+          f"failed {summary['failed']}, removed {summary['removed']}, labels rebuilt {summary['labels']}")
+
+
+if __name__ == "__main__":
+    main()
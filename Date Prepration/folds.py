@@ -0,0 +1,133 @@
+import os
+import random
+import shutil
+import argparse
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def collect_images(images_root):
+    """
+    Return {group: [absolute image paths]} where the group is the mouse/slide subfolder.
+    Images directly in images_root each form their own group.
+    """
+    groups = {}
+    for entry in sorted(os.listdir(images_root)):
+        entry_path = os.path.abspath(os.path.join(images_root, entry))
+        if os.path.isdir(entry_path):
+            paths = []
+            for root, _, files in os.walk(entry_path):
+                paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+            if paths:
+                groups[entry] = sorted(paths)
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            groups[entry] = [entry_path]
+    return groups
+
+
+def assign_folds(groups, k, seed=42):
+    """
+    Group k-fold: whole groups go to one fold, largest groups first into the fold with the
+    fewest images so folds stay balanced. With k == number of groups this is leave-one-group-out.
+    """
+    names = sorted(groups)
+    random.Random(seed).shuffle(names)
+    names.sort(key=lambda name: len(groups[name]), reverse=True)
+    folds = [[] for _ in range(k)]
+    sizes = [0] * k
+    for name in names:
+        fold = sizes.index(min(sizes))
+        folds[fold].append(name)
+        sizes[fold] += len(groups[name])
+    return folds
+
+
+def labels_root_for(images_root):
+    parts = images_root.split(os.sep)
+    index = len(parts) - 1 - parts[::-1].index("images")
+    parts[index] = "labels"
+    return os.sep.join(parts)
+
+
+def link_tree(paths, images_root, fold_path, split, mode):
+    labels_root = labels_root_for(images_root)
+    for kind in ("images", "labels"):
+        shutil.rmtree(os.path.join(fold_path, kind, split), ignore_errors=True)
+    for path in paths:
+        relative = os.path.relpath(path, images_root)
+        label_relative = os.path.splitext(relative)[0] + ".txt"
+        pairs = [(path, os.path.join(fold_path, "images", split, relative)),
+                 (os.path.join(labels_root, label_relative), os.path.join(fold_path, "labels", split, label_relative))]
+        for source, target in pairs:
+            if not os.path.exists(source):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            if mode == "symlink":
+                os.symlink(source, target)
+            else:
+                os.link(source, target)
+
+
+def write_folds(dataset_path, output_root, k=7, seed=42, mode="list", class_names=("neutrophil",),
+                fold_name="dataset_fold_{fold}", yaml_name="neutrophils_fold_{fold}.yaml", images_subdir="images"):
+    """
+    Create per-fold train/test splits of <dataset_path>/<images_subdir> without copying any image.
+
+    mode "list" writes train.txt / test.txt with absolute image paths (YOLO finds each label
+    by swapping /images/ for /labels/); "symlink" and "hardlink" build the usual
+    images/{train,test} and labels/{train,test} trees out of links. Returns the YAML paths.
+    """
+    images_root = os.path.abspath(os.path.join(dataset_path, images_subdir))
+    groups = collect_images(images_root)
+    if len(groups) < k:
+        raise ValueError(f"Need at least {k} groups in {images_root} for {k} folds, found {len(groups)}")
+    folds = assign_folds(groups, k, seed)
+
+    yaml_paths = []
+    for fold in range(1, k + 1):
+        fold_path = os.path.abspath(os.path.join(output_root, fold_name.format(fold=fold)))
+        os.makedirs(fold_path, exist_ok=True)
+        test_groups = folds[fold - 1]
+        test_paths = [p for group in test_groups for p in groups[group]]
+        train_paths = [p for group in sorted(groups) if group not in test_groups for p in groups[group]]
+
+        if mode == "list":
+            for split, paths in (("train", train_paths), ("test", test_paths)):
+                with open(os.path.join(fold_path, f"{split}.txt"), "w") as f:
+                    f.write("\n".join(paths) + "\n")
+            train_entry, test_entry = "train.txt", "test.txt"
+        elif mode in ("symlink", "hardlink"):
+            for split, paths in (("train", train_paths), ("test", test_paths)):
+                link_tree(paths, images_root, fold_path, split, mode)
+            train_entry, test_entry = "images/train", "images/test"
+        else:
+            raise ValueError(f"Unknown fold mode: {mode}")
+
+        names = "\n".join(f"  {i}: {name}" for i, name in enumerate(class_names))
+        yaml_path = os.path.join(fold_path, yaml_name.format(fold=fold))
+        with open(yaml_path, "w") as f:
+            f.write(f"path: {fold_path}\ntrain: {train_entry}\nval: {test_entry}\ntest: {test_entry}\n\nnames:\n{names}\n")
+        test_names = ", ".join(test_groups) if len(test_groups) <= 5 else f"{len(test_groups)} groups"
+        print(f"Fold {fold}: test on {test_names} ({len(test_paths)} images), train on {len(train_paths)} images")
+        yaml_paths.append(yaml_path)
+    return yaml_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write k-fold splits as file lists or link trees instead of copies.")
+    parser.add_argument("dataset_path", help="Folder with images/<mouse>/ and labels/<mouse>/")
+    parser.add_argument("output_root")
+    parser.add_argument("-k", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=["list", "symlink", "hardlink"], default="list")
+    parser.add_argument("--images-subdir", default="images", help="e.g. images/train for a flat dataset")
+    args = parser.parse_args()
+
+    write_folds(os.path.expanduser(args.dataset_path), os.path.expanduser(args.output_root), args.k, args.seed, args.mode,
+                images_subdir=args.images_subdir)
+
+
+if __name__ == "__main__":
+    main()
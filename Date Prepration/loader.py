@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from derivatives import stat_signature
+
+
+def parse_filename(filename):
+    base_name = os.path.basename(filename)
+    count = int(base_name.split("_")[-1].split(".")[0])
+    return count
+
+
+def decode_image(image_path, image_size):
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")
+        if img.size != image_size:
+            img = img.resize(image_size)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def decode_mask(mask_path, image_size):
+    with Image.open(mask_path) as mask:
+        mask = mask.convert("L")
+        if mask.size != image_size:
+            mask = mask.resize(image_size, Image.NEAREST)
+        return np.asarray(mask, dtype=np.uint8)[..., np.newaxis]
+
+
+def to_float(batch):
+    return batch.astype(np.float32) / 255.0
+
+
+class SampleCache:
+    """
+    uint8 on-disk copy of decoded, resized samples, filled in as samples are first read.
+    Keyed by the path list and size, so a different dataset gets its own cache folder. The
+    size and mtime of every image and mask are kept next to the filled flags; a sample whose
+    files were rewritten since (e.g. by convert_all) is decoded again.
+    """
+
+    def __init__(self, cache_dir, image_paths, mask_paths, image_size):
+        key = hashlib.sha1(json.dumps([image_paths, mask_paths, list(image_size)]).encode()).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        width, height = image_size
+        count = len(image_paths)
+        self.filled_path = os.path.join(self.cache_dir, "filled.npy")
+        self.signatures_path = os.path.join(self.cache_dir, "signatures.npy")
+        files = [image_paths] if mask_paths is None else [image_paths, mask_paths]
+        self.signatures = np.array([sum((stat_signature(paths[i]) for paths in files), []) for i in range(count)],
+                                   dtype=np.int64).reshape(count, 2 * len(files))
+        exists = os.path.exists(self.filled_path)
+        mode = "r+" if exists else "w+"
+        self.images = np.memmap(os.path.join(self.cache_dir, "images.u8"), dtype=np.uint8, mode=mode,
+                                shape=(count, height, width, 3))
+        self.masks = None
+        if mask_paths is not None:
+            self.masks = np.memmap(os.path.join(self.cache_dir, "masks.u8"), dtype=np.uint8, mode=mode,
+                                   shape=(count, height, width, 1))
+        self.filled = np.load(self.filled_path) if exists else np.zeros(count, dtype=bool)
+        if exists:
+            previous = np.load(self.signatures_path) if os.path.exists(self.signatures_path) else None
+            if previous is None or previous.shape != self.signatures.shape:
+                self.filled[:] = False
+            else:
+                self.filled &= (previous == self.signatures).all(axis=1)
+
+    def flush(self):
+        self.images.flush()
+        if self.masks is not None:
+            self.masks.flush()
+        np.save(self.signatures_path, self.signatures)
+        np.save(self.filled_path, self.filled)
+
+
+class StreamingLoader:
+    """
+    Batches of (images, masks, targets) as uint8 arrays, decoded by a thread pool and
+    prefetched `prefetch` batches ahead. The shuffle order depends only on seed and epoch.
+    Use to_float() on a batch when the model needs [0, 1] floats.
+    """
+
+    def __init__(self, image_paths, mask_paths=None, targets=None, batch_size=16, image_size=None,
+                 cache_dir=None, workers=None, prefetch=4, shuffle=True, seed=0, drop_last=False):
+        if mask_paths is not None and len(mask_paths) != len(image_paths):
+            raise ValueError(f"Mismatch between number of images ({len(image_paths)}) and masks ({len(mask_paths)})")
+        self.image_paths = list(image_paths)
+        self.mask_paths = list(mask_paths) if mask_paths is not None else None
+        self.targets = np.asarray(targets, dtype=np.float32) if targets is not None else None
+        self.batch_size = batch_size
+        if image_size is None:
+            with Image.open(self.image_paths[0]) as img:
+                image_size = img.size
+        self.image_size = tuple(image_size)
+        self.workers = workers or os.cpu_count()
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.cache = SampleCache(cache_dir, self.image_paths, self.mask_paths, self.image_size) if cache_dir else None
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.image_paths) // self.batch_size
+        return (len(self.image_paths) + self.batch_size - 1) // self.batch_size
+
+    def order(self, epoch):
+        if not self.shuffle:
+            return np.arange(len(self.image_paths))
+        return np.random.default_rng([self.seed, epoch]).permutation(len(self.image_paths))
+
+    def load_sample(self, index):
+        cache = self.cache
+        if cache is not None and cache.filled[index]:
+            image = np.array(cache.images[index])
+            mask = np.array(cache.masks[index]) if cache.masks is not None else None
+            return image, mask
+        image = decode_image(self.image_paths[index], self.image_size)
+        mask = decode_mask(self.mask_paths[index], self.image_size) if self.mask_paths is not None else None
+        if cache is not None:
+            cache.images[index] = image
+            if mask is not None:
+                cache.masks[index] = mask
+            cache.filled[index] = True
+        return image, mask
+
+    def load_batch(self, executor, indices):
+        samples = list(executor.map(self.load_sample, indices))
+        images = np.stack([image for image, _ in samples])
+        masks = np.stack([mask for _, mask in samples]) if self.mask_paths is not None else None
+        targets = self.targets[indices] if self.targets is not None else None
+        return images, masks, targets
+
+    def iter_epoch(self, epoch):
+        order = self.order(epoch)
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+
+        ready = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for indices in batches:
+                        if stop.is_set():
+                            return
+                        ready.put(self.load_batch(executor, indices))
+                ready.put(done)
+            except Exception as e:
+                ready.put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            while producer.is_alive():
+                try:
+                    ready.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if self.cache is not None:
+                self.cache.flush()
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        return self.iter_epoch(epoch)
+
+
+def benchmark(loader, epochs=2, as_float=True):
+    """
+    Print samples/sec for each epoch; with a cache the second epoch shows the warm rate.
+    """
+    rates = []
+    for epoch in range(epochs):
+        start = time.time()
+        samples = 0
+        for images, masks, targets in loader:
+            if as_float:
+                images = to_float(images)
+            samples += len(images)
+        rate = samples / (time.time() - start)
+        rates.append(rate)
+        print(f"Epoch {epoch + 1}: {samples} samples, {rate:.1f} samples/sec")
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming tile/mask loader.")
+    parser.add_argument("image_dir")
+    parser.add_argument("mask_dir", nargs="?")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--size", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--epochs", type=int, default=2)
+    args = parser.parse_args()
+
+    image_paths = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir) if f.endswith(".png"))
+    mask_paths = None
+    if args.mask_dir:
+        mask_paths = sorted(os.path.join(args.mask_dir, f) for f in os.listdir(args.mask_dir) if f.endswith(".png"))
+    counts = [parse_filename(f) for f in image_paths]
+    image_size = (args.size, args.size) if args.size else None
+    loader = StreamingLoader(image_paths, mask_paths, counts, batch_size=args.batch_size, image_size=image_size,
+                             cache_dir=args.cache_dir, workers=args.workers, prefetch=args.prefetch)
+    benchmark(loader, args.epochs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import glob
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from results_store import quadratic_kappa
+
+NUM_CLASSES = 3
+TRUE_COLUMN = "label_groundtruth"
+PRED_COLUMN = "label_prediction"
+OBSERVER_COLUMNS = ("Label – 1", "Label – 2")
+
+
+def confusion_matrix(y_true, y_pred, num_classes=NUM_CLASSES):
+    cells = np.asarray(y_true) * num_classes + np.asarray(y_pred)
+    return np.bincount(cells, minlength=num_classes ** 2).reshape(num_classes, num_classes)
+
+
+def metrics(confusion):
+    """
+    QWK, MSE, accuracy and per-class true/predicted counts for a stack of (..., K, K) confusion matrices.
+    """
+    confusion = np.asarray(confusion, dtype=float)
+    k = confusion.shape[-1]
+    total = confusion.sum(axis=(-2, -1))
+    squared_error = (np.arange(k)[:, None] - np.arange(k)[None, :]) ** 2
+    result = {
+        "qwk": quadratic_kappa(confusion),
+        "mse": (squared_error * confusion).sum(axis=(-2, -1)) / total,
+        "accuracy": np.trace(confusion, axis1=-2, axis2=-1) / total,
+    }
+    for c in range(k):
+        result[f"true_{c}"] = confusion[..., c, :].sum(axis=-1)
+        result[f"pred_{c}"] = confusion[..., :, c].sum(axis=-1)
+    return result
+
+
+def resample_confusions(confusion, resamples=10000, seed=0):
+    """
+    Bootstrap confusion matrices. Resampling n tiles with replacement only changes how many
+    tiles fall in each cell, so each resample is one multinomial draw over the K*K cells:
+    (resamples, K, K) at a cost independent of the number of tiles.
+    """
+    confusion = np.asarray(confusion)
+    n = int(confusion.sum())
+    counts = np.random.default_rng(seed).multinomial(n, confusion.ravel() / n, size=resamples)
+    return counts.reshape((resamples,) + confusion.shape)
+
+
+def intervals(samples, point, alpha=0.05):
+    rows = {}
+    for name, values in samples.items():
+        values = np.asarray(values, dtype=float)
+        if np.isnan(values).all():
+            low = high = np.nan
+        else:
+            low, high = np.nanpercentile(values, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+        rows[name] = {"estimate": float(point[name]), "low": float(low), "high": float(high)}
+    return rows
+
+
+def bootstrap_ci(y_true, y_pred, resamples=10000, alpha=0.05, seed=0, num_classes=NUM_CLASSES):
+    """
+    Point estimate and percentile interval of every metric. Returns {metric: {estimate, low, high}}.
+    """
+    confusion = confusion_matrix(y_true, y_pred, num_classes)
+    return intervals(metrics(resample_confusions(confusion, resamples, seed)), metrics(confusion), alpha)
+
+
+def paired_bootstrap(pair_a, pair_b, resamples=10000, alpha=0.05, seed=0, num_classes=NUM_CLASSES):
+    """
+    Interval of metric(a) - metric(b) where a and b are (y_true, y_pred) on the same tiles, e.g.
+    two models against one label set, or the model against observer 1 and against observer 2.
+
+    Tiles are resampled jointly through a multinomial over the K**4 combined cells, so both
+    confusion matrices of a resample come from the same tiles.
+    """
+    k = num_classes
+    (true_a, pred_a), (true_b, pred_b) = pair_a, pair_b
+    cells = ((np.asarray(true_a) * k + np.asarray(pred_a)) * k + np.asarray(true_b)) * k + np.asarray(pred_b)
+    joint = np.bincount(cells, minlength=k ** 4)
+    n = int(joint.sum())
+    draws = np.random.default_rng(seed).multinomial(n, joint / n, size=resamples).reshape(resamples, k, k, k, k)
+    samples_a = metrics(draws.sum(axis=(3, 4)))
+    samples_b = metrics(draws.sum(axis=(1, 2)))
+    point_a = metrics(joint.reshape(k, k, k, k).sum(axis=(2, 3)))
+    point_b = metrics(joint.reshape(k, k, k, k).sum(axis=(0, 1)))
+    difference = {name: samples_a[name] - samples_b[name] for name in samples_a}
+    point = {name: point_a[name] - point_b[name] for name in point_a}
+    rows = intervals(difference, point, alpha)
+    for name, values in difference.items():
+        # share of resamples where a is not better than b (for error metrics, not worse)
+        rows[name]["p_le_zero"] = float(np.mean(values <= 0))
+    return rows
+
+
+def read_labels(csv_path):
+    """
+    (y_true, y_pred) pairs in one CSV: model vs ground truth for output_metrics / Res.csv files,
+    observer 1 vs observer 2 for InterVar.csv. Returns {comparison name: (names, y_true, y_pred)}.
+    """
+    frame = pd.read_csv(csv_path, encoding="utf-8-sig")
+    pairs = {}
+    if TRUE_COLUMN in frame and PRED_COLUMN in frame:
+        pairs["model_vs_labels"] = (frame["name"].to_numpy(), frame[TRUE_COLUMN].to_numpy(), frame[PRED_COLUMN].to_numpy())
+    if all(column in frame for column in OBSERVER_COLUMNS):
+        pairs["observer_1_vs_2"] = (frame["name"].to_numpy(), frame[OBSERVER_COLUMNS[0]].to_numpy(),
+                                    frame[OBSERVER_COLUMNS[1]].to_numpy())
+    return pairs
+
+
+def bootstrap_directory(csv_dir, resamples=10000, alpha=0.05, seed=0):
+    """
+    Intervals for every run (and the observer agreement) in csv_dir as one DataFrame.
+    """
+    records = []
+    for csv_path in sorted(glob.glob(os.path.join(csv_dir, "*.csv"))):
+        for comparison, (_, y_true, y_pred) in read_labels(csv_path).items():
+            for metric, row in bootstrap_ci(y_true, y_pred, resamples, alpha, seed).items():
+                records.append(dict(row, run=os.path.basename(csv_path), comparison=comparison, metric=metric,
+                                    tiles=len(y_true)))
+    return pd.DataFrame(records, columns=["run", "comparison", "tiles", "metric", "estimate", "low", "high"])
+
+
+def compare_runs(csv_a, csv_b, resamples=10000, alpha=0.05, seed=0):
+    """
+    Paired intervals of run a minus run b on the tiles both runs scored.
+    """
+    names_a, true_a, pred_a = read_labels(csv_a)["model_vs_labels"]
+    names_b, true_b, pred_b = read_labels(csv_b)["model_vs_labels"]
+    common, index_a, index_b = np.intersect1d(names_a, names_b, return_indices=True)
+    return paired_bootstrap((true_a[index_a], pred_a[index_a]), (true_b[index_b], pred_b[index_b]),
+                            resamples, alpha, seed), len(common)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals for tile severity-score metrics.")
+    parser.add_argument("paths", nargs="+", help="A folder of CSVs, or two CSVs with --compare")
+    parser.add_argument("--compare", action="store_true", help="Paired difference of the two given runs")
+    parser.add_argument("--resamples", type=int, default=10000)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", default=None)
+    args = parser.parse_args()
+
+    if args.compare:
+        rows, tiles = compare_runs(args.paths[0], args.paths[1], args.resamples, args.alpha, args.seed)
+        table = pd.DataFrame(rows).T
+        print(f"{os.path.basename(args.paths[0])} - {os.path.basename(args.paths[1])} on {tiles} common tiles")
+    else:
+        table = pd.concat([bootstrap_directory(path, args.resamples, args.alpha, args.seed) for path in args.paths],
+                          ignore_index=True)
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(table.round(4).to_string())
+    if args.csv:
+        table.to_csv(args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,41 @@
 import os
+import sys
 import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-observer1_dir = "labels_O1/Healthy/"
-observer2_dir = "labels_O2/Healthy/"
-intersection_dir = "Intersection_Labels/Healthy"
-union_dir = "Union_Labels/Healthy"
+import numpy as np
 
-# print(os.listdir(observer1_dir))
-# os.makedirs(intersection_dir, exist_ok=True)
-# os.makedirs(union_dir, exist_ok=True)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Application"))
+from annotations import Annotations
 
-def calculate_iou(box1, box2):
-    x1_1, y1_1, x2_1, y2_1 = box1
-    x1_2, y1_2, x2_2, y2_2 = box2
+OUTPUT_DIRS = {"intersection": "Intersection_Labels", "union": "Union_Labels", "majority": "Majority_Labels"}
+SUMMARY_FILE = "consensus_summary.csv"
 
-    x1 = max(x1_1, x1_2)
-    y1 = max(y1_1, y1_2)
-    x2 = min(x2_1, x2_2)
-    y2 = min(y2_1, y2_2)
-    intersection_area = max(0, x2 - x1) * max(0, y2 - y1)
 
-    box1_area = (x2_1 - x1_1) * (y2_1 - y1_1)
-    box2_area = (x2_2 - x1_2) * (y2_2 - y1_2)
-    union_area = box1_area + box2_area - intersection_area
+def iou_matrix(boxes1, boxes2):
+    """
+    Pairwise IoU between (N, 4) and (M, 4) arrays of x1, y1, x2, y2 boxes.
+    """
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    intersection_area = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union_area = area1[:, None] + area2[None, :] - intersection_area
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union_area > 0, intersection_area / union_area, 0.0)
 
-    iou = intersection_area / union_area if union_area > 0 else 0
-    return iou
 
 def get_prefix(file_name):
     parts = file_name.split('_')
     if len(parts) >= 3:
-        return '_'.join(parts[:3])  
+        return '_'.join(parts[:3])
     return file_name
 
+
 def to_yolo_format(box, class_id=0):
     x1, y1, x2, y2 = box
     x_center = (x1 + x2) / 2
@@ -41,90 +44,146 @@ def to_yolo_format(box, class_id=0):
     height = y2 - y1
     return [class_id, x_center, y_center, width, height]
 
-observer1_files = os.listdir(observer1_dir)
-observer2_files = os.listdir(observer2_dir)
-
-
-observer1_by_prefix = {get_prefix(f): f for f in observer1_files}
-observer2_by_prefix = {get_prefix(f): f for f in observer2_files}
-
-
-common_prefixes = set(observer1_by_prefix.keys()).intersection(observer2_by_prefix.keys())
-print(f"Found {len(common_prefixes)} common prefixes between observers.")
-
-
-for prefix in common_prefixes:
-    observer1_file = observer1_by_prefix[prefix]
-    observer2_file = observer2_by_prefix[prefix]
-    observer1_path = os.path.join(observer1_dir, observer1_file)
-    observer2_path = os.path.join(observer2_dir, observer2_file)
-
-
-    observer1_boxes = []
-    with open(observer1_path, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            class_id, x_center, y_center, width, height = map(float, line.strip().split())
-            x1 = (x_center - width / 2)
-            y1 = (y_center - height / 2)
-            x2 = (x_center + width / 2)
-            y2 = (y_center + height / 2)
-            observer1_boxes.append([x1, y1, x2, y2])
-
-
-    observer2_boxes = []
-    with open(observer2_path, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            class_id, x_center, y_center, width, height = map(float, line.strip().split())
-            x1 = (x_center - width / 2)
-            y1 = (y_center - height / 2)
-            x2 = (x_center + width / 2)
-            y2 = (y_center + height / 2)
-            observer2_boxes.append([x1, y1, x2, y2])
-
-
-    intersection_boxes = []
-    matched_o2_boxes = [False] * len(observer2_boxes)
-
-    for o1_box in observer1_boxes:
-        best_iou = 0.1  
-        best_match = None
-
-        for i, o2_box in enumerate(observer2_boxes):
-            if not matched_o2_boxes[i]:
-                iou = calculate_iou(o1_box, o2_box)
-                if iou > best_iou:
-                    best_iou = iou
-                    best_match = o2_box
-                    matched_idx = i
-
-        if best_match is not None:
-
-            avg_box = [
-                (o1_box[0] + best_match[0]) / 2,
-                (o1_box[1] + best_match[1]) / 2,
-                (o1_box[2] + best_match[2]) / 2,
-                (o1_box[3] + best_match[3]) / 2
-            ]
-            intersection_boxes.append(avg_box)
-            matched_o2_boxes[matched_idx] = True
-
-    union_boxes = observer1_boxes.copy()
-    for i, o2_box in enumerate(observer2_boxes):
-        if not matched_o2_boxes[i]:  
-            union_boxes.append(o2_box)
-
-    intersection_path = os.path.join(intersection_dir, f"{prefix}.txt")
-    with open(intersection_path, "w") as f:
-        for box in intersection_boxes:
-            yolo_box = to_yolo_format(box)
-            f.write(f"{yolo_box[0]} {yolo_box[1]} {yolo_box[2]} {yolo_box[3]} {yolo_box[4]}\n")
-
-    union_path = os.path.join(union_dir, f"{prefix}.txt")
-    with open(union_path, "w") as f:
-        for box in union_boxes:
-            yolo_box = to_yolo_format(box)
-            f.write(f"{yolo_box[0]} {yolo_box[1]} {yolo_box[2]} {yolo_box[3]} {yolo_box[4]}\n")
-            print(".")
 
+def read_boxes(label_path):
+    """
+    YOLO label file -> (N, 4) array of x1, y1, x2, y2 in normalized coordinates.
+    """
+    return Annotations.from_yolo_file(label_path).boxes.astype(float)
+
+
+def write_boxes(label_path, boxes):
+    with open(label_path, "w") as f:
+        f.write("".join("{} {} {} {} {}\n".format(*to_yolo_format([float(v) for v in box])) for box in boxes))
+
+
+def cluster_boxes(observer_boxes, iou_threshold=0.1):
+    """
+    Greedily match the boxes of each observer in turn to the clusters built so far.
+
+    A box joins the unmatched cluster whose mean box overlaps it most (IoU above the
+    threshold), otherwise it starts a new cluster. Returns a list of clusters, each a
+    list of (observer index, box). The matching runs in the opposite direction from the
+    original two-observer loop, so ties can pair differently; on the committed two-observer
+    labels it reproduces Intersection_Labels and Union_Labels.
+    """
+    clusters = []
+    for observer, boxes in enumerate(observer_boxes):
+        if not len(boxes):
+            continue
+        if not clusters:
+            clusters = [[(observer, box)] for box in boxes]
+            continue
+        means = np.array([np.mean([box for _, box in cluster], axis=0) for cluster in clusters])
+        ious = iou_matrix(boxes, means)
+        matched = np.zeros(len(clusters), dtype=bool)
+        new_clusters = []
+        for i, box in enumerate(boxes):
+            candidates = np.where(matched, 0.0, ious[i])
+            best = int(np.argmax(candidates))
+            if candidates[best] > iou_threshold:
+                clusters[best].append((observer, box))
+                matched[best] = True
+            else:
+                new_clusters.append([(observer, box)])
+        clusters.extend(new_clusters)
+    return clusters
+
+
+def build_tile(label_paths, output_paths, iou_threshold=0.1):
+    """
+    Write the intersection, union and majority labels for one tile. Returns the box counts.
+
+    Intersection and majority boxes are the mean of the matched boxes; union keeps the box of
+    the first observer that drew each cell.
+    """
+    observer_boxes = [read_boxes(path) for path in label_paths]
+    clusters = cluster_boxes(observer_boxes, iou_threshold)
+    num_observers = len(label_paths)
+    consensus = {
+        "intersection": [np.mean([box for _, box in c], axis=0) for c in clusters if len(c) == num_observers],
+        "union": [c[0][1] for c in clusters],
+        "majority": [np.mean([box for _, box in c], axis=0) for c in clusters if 2 * len(c) > num_observers],
+    }
+    for kind, boxes in consensus.items():
+        write_boxes(output_paths[kind], boxes)
+    counts = [len(boxes) for boxes in observer_boxes]
+    return counts + [len(consensus[kind]) for kind in OUTPUT_DIRS]
+
+
+def discover_observers(root_dir, pattern="labels_"):
+    return sorted(os.path.join(root_dir, d) for d in os.listdir(root_dir)
+                  if d.startswith(pattern) and os.path.isdir(os.path.join(root_dir, d)))
+
+
+def discover_classes(observer_dirs):
+    classes = set()
+    for observer_dir in observer_dirs:
+        classes.update(d for d in os.listdir(observer_dir) if os.path.isdir(os.path.join(observer_dir, d)))
+    return sorted(classes)
+
+
+def build_consensus(observer_dirs, output_root=".", classes=None, iou_threshold=0.1, workers=None,
+                    summary_path=None):
+    """
+    Build Intersection/Union/Majority label sets for every class subfolder shared by the
+    observer directories, in one pass over the tiles labelled by all observers.
+    Writes a per-tile summary CSV and returns its rows.
+    """
+    classes = classes or discover_classes(observer_dirs)
+    observer_names = [os.path.basename(os.path.normpath(d)) for d in observer_dirs]
+    jobs = []
+    for class_name in classes:
+        by_prefix = []
+        for observer_dir in observer_dirs:
+            class_dir = os.path.join(observer_dir, class_name)
+            files = os.listdir(class_dir) if os.path.isdir(class_dir) else []
+            by_prefix.append({get_prefix(f[:-4]): os.path.join(class_dir, f) for f in files if f.endswith(".txt")})
+        common_prefixes = sorted(set.intersection(*[set(p) for p in by_prefix]))
+        print(f"{class_name}: found {len(common_prefixes)} tiles labelled by all {len(observer_dirs)} observers.")
+
+        output_dirs = {kind: os.path.join(output_root, name, class_name) for kind, name in OUTPUT_DIRS.items()}
+        for output_dir in output_dirs.values():
+            os.makedirs(output_dir, exist_ok=True)
+        for prefix in common_prefixes:
+            label_paths = [paths[prefix] for paths in by_prefix]
+            output_paths = {kind: os.path.join(d, f"{prefix}.txt") for kind, d in output_dirs.items()}
+            jobs.append((class_name, prefix, label_paths, output_paths))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        counts = executor.map(build_tile, [job[2] for job in jobs], [job[3] for job in jobs],
+                              [iou_threshold] * len(jobs), chunksize=16)
+        rows = [[class_name, prefix] + tile_counts for (class_name, prefix, _, _), tile_counts in zip(jobs, counts)]
+
+    header = ["class", "tile"] + observer_names + list(OUTPUT_DIRS)
+    summary_path = summary_path or os.path.join(output_root, SUMMARY_FILE)
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    for class_name in classes:
+        class_rows = [row for row in rows if row[0] == class_name]
+        totals = np.sum([row[2:] for row in class_rows], axis=0) if class_rows else [0] * (len(header) - 2)
+        print(f"{class_name}: " + ", ".join(f"{name} {int(total)}" for name, total in zip(header[2:], totals)) + " boxes")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build Intersection/Union/Majority consensus labels from several observers.")
+    parser.add_argument("observers", nargs="*", help="Observer label folders (default: every labels_* folder in --root)")
+    parser.add_argument("--root", default=".", help="Folder searched for labels_* observer folders")
+    parser.add_argument("--output-root", default=".")
+    parser.add_argument("--classes", nargs="*", default=None, help="Class subfolders (default: all found)")
+    parser.add_argument("--iou", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    observer_dirs = args.observers or discover_observers(args.root)
+    if len(observer_dirs) < 2:
+        raise SystemExit(f"Need at least two observer folders, found {observer_dirs}")
+    build_consensus(observer_dirs, args.output_root, args.classes, args.iou, args.workers)
+
+
+if __name__ == "__main__":
+    main()
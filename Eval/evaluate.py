@@ -0,0 +1,118 @@
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sweep import read_ground_truth, match_detections
+
+CSV_FIELDS = [
+    "name", "ground truth neutrophils", "predicted neutrophils", "missed",
+    "false_positives", "true_positives", "label_groundtruth", "label_prediction"
+]
+
+
+def get_label(count):
+    if count == 0:
+        return 0
+    elif count < 5:
+        return 1
+    else:
+        return 2
+
+
+def label_path_for(test_labels_dir, image_name):
+    return os.path.join(test_labels_dir, os.path.splitext(image_name)[0] + ".txt")
+
+
+def evaluate_tile(image_name, predicted_boxes, scores, shape, label_path, iou_threshold=0.1):
+    """
+    Metrics row of one tile: each prediction, highest score first, takes the best overlapping
+    unmatched ground truth box as in process_image.
+    """
+    image_height, image_width = shape
+    ground_truth_boxes = read_ground_truth(label_path, image_width, image_height)
+    _, tp, fp = match_detections(predicted_boxes, scores, ground_truth_boxes, iou_threshold, matching="best")
+    true_positives = int(tp.sum())
+    gt_count, pred_count = len(ground_truth_boxes), len(predicted_boxes)
+    return {
+        "name": image_name,
+        "ground truth neutrophils": gt_count,
+        "predicted neutrophils": pred_count,
+        "missed": gt_count - true_positives,
+        "false_positives": int(fp.sum()),
+        "true_positives": true_positives,
+        "label_groundtruth": get_label(gt_count),
+        "label_prediction": get_label(pred_count),
+    }
+
+
+def evaluate_predictions(predictions, test_labels_dir, csv_path=None, iou_threshold=0.1, workers=None, chunksize=64):
+    """
+    Per-tile metrics of cached predictions ({image name: (boxes, scores, shape)}) against one
+    label directory, matched in a process pool. Tiles without a label file are skipped.
+    Nothing is drawn; see visualize(). Returns the rows, also written to csv_path if given.
+    """
+    names = [name for name in sorted(predictions) if os.path.exists(label_path_for(test_labels_dir, name))]
+    args = [(name,) + tuple(predictions[name]) + (label_path_for(test_labels_dir, name),) for name in names]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(evaluate_tile, *zip(*args), [iou_threshold] * len(args), chunksize=chunksize)) if args else []
+
+    if csv_path:
+        with open(csv_path, mode="w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+def totals(rows):
+    return {
+        "total_missed": sum(int(row["missed"]) for row in rows),
+        "total_false_positives": sum(int(row["false_positives"]) for row in rows),
+        "total_true_positives": sum(int(row["true_positives"]) for row in rows),
+    }
+
+
+def worst_tiles(rows, n=20):
+    """
+    Names of the n tiles with the largest absolute count error.
+    """
+    errors = [abs(int(row["predicted neutrophils"]) - int(row["ground truth neutrophils"])) for row in rows]
+    order = np.argsort(errors, kind="stable")[::-1][:n]
+    return [rows[i]["name"] for i in order]
+
+
+def draw_tile(image_path, label_path, predicted_boxes, output_image_path):
+    import cv2
+
+    image = cv2.imread(image_path)
+    image_height, image_width, _ = image.shape
+    ground_truth_boxes = read_ground_truth(label_path, image_width, image_height)
+
+    for gt_box in ground_truth_boxes:
+        cv2.rectangle(image, (int(gt_box[0]), int(gt_box[1])), (int(gt_box[2]), int(gt_box[3])), (0, 255, 0), 4)
+
+    for pred_box in predicted_boxes:
+        center_x = int((pred_box[0] + pred_box[2]) / 2)
+        center_y = int((pred_box[1] + pred_box[3]) / 2)
+        radius = int(min(pred_box[2] - pred_box[0], pred_box[3] - pred_box[1]) / 2)
+        cv2.circle(image, (center_x, center_y), radius, (0, 0, 255), 4)
+
+    text = f"Ground Truth: {len(ground_truth_boxes)}, Predicted: {len(predicted_boxes)}"
+    cv2.putText(image, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2, cv2.LINE_AA)
+    cv2.imwrite(output_image_path, image)
+    return output_image_path
+
+
+def visualize(predictions, test_images_dir, test_labels_dir, output_dir, names, workers=None):
+    """
+    Draw ground truth rectangles and prediction circles for the selected tiles only,
+    e.g. visualize(..., names=worst_tiles(rows, 20)). Returns the written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(draw_tile, os.path.join(test_images_dir, name), label_path_for(test_labels_dir, name),
+                                   predictions[name][0], os.path.join(output_dir, f"output_{name}"))
+                   for name in names]
+        return [future.result() for future in futures]
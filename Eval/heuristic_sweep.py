@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Application"))
+from annotations import Annotations
+from create import iou_matrix
+from prediction_cache import file_hash, list_images
+
+FEATURE_FILE = "features.npz"
+META_FILE = "meta.json"
+FEATURE_VERSION = 1
+LABEL_DIRS = ["labels_O1", "labels_O2", "Intersection_Labels", "Union_Labels", "Majority_Labels"]
+
+# Per-contour columns; the same candidates the app's process_* methods score, before any filtering
+FEATURE_COLUMNS = {
+    "neutrophil": ["area", "circularity", "white", "x1", "y1", "x2", "y2"],
+    "hyaline": ["area", "elongation", "hue", "x1", "y1", "x2", "y2"],
+}
+
+# Constants of calculate_score / process_neutrophils and calculate_hyaline_score / process_hyaline_membranes
+NEUTROPHIL_DEFAULTS = {"area_lo": 100, "area_hi": 1000, "circ_lo": 0.48, "white_lo": 0.05, "w_area": 0.15,
+                       "w_circ": 0.7, "cutoff": 0.15, "min_area": 300, "max_area": 900, "min_circ": 0.5}
+HYALINE_DEFAULTS = {"area_lo": 500, "area_hi": 5000, "elong_lo": 2, "elong_hi": 10, "hue_lo": 140, "hue_hi": 170,
+                    "w_area": 0.4, "w_elong": 0.4, "cutoff": 0.3, "min_area": 500}
+
+NEUTROPHIL_GRID = {
+    "area_lo": [50, 100, 200],
+    "area_hi": [800, 1000, 1500],
+    "circ_lo": [0.4, 0.48, 0.56],
+    "white_lo": [0.05],
+    "w_area": [0.1, 0.15, 0.25],
+    "w_circ": [0.5, 0.7, 0.8],
+    "cutoff": [0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6],
+    "min_area": [200, 300, 400],
+    "max_area": [900, 1200, 2000],
+    "min_circ": [0.4, 0.5, 0.6],
+}
+HYALINE_GRID = {
+    "area_lo": [300, 500, 1000],
+    "area_hi": [3000, 5000, 10000],
+    "elong_lo": [1.5, 2, 3],
+    "elong_hi": [6, 10],
+    "hue_lo": [140, 150],
+    "hue_hi": [160, 170],
+    "w_area": [0.3, 0.4, 0.5],
+    "w_elong": [0.3, 0.4, 0.5],
+    "cutoff": [0.2, 0.3, 0.4, 0.5, 0.6],
+    "min_area": [300, 500, 1000],
+}
+
+
+def neutrophil_features(tile, min_area=50):
+    """
+    Area, circularity and white percentage of every Otsu contour as process_neutrophils computes
+    them, but measured on the undrawn tile and only inside each neighbourhood circle's bounding square.
+    """
+    import cv2
+
+    tile = tile.copy()
+    tile[tile > 220] = 255
+    gray_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray_tile, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    light_areas_mask = cv2.inRange(tile, (200, 200, 200), (255, 255, 255))
+    rows = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        perimeter = cv2.arcLength(contour, True)
+        if perimeter == 0 or area < min_area:
+            continue
+        circularity = 4 * np.pi * (area / (perimeter * perimeter))
+        x, y, w, h = cv2.boundingRect(contour)
+        center_x, center_y = x + w // 2, y + h // 2
+        radius = min(int(1.05 * np.sqrt(area)), center_x, center_y, tile.shape[1] - center_x, tile.shape[0] - center_y)
+        light = light_areas_mask[center_y - radius:center_y + radius + 1, center_x - radius:center_x + radius + 1]
+        circle = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+        cv2.circle(circle, (radius, radius), radius, 255, thickness=-1)
+        circle = circle[:light.shape[0], :light.shape[1]]
+        white = cv2.countNonZero(cv2.bitwise_and(light, light, mask=circle)) / max(cv2.countNonZero(circle), 1)
+        rows.append((area, circularity, white, x, y, x + w, y + h))
+    return np.array(rows, dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS["neutrophil"]))
+
+
+def hyaline_features(tile, min_area=100):
+    """
+    Area, elongation and mean hue of every pink contour as process_hyaline_membranes computes them.
+    """
+    import cv2
+
+    hsv_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)
+    pink_mask = cv2.inRange(hsv_tile, np.array([140, 50, 50]), np.array([170, 255, 255]))
+    kernel = np.ones((5, 5), np.uint8)
+    pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_CLOSE, kernel)
+    pink_mask = cv2.morphologyEx(pink_mask, cv2.MORPH_OPEN, kernel)
+    contours, _ = cv2.findContours(pink_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rows = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        perimeter = cv2.arcLength(contour, True)
+        if area < min_area or perimeter == 0:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        elongation = max(w, h) / min(w, h) if min(w, h) > 0 else 0
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [(contour - [x, y]).astype(np.int32)], -1, 255, thickness=cv2.FILLED)
+        hue = cv2.mean(hsv_tile[y:y + h, x:x + w], mask=mask)[0]
+        rows.append((area, elongation, hue, x, y, x + w, y + h))
+    return np.array(rows, dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS["hyaline"]))
+
+
+def extract_tile(image_path):
+    import cv2
+
+    tile = cv2.imread(image_path)
+    return tile.shape[:2], {"neutrophil": neutrophil_features(tile), "hyaline": hyaline_features(tile)}
+
+
+class FeatureStore:
+    """
+    Columnar contour features of all tiles in one npz: per tile its name, content hash, shape and
+    candidate count per scorer, and the feature rows of all tiles concatenated per scorer.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.entries = {}
+        path = os.path.join(store_dir, FEATURE_FILE)
+        if not os.path.exists(path):
+            return
+        with open(os.path.join(store_dir, META_FILE), "r") as f:
+            if json.load(f).get("version") != FEATURE_VERSION:
+                return
+        with np.load(path) as data:
+            offsets = {kind: np.concatenate([[0], np.cumsum(data[f"{kind}_counts"])]) for kind in FEATURE_COLUMNS}
+            for i, name in enumerate(data["names"]):
+                features = {kind: data[kind][offsets[kind][i]:offsets[kind][i + 1]] for kind in FEATURE_COLUMNS}
+                self.entries[str(name)] = (str(data["hashes"][i]), tuple(data["shapes"][i]), features)
+
+    def update(self, test_images_dir, workers=None):
+        """
+        Extract features of new or changed tiles only. Returns how many tiles were extracted.
+        """
+        paths = list_images(test_images_dir)
+        hashes = {os.path.basename(path): file_hash(path) for path in paths}
+        stale = [path for path in paths if self.entries.get(os.path.basename(path), ("",))[0] != hashes[os.path.basename(path)]]
+        if stale:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for path, (shape, features) in zip(stale, executor.map(extract_tile, stale, chunksize=4)):
+                    name = os.path.basename(path)
+                    self.entries[name] = (hashes[name], shape, features)
+        removed = set(self.entries) - set(hashes)
+        for name in removed:
+            del self.entries[name]
+        if stale or removed:
+            self.save()
+        return len(stale)
+
+    def save(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        names = sorted(self.entries)
+        columns = {"names": np.array(names, dtype=str),
+                   "hashes": np.array([self.entries[n][0] for n in names], dtype="U40"),
+                   "shapes": np.array([self.entries[n][1] for n in names], dtype=np.int32).reshape(-1, 2)}
+        for kind, fields in FEATURE_COLUMNS.items():
+            arrays = [self.entries[n][2][kind] for n in names]
+            columns[kind] = np.concatenate(arrays) if arrays else np.zeros((0, len(fields)), np.float32)
+            columns[f"{kind}_counts"] = np.array([len(a) for a in arrays], dtype=np.int64)
+        temp_path = os.path.join(self.store_dir, f"{FEATURE_FILE}.{os.getpid()}.tmp.npz")
+        np.savez(temp_path, **columns)
+        os.replace(temp_path, os.path.join(self.store_dir, FEATURE_FILE))
+        with open(os.path.join(self.store_dir, META_FILE), "w") as f:
+            json.dump({"version": FEATURE_VERSION, "columns": FEATURE_COLUMNS}, f, indent=2)
+
+    def table(self, kind):
+        """
+        (names, shapes, tile index per candidate, {column: values}) for one scorer.
+        """
+        names = sorted(self.entries)
+        arrays = [self.entries[n][2][kind] for n in names]
+        rows = np.concatenate(arrays) if arrays else np.zeros((0, len(FEATURE_COLUMNS[kind])), np.float32)
+        tiles = np.repeat(np.arange(len(names)), [len(a) for a in arrays])
+        columns = {field: rows[:, i].astype(float) for i, field in enumerate(FEATURE_COLUMNS[kind])}
+        return names, [self.entries[n][1] for n in names], tiles, columns
+
+
+def neutrophil_keep(features, params):
+    """
+    (combinations, candidates) mask of the candidates process_neutrophils keeps under each
+    parameter set; params values are (combinations, 1) columns.
+    """
+    area, circularity, white = features["area"], features["circularity"], features["white"]
+    area_score = np.clip((area - params["area_lo"]) / (params["area_hi"] - params["area_lo"]), 0, 1)
+    circularity_score = np.clip((circularity - params["circ_lo"]) / (1 - params["circ_lo"]), 0, 1)
+    white_score = np.clip((white - params["white_lo"]) / (1 - params["white_lo"]), 0, 1)
+    score = (params["w_area"] * area_score + params["w_circ"] * circularity_score
+             + (1 - params["w_area"] - params["w_circ"]) * white_score)
+    return ((area > params["min_area"]) & (area < params["max_area"]) & (circularity > params["min_circ"])
+            & (circularity < 1) & (score >= params["cutoff"]))
+
+
+def hyaline_keep(features, params):
+    area, elongation, hue = features["area"], features["elongation"], features["hue"]
+    area_score = np.clip((area - params["area_lo"]) / (params["area_hi"] - params["area_lo"]), 0, 1)
+    elongation_score = np.clip((elongation - params["elong_lo"]) / (params["elong_hi"] - params["elong_lo"]), 0, 1)
+    hue_score = np.where((hue >= params["hue_lo"]) & (hue <= params["hue_hi"]), 1.0, 0.5)
+    score = (params["w_area"] * area_score + params["w_elong"] * elongation_score
+             + (1 - params["w_area"] - params["w_elong"]) * hue_score)
+    return (area >= params["min_area"]) & (score >= params["cutoff"])
+
+
+SCORERS = {
+    "neutrophil": (neutrophil_keep, NEUTROPHIL_DEFAULTS, NEUTROPHIL_GRID, ("w_area", "w_circ")),
+    "hyaline": (hyaline_keep, HYALINE_DEFAULTS, HYALINE_GRID, ("w_area", "w_elong")),
+}
+
+
+def parameter_grid(kind, grid=None, max_combinations=None, seed=0):
+    """
+    All valid combinations of the grid as a DataFrame, the app's own constants first.
+    Combinations whose two weights exceed 1 or whose ranges are empty are dropped.
+    """
+    _, defaults, default_grid, (weight_a, weight_b) = SCORERS[kind]
+    grid = grid or default_grid
+    fields = list(defaults)
+    combos = pd.DataFrame(list(itertools.product(*(grid.get(field, [defaults[field]]) for field in fields))),
+                          columns=fields)
+    valid = (combos[weight_a] + combos[weight_b] <= 1) & (combos["area_hi"] > combos["area_lo"])
+    if "max_area" in combos:
+        valid &= combos["max_area"] > combos["min_area"]
+    if "elong_hi" in combos:
+        valid &= combos["elong_hi"] > combos["elong_lo"]
+    combos = combos[valid]
+    if max_combinations is not None and len(combos) > max_combinations:
+        combos = combos.sample(max_combinations, random_state=seed)
+    combos = pd.concat([pd.DataFrame([defaults]), combos], ignore_index=True).drop_duplicates(ignore_index=True)
+    return combos
+
+
+def read_class_boxes(label_path, image_width, image_height, class_id=0):
+    labels = Annotations.from_yolo_file(label_path, image_width, image_height)
+    if class_id is not None:
+        labels = labels.of_class(class_id)
+    return labels.to_pixel().boxes.astype(float)
+
+
+def label_index(labels_dir):
+    """
+    {tile stem: label path} over labels_dir and its Damaged/Healthy subfolders.
+    """
+    index = {}
+    for folder, _, files in os.walk(labels_dir):
+        for name in files:
+            if name.endswith(".txt"):
+                index[os.path.splitext(name)[0]] = os.path.join(folder, name)
+    return index
+
+
+def prepare_targets(names, shapes, tiles, features, labels_dir, class_id=0, iou_threshold=0.1):
+    """
+    Assign every candidate of a labelled tile to its best overlapping ground truth box (IoU above
+    iou_threshold), once per label set. Tiles without a label file are left out.
+    """
+    index = label_index(labels_dir)
+    boxes = np.stack([features[c] for c in ("x1", "y1", "x2", "y2")], axis=1) if len(tiles) else np.zeros((0, 4))
+    labelled = [t for t, name in enumerate(names) if os.path.splitext(name)[0] in index]
+    gt_counts = np.zeros(len(labelled), dtype=int)
+    candidate_gt = np.full(len(tiles), -1)
+    in_eval = np.zeros(len(tiles), dtype=bool)
+    tile_column = np.full(len(tiles), -1)
+    offset = 0
+    for column, t in enumerate(labelled):
+        height, width = shapes[t]
+        gt_boxes = read_class_boxes(index[os.path.splitext(names[t])[0]], width, height, class_id)
+        gt_counts[column] = len(gt_boxes)
+        members = np.flatnonzero(tiles == t)
+        in_eval[members] = True
+        tile_column[members] = column
+        if len(members) and len(gt_boxes):
+            ious = iou_matrix(boxes[members], gt_boxes)
+            best = ious.argmax(axis=1)
+            hit = ious[np.arange(len(members)), best] > iou_threshold
+            candidate_gt[members[hit]] = offset + best[hit]
+        offset += len(gt_boxes)
+    return {"in_eval": in_eval, "tile_column": tile_column, "candidate_gt": candidate_gt, "gt_counts": gt_counts,
+            "total_gt": offset}
+
+
+def evaluate_combinations(keep, targets):
+    """
+    Detection and count metrics of a (combinations, candidates) keep mask. A ground truth box
+    hit by several kept candidates is one true positive; the other hits are false positives.
+    """
+    keep = keep[:, targets["in_eval"]].astype(np.float32)
+    tile_column = targets["tile_column"][targets["in_eval"]]
+    candidate_gt = targets["candidate_gt"][targets["in_eval"]]
+    num_tiles = len(targets["gt_counts"])
+
+    tile_onehot = np.zeros((len(tile_column), num_tiles), dtype=np.float32)
+    tile_onehot[np.arange(len(tile_column)), tile_column] = 1
+    counts = keep @ tile_onehot
+    matched = np.flatnonzero(candidate_gt >= 0)
+    gt_onehot = np.zeros((len(matched), targets["total_gt"]), dtype=np.float32)
+    gt_onehot[np.arange(len(matched)), candidate_gt[matched]] = 1
+    true_positives = ((keep[:, matched] @ gt_onehot) > 0).sum(axis=1)
+
+    kept = keep.sum(axis=1)
+    false_positives = kept - true_positives
+    total_gt = targets["total_gt"]
+    precision = np.where(kept > 0, true_positives / np.maximum(kept, 1), 0.0)
+    recall = true_positives / total_gt if total_gt else np.zeros(len(keep))
+    f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-12), 0.0)
+    errors = counts - targets["gt_counts"][None, :]
+    return {
+        "true_positives": true_positives.astype(int),
+        "false_positives": false_positives.astype(int),
+        "false_negatives": (total_gt - true_positives).astype(int),
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "count_mae": np.abs(errors).mean(axis=1) if num_tiles else np.zeros(len(keep)),
+        "count_bias": errors.mean(axis=1) if num_tiles else np.zeros(len(keep)),
+    }
+
+
+def pareto_front(precision, recall, count_mae, chunk=256):
+    """
+    Mask of the combinations no other combination beats on precision, recall and count MAE at once.
+    Many combinations keep the same candidates, so only distinct metric triples are compared.
+    """
+    points = np.stack([-np.asarray(precision), -np.asarray(recall), np.asarray(count_mae)], axis=1)
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    dominated = np.zeros(len(unique), dtype=bool)
+    for start in range(0, len(unique), chunk):
+        block = unique[start:start + chunk, None, :]
+        no_worse = (unique[None, :, :] <= block).all(axis=2)
+        better = (unique[None, :, :] < block).any(axis=2)
+        dominated[start:start + chunk] = (no_worse & better).any(axis=1)
+    return ~dominated[inverse.ravel()]
+
+
+def run_sweep(store, kind, labels_dirs, combos, class_id=0, iou_threshold=0.1, chunk=512):
+    """
+    Every parameter combination against every label set, from the cached features only.
+    Returns {label set: DataFrame of parameters, metrics and a pareto column}.
+    """
+    keep_fn = SCORERS[kind][0]
+    names, shapes, tiles, features = store.table(kind)
+    results = {}
+    for labels_dir in labels_dirs:
+        targets = prepare_targets(names, shapes, tiles, features, labels_dir, class_id, iou_threshold)
+        parts = []
+        for start in range(0, len(combos), chunk):
+            block = combos.iloc[start:start + chunk]
+            params = {field: block[field].to_numpy(dtype=float)[:, None] for field in combos.columns}
+            parts.append(evaluate_combinations(keep_fn(features, params), targets))
+        metrics = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        table = pd.concat([combos.reset_index(drop=True), pd.DataFrame(metrics)], axis=1)
+        table["pareto"] = pareto_front(table["precision"], table["recall"], table["count_mae"])
+        table["default"] = False
+        table.loc[0, "default"] = True
+        results[os.path.basename(labels_dir.rstrip("/"))] = table
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the app's classical scorer constants over cached contour features.")
+    parser.add_argument("--images", default="images/")
+    parser.add_argument("--store", default="Heuristic_Features")
+    parser.add_argument("--kind", choices=sorted(SCORERS), default="neutrophil")
+    parser.add_argument("--labels", nargs="+", default=None, help=f"Label sets (default: those of {LABEL_DIRS} present)")
+    parser.add_argument("--class-id", type=int, default=0, help="Label class the scorer should find")
+    parser.add_argument("--iou-threshold", type=float, default=0.1)
+    parser.add_argument("--max-combinations", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output-prefix", default="heuristic_sweep")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    extracted = store.update(args.images, args.workers)
+    print(f"Features of {len(store.entries)} tiles ({extracted} extracted, the rest cached)")
+    labels_dirs = args.labels or [d for d in LABEL_DIRS if os.path.isdir(d)]
+    combos = parameter_grid(args.kind, max_combinations=args.max_combinations)
+    results = run_sweep(store, args.kind, labels_dirs, combos, args.class_id, args.iou_threshold)
+    for label_set, table in results.items():
+        table.to_csv(f"{args.output_prefix}_{args.kind}_{label_set}.csv", index=False)
+        front = table[table["pareto"] | table["default"]].sort_values("f1", ascending=False)
+        print(f"{label_set}: {len(table)} combinations, {int(table['pareto'].sum())} on the Pareto front")
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(front.head(10).round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
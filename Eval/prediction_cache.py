@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import hashlib
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Date Prepration"))
+from derivatives import file_hash
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+CACHE_FILE = "predictions.npz"
+META_FILE = "meta.json"
+CACHE_CONF = 0.001
+
+
+def list_images(test_images_dir):
+    return sorted(os.path.join(test_images_dir, f) for f in os.listdir(test_images_dir)
+                  if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def cache_key(weights_hash, settings):
+    """
+    Directory name for a model and its inference settings other than conf: a cache made at a
+    lower confidence answers any higher one by filtering, since NMS only suppresses boxes with
+    lower scores (unless max_det was reached).
+    """
+    settings_hash = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    return f"{weights_hash[:16]}_{settings_hash[:8]}"
+
+
+class PredictionStore:
+    """
+    Columnar predictions of one model: per image its content hash, name, shape and box count,
+    and all boxes, scores and classes concatenated. Stored as a single npz.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.conf = None
+        self.entries = {}
+        path = os.path.join(store_dir, CACHE_FILE)
+        if not os.path.exists(path):
+            return
+        with open(os.path.join(store_dir, META_FILE), "r") as f:
+            self.conf = json.load(f)["conf"]
+        with np.load(path) as data:
+            offsets = np.concatenate([[0], np.cumsum(data["counts"])])
+            boxes, scores, classes = data["boxes"], data["scores"], data["classes"]
+            for i, image_hash in enumerate(data["hashes"]):
+                start, end = offsets[i], offsets[i + 1]
+                self.entries[str(image_hash)] = (str(data["names"][i]), tuple(data["shapes"][i]),
+                                                 boxes[start:end], scores[start:end], classes[start:end])
+
+    def get(self, image_hash, conf):
+        name, shape, boxes, scores, classes = self.entries[image_hash]
+        keep = scores >= conf
+        return boxes[keep].astype(float), scores[keep].astype(float), shape
+
+    def put(self, image_hash, name, shape, boxes, scores, classes):
+        self.entries[image_hash] = (name, tuple(shape), np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+                                    np.asarray(scores, dtype=np.float32), np.asarray(classes, dtype=np.int16))
+
+    def save(self, meta):
+        os.makedirs(self.store_dir, exist_ok=True)
+        hashes = sorted(self.entries)
+        entries = [self.entries[h] for h in hashes]
+        temp_path = os.path.join(self.store_dir, f"{CACHE_FILE}.{os.getpid()}.tmp.npz")
+        np.savez(temp_path,
+                 hashes=np.array(hashes, dtype="U40"),
+                 names=np.array([e[0] for e in entries], dtype=str),
+                 shapes=np.array([e[1] for e in entries], dtype=np.int32).reshape(-1, 2),
+                 counts=np.array([len(e[3]) for e in entries], dtype=np.int64),
+                 boxes=np.concatenate([e[2] for e in entries]) if entries else np.zeros((0, 4), np.float32),
+                 scores=np.concatenate([e[3] for e in entries]) if entries else np.zeros(0, np.float32),
+                 classes=np.concatenate([e[4] for e in entries]) if entries else np.zeros(0, np.int16))
+        os.replace(temp_path, os.path.join(self.store_dir, CACHE_FILE))
+        with open(os.path.join(self.store_dir, META_FILE), "w") as f:
+            json.dump(dict(meta, conf=self.conf, images=len(hashes)), f, indent=2)
+
+
+def cached_predict(weights_path, test_images_dir, conf=0.1, cache_dir="Prediction_Cache", model=None,
+                   cache_conf=CACHE_CONF, **settings):
+    """
+    Predictions of weights_path for every image in test_images_dir, running the detector only
+    on images (by content hash) that are not cached yet for these weights and settings.
+    The detector runs at cache_conf so later calls at any higher conf are served from the cache.
+
+    Returns {image name: (boxes, scores, (height, width))} with boxes in pixels, the same form
+    as sweep.predict_once, so any label set, threshold or matching rule can reuse it.
+    """
+    weights_hash = file_hash(weights_path)
+    store = PredictionStore(os.path.join(cache_dir, cache_key(weights_hash, settings)))
+
+    image_paths = list_images(test_images_dir)
+    image_hashes = [file_hash(path) for path in image_paths]
+    if store.conf is not None and conf < store.conf:
+        # cached boxes stop at a higher confidence, so everything has to be predicted again
+        store.entries = {}
+        store.conf = None
+    predict_conf = min(conf, cache_conf) if store.conf is None else store.conf
+    missing = [(path, h) for path, h in zip(image_paths, image_hashes) if h not in store.entries]
+
+    if missing:
+        if model is None:
+            from ultralytics import YOLO
+            model = YOLO(weights_path)
+        print(f"Predicting {len(missing)} of {len(image_paths)} images with {os.path.basename(weights_path)}")
+        results = model.predict(source=[path for path, _ in missing], show_labels=False, show_conf=False,
+                                conf=predict_conf, verbose=False, stream=True, **settings)
+        for (path, image_hash), result in zip(missing, results):
+            boxes = result.boxes
+            store.put(image_hash, os.path.basename(path), result.orig_shape[:2],
+                      boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy())
+        store.conf = predict_conf
+        store.save({"weights": os.path.abspath(weights_path), "weights_hash": weights_hash,
+                    "settings": settings})
+
+    return {os.path.basename(path): store.get(image_hash, conf) for path, image_hash in zip(image_paths, image_hashes)}
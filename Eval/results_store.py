@@ -0,0 +1,232 @@
+import os
+import re
+import sys
+import csv
+import glob
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Date Prepration"))
+from derivatives import file_hash
+
+RUNS_FILE = "runs.csv"
+NUM_CLASSES = 3
+
+# CSV header -> stored column
+COLUMNS = {
+    "ground truth neutrophils": "gt_count",
+    "predicted neutrophils": "pred_count",
+    "missed": "missed",
+    "false_positives": "false_positives",
+    "true_positives": "true_positives",
+    "label_groundtruth": "label_gt",
+    "label_prediction": "label_pred",
+}
+RUN_FIELDS = ["run_id", "file", "label_set", "model", "arch", "data_version", "augmentation", "batch",
+              "variant", "sha1", "rows"]
+LABEL_SET_PATTERN = re.compile(r"^output_metrics_((?:Intersection|Union|Majority)_Labels|labels_[^_]+)_(.+)\.csv$")
+
+
+def parse_run_name(file_name):
+    """
+    output_metrics_<label set>_<model>.csv, e.g. ..._labels_O1_best_11s_dataold_Noaug_b16.csv ->
+    label set labels_O1, arch 11s, data version old, augmentation noaug, batch 16.
+    Tokens that fit none of these end up in variant.
+    """
+    match = LABEL_SET_PATTERN.match(os.path.basename(file_name))
+    if match is None:
+        raise ValueError(f"Not an output_metrics_<label set>_<model>.csv file: {file_name}")
+    label_set, model = match.groups()
+    run = {"label_set": label_set, "model": model, "arch": "", "data_version": "", "augmentation": "",
+           "batch": "", "variant": ""}
+    variant = []
+    for i, token in enumerate(model.split("_")):
+        if i == 0 and token == "best":
+            continue
+        if not run["arch"] and re.match(r"^\d+[nsmlx]$", token):
+            run["arch"] = token
+        elif token.startswith("data"):
+            run["data_version"] = token[4:]
+        elif token.lower().endswith("aug"):
+            run["augmentation"] = token.lower()
+        elif re.match(r"^b\d+$", token):
+            run["batch"] = token[1:]
+        else:
+            variant.append(token)
+    run["variant"] = "_".join(variant)
+    return run
+
+
+def read_metrics_csv(path):
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.DictReader(f))
+    columns = {"name": np.array([row["name"] for row in rows], dtype=str)}
+    for header, column in COLUMNS.items():
+        columns[column] = np.array([int(row[header]) for row in rows], dtype=np.int32)
+    return columns
+
+
+def quadratic_kappa(confusion):
+    """
+    Quadratic weighted Cohen's kappa for a stack of (..., K, K) confusion matrices
+    (rows ground truth, columns prediction), same as sklearn's cohen_kappa_score(weights="quadratic").
+    """
+    confusion = np.asarray(confusion, dtype=float)
+    k = confusion.shape[-1]
+    weights = (np.arange(k)[:, None] - np.arange(k)[None, :]) ** 2
+    total = confusion.sum(axis=(-2, -1), keepdims=True)
+    expected = confusion.sum(axis=-1, keepdims=True) * confusion.sum(axis=-2, keepdims=True) / np.where(total > 0, total, 1)
+    observed_cost = (weights * confusion).sum(axis=(-2, -1))
+    expected_cost = (weights * expected).sum(axis=(-2, -1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(expected_cost > 0, 1 - observed_cost / expected_cost, np.nan)
+
+
+class ResultsStore:
+    """
+    All output_metrics runs in one store: runs.csv holds one row per run with the fields parsed
+    from its file name, and each run's columns live in label_set=<label set>/run_<id>.npz.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        runs_path = os.path.join(store_dir, RUNS_FILE)
+        if os.path.exists(runs_path):
+            self.runs = pd.read_csv(runs_path, dtype=str, keep_default_na=False)
+            self.runs["run_id"] = self.runs["run_id"].astype(int)
+            self.runs["rows"] = self.runs["rows"].astype(int)
+        else:
+            self.runs = pd.DataFrame(columns=RUN_FIELDS)
+
+    def partition_path(self, label_set, run_id):
+        return os.path.join(self.store_dir, f"label_set={label_set}", f"run_{run_id}.npz")
+
+    def ingest(self, csv_dir, pattern="output_metrics_*.csv"):
+        """
+        Add new CSVs and replace runs whose CSV changed; unchanged files are not read.
+        Returns {"added": n, "updated": n, "unchanged": n}.
+        """
+        summary = {"added": 0, "updated": 0, "unchanged": 0}
+        known = dict(zip(self.runs["file"], zip(self.runs["run_id"], self.runs["sha1"])))
+        next_id = int(self.runs["run_id"].max()) + 1 if len(self.runs) else 0
+        new_runs = []
+        for path in sorted(glob.glob(os.path.join(csv_dir, pattern))):
+            file_name = os.path.basename(path)
+            sha1 = file_hash(path)
+            if file_name in known and known[file_name][1] == sha1:
+                summary["unchanged"] += 1
+                continue
+            run = parse_run_name(file_name)
+            if file_name in known:
+                run_id = known[file_name][0]
+                self.runs = self.runs[self.runs["run_id"] != run_id]
+                summary["updated"] += 1
+            else:
+                run_id = next_id
+                next_id += 1
+                summary["added"] += 1
+            columns = read_metrics_csv(path)
+            partition_path = self.partition_path(run["label_set"], run_id)
+            os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+            np.savez(partition_path, **columns)
+            new_runs.append(dict(run, run_id=run_id, file=file_name, sha1=sha1, rows=len(columns["name"])))
+
+        if new_runs:
+            self.runs = pd.concat([self.runs, pd.DataFrame(new_runs, columns=RUN_FIELDS)], ignore_index=True)
+            self.runs = self.runs.sort_values("run_id").reset_index(drop=True)
+            temp_path = os.path.join(self.store_dir, RUNS_FILE + ".tmp")
+            self.runs.to_csv(temp_path, index=False)
+            os.replace(temp_path, os.path.join(self.store_dir, RUNS_FILE))
+        return summary
+
+    def select_runs(self, **filters):
+        runs = self.runs
+        for field, value in filters.items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            runs = runs[runs[field].isin([str(v) for v in values])]
+        return runs
+
+    def rows(self, **filters):
+        """
+        Per-tile rows of the selected runs as one DataFrame, with the run fields as columns.
+        """
+        runs = self.select_runs(**filters)
+        frames = []
+        for run in runs.itertuples(index=False):
+            with np.load(self.partition_path(run.label_set, run.run_id)) as data:
+                frame = pd.DataFrame({column: data[column] for column in data.files})
+            frame.insert(0, "run_id", run.run_id)
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=["run_id", "name"] + list(COLUMNS.values()))
+        return pd.concat(frames, ignore_index=True).merge(runs.drop(columns=["sha1", "rows", "file"]), on="run_id")
+
+    def leaderboard(self, sort_by="qwk", **filters):
+        """
+        One row per run: tile label MSE, quadratic kappa and accuracy, count MAE and the
+        detection precision/recall/F1, computed for every run in a single group-by.
+        """
+        rows = self.rows(**filters)
+        runs = self.select_runs(**filters).set_index("run_id")
+        if rows.empty:
+            return pd.DataFrame()
+        rows["label_sq_error"] = (rows["label_gt"] - rows["label_pred"]) ** 2
+        rows["label_correct"] = rows["label_gt"] == rows["label_pred"]
+        rows["count_abs_error"] = (rows["pred_count"] - rows["gt_count"]).abs()
+        grouped = rows.groupby("run_id")
+        board = grouped.agg(tiles=("name", "size"), mse=("label_sq_error", "mean"), accuracy=("label_correct", "mean"),
+                            count_mae=("count_abs_error", "mean"), tp=("true_positives", "sum"),
+                            fp=("false_positives", "sum"), missed=("missed", "sum"))
+
+        run_index = pd.Index(board.index)
+        confusion = np.zeros((len(run_index), NUM_CLASSES, NUM_CLASSES))
+        np.add.at(confusion, (run_index.get_indexer(rows["run_id"]), rows["label_gt"].clip(0, NUM_CLASSES - 1),
+                              rows["label_pred"].clip(0, NUM_CLASSES - 1)), 1)
+        board["qwk"] = quadratic_kappa(confusion)
+
+        detected = board["tp"] + board["fp"]
+        board["precision"] = np.where(detected > 0, board["tp"] / detected.where(detected > 0, 1), 0.0)
+        positives = board["tp"] + board["missed"]
+        board["recall"] = np.where(positives > 0, board["tp"] / positives.where(positives > 0, 1), 0.0)
+        pr = board["precision"] + board["recall"]
+        board["f1"] = np.where(pr > 0, 2 * board["precision"] * board["recall"] / pr.where(pr > 0, 1), 0.0)
+
+        fields = ["label_set", "model", "arch", "data_version", "augmentation", "batch", "variant"]
+        board = runs[fields].join(board, how="inner")
+        ascending = sort_by in ("mse", "count_mae", "fp", "missed")
+        return board.sort_values(sort_by, ascending=ascending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest output_metrics CSVs into one store and rank every run.")
+    parser.add_argument("--store", default="Results_Store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest")
+    ingest_parser.add_argument("csv_dir", nargs="?", default="CSV_Preds")
+    board_parser = subparsers.add_parser("leaderboard")
+    board_parser.add_argument("--sort", default="qwk")
+    for field in ("label_set", "arch", "data_version", "augmentation", "model"):
+        board_parser.add_argument(f"--{field.replace('_', '-')}", dest=field, nargs="*", default=None)
+    board_parser.add_argument("--csv", default=None, help="Also write the leaderboard to this CSV")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "ingest":
+        summary = store.ingest(args.csv_dir)
+        print(f"Added {summary['added']}, updated {summary['updated']}, unchanged {summary['unchanged']} runs")
+    else:
+        filters = {field: getattr(args, field) for field in ("label_set", "arch", "data_version", "augmentation", "model")}
+        board = store.leaderboard(args.sort, **filters)
+        with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_rows", None):
+            print(board.round(4).to_string())
+        if args.csv:
+            board.to_csv(args.csv)
+
+
+if __name__ == "__main__":
+    main()
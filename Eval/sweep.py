@@ -0,0 +1,165 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Application"))
+from annotations import Annotations
+from create import iou_matrix
+
+
+def read_ground_truth(label_path, image_width, image_height):
+    """
+    YOLO label file -> (N, 4) array of x1, y1, x2, y2 in pixels.
+    """
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4))
+    return Annotations.from_yolo_file(label_path, image_width, image_height).to_pixel().boxes.astype(float)
+
+
+def result_arrays(result):
+    """
+    Boxes (N, 4), scores (N,) and (height, width) of one ultralytics result, without re-reading the image.
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), tuple(result.orig_shape[:2])
+    return boxes.xyxy.cpu().numpy().astype(float), boxes.conf.cpu().numpy().astype(float), tuple(result.orig_shape[:2])
+
+
+def predict_once(model, test_images_dir, min_conf=0.001, **predict_kwargs):
+    """
+    Run the detector a single time at min_conf and keep every box with its score.
+    Returns {image name: (boxes, scores, (height, width))}.
+    """
+    predictions = {}
+    results = model.predict(source=test_images_dir, show_labels=False, show_conf=False, conf=min_conf,
+                            verbose=False, stream=True, **predict_kwargs)
+    for result in results:
+        predictions[os.path.basename(result.path)] = result_arrays(result)
+    return predictions
+
+
+def match_detections(pred_boxes, scores, gt_boxes, iou_threshold=0.1, matching="first"):
+    """
+    Label each prediction as true or false positive, in descending score order.
+
+    "first" follows the threshold notebook: a prediction is judged against the first ground
+    truth box it overlaps, and a duplicate hit on an already matched box counts as neither.
+    "best" follows process_image: the best overlapping unmatched box, otherwise a false positive.
+    Each outcome only depends on higher scoring predictions, so the result at any confidence
+    threshold is a prefix of these arrays. Returns (sorted scores, tp, fp).
+    """
+    order = np.argsort(-scores, kind="stable")
+    scores = scores[order]
+    tp = np.zeros(len(order), dtype=bool)
+    fp = np.zeros(len(order), dtype=bool)
+    if not len(gt_boxes):
+        fp[:] = True
+        return scores, tp, fp
+    if not len(order):
+        return scores, tp, fp
+
+    ious = iou_matrix(pred_boxes[order], gt_boxes)
+    overlaps = ious > iou_threshold
+    matched = np.zeros(len(gt_boxes), dtype=bool)
+    for i in range(len(order)):
+        if matching == "first":
+            hits = np.flatnonzero(overlaps[i])
+            if not len(hits):
+                fp[i] = True
+            elif not matched[hits[0]]:
+                tp[i] = True
+                matched[hits[0]] = True
+        elif matching == "best":
+            candidates = np.where(overlaps[i] & ~matched, ious[i], -1.0)
+            best = int(np.argmax(candidates))
+            if candidates[best] > 0:
+                tp[i] = True
+                matched[best] = True
+            else:
+                fp[i] = True
+        else:
+            raise ValueError(f"Unknown matching rule: {matching}")
+    return scores, tp, fp
+
+
+def match_label_dir(predictions, test_labels_dir, iou_threshold=0.1, matching="first"):
+    """
+    Match cached predictions against one label directory. Images without a label file are
+    skipped as in the evaluation cells. Returns a list of per-image records.
+    """
+    records = []
+    for image_name in sorted(predictions):
+        label_path = os.path.join(test_labels_dir, os.path.splitext(image_name)[0] + ".txt")
+        if not os.path.exists(label_path):
+            continue
+        pred_boxes, scores, (image_height, image_width) = predictions[image_name]
+        gt_boxes = read_ground_truth(label_path, image_width, image_height)
+        sorted_scores, tp, fp = match_detections(pred_boxes, scores, gt_boxes, iou_threshold, matching)
+        records.append({"name": image_name, "scores": sorted_scores, "tp": tp, "fp": fp, "num_gt": len(gt_boxes)})
+    return records
+
+
+def sweep(records, thresholds):
+    """
+    TP/FP/FN, precision, recall, F1 and count errors for every threshold in one pass.
+
+    All predictions are pooled and sorted by score once; cumulative TP/FP sums read off the
+    totals for "score >= threshold" with a single searchsorted.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    if records:
+        scores = np.concatenate([r["scores"] for r in records])
+        tp = np.concatenate([r["tp"] for r in records])
+        fp = np.concatenate([r["fp"] for r in records])
+    else:
+        scores, tp, fp = np.zeros(0), np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+    total_gt = sum(r["num_gt"] for r in records)
+
+    order = np.argsort(-scores, kind="stable")
+    cum_tp = np.concatenate([[0], np.cumsum(tp[order])])
+    cum_fp = np.concatenate([[0], np.cumsum(fp[order])])
+    kept = np.searchsorted(-scores[order], -thresholds, side="right")
+    true_positives = cum_tp[kept]
+    false_positives = cum_fp[kept]
+    false_negatives = total_gt - true_positives
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        detected = true_positives + false_positives
+        precision = np.where(detected > 0, true_positives / np.maximum(detected, 1), 0.0)
+        recall = true_positives / total_gt if total_gt > 0 else np.zeros(len(thresholds))
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    # per-image predicted counts at every threshold: (images, thresholds)
+    counts = np.array([np.searchsorted(-r["scores"], -thresholds, side="right") for r in records]).reshape(len(records), -1)
+    gt_counts = np.array([r["num_gt"] for r in records]).reshape(-1, 1)
+    errors = counts - gt_counts
+    return {
+        "threshold": thresholds,
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+        "precision": precision,
+        "recall": recall,
+        "accuracy": recall,
+        "f1": f1,
+        "count_mae": np.abs(errors).mean(axis=0) if len(records) else np.zeros(len(thresholds)),
+        "count_rmse": np.sqrt((errors ** 2).mean(axis=0)) if len(records) else np.zeros(len(thresholds)),
+        "count_bias": errors.mean(axis=0) if len(records) else np.zeros(len(thresholds)),
+    }
+
+
+def sweep_model(model, test_images_dir, test_labels_dirs, thresholds=None, min_conf=0.001,
+                iou_threshold=0.1, matching="first", predictions=None):
+    """
+    One inference pass of model over test_images_dir, then a curve per label directory.
+    Thresholds below min_conf are raised to it since those boxes were never produced.
+    Pass predictions (e.g. from prediction_cache.cached_predict) to skip inference.
+    """
+    thresholds = np.linspace(0.0, 1.0, 100) if thresholds is None else np.asarray(thresholds, dtype=float)
+    thresholds = np.maximum(thresholds, min_conf)
+    if predictions is None:
+        predictions = predict_once(model, test_images_dir, min_conf)
+    return {test_labels_dir: sweep(match_label_dir(predictions, test_labels_dir, iou_threshold, matching), thresholds)
+            for test_labels_dir in test_labels_dirs}
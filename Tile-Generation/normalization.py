@@ -0,0 +1,152 @@
+import functools
+
+import cv2 as cv
+import numpy as np
+import pyvips
+
+# Reference H&E stain vectors and maximum concentrations from Macenko et al. (2009)
+MACENKO_REFERENCE_STAINS = np.array([[0.5626, 0.7201, 0.4062],
+                                     [0.2159, 0.8012, 0.5581]], dtype=np.float32)
+MACENKO_REFERENCE_MAX_CONCENTRATIONS = np.array([1.9705, 1.0308], dtype=np.float32)
+LIGHT_INTENSITY = 240.0
+
+
+@functools.lru_cache(maxsize=None)
+def gamma_lut(gamma):
+    lut = np.clip(np.power(np.arange(256) / 255.0, gamma) * 255.0, 0, 255)
+    lut = lut.astype(np.uint8).reshape(1, 256)
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_gamma_correction(img, gamma):
+    return cv.LUT(img, gamma_lut(gamma))
+
+
+def affine_lut(scale, offset):
+    return np.clip(np.arange(256, dtype=np.float32) * scale + offset, 0, 255).round().astype(np.uint8)
+
+
+def optical_density_lut():
+    return (-np.log((np.arange(256, dtype=np.float32) + 1.0) / LIGHT_INTENSITY)).astype(np.float32)
+
+
+def tissue_pixels(rgb, alpha=None, background_threshold=220):
+    mask = (rgb.mean(axis=2) < background_threshold) & (rgb.max(axis=2) > 0)
+    if alpha is not None:
+        mask &= alpha > 0
+    return rgb[mask]
+
+
+def macenko_stains(pixels, beta=0.15, alpha=1.0):
+    od = -np.log((pixels.astype(np.float32) + 1.0) / LIGHT_INTENSITY)
+    od = od[(od > beta).all(axis=1)]
+    if len(od) < 100:
+        raise ValueError("Not enough tissue in the thumbnail to estimate stain vectors")
+    _, eigenvectors = np.linalg.eigh(np.cov(od.T))
+    plane = eigenvectors[:, 1:3]
+    projected = od @ plane
+    angles = np.arctan2(projected[:, 1], projected[:, 0])
+    min_angle, max_angle = np.percentile(angles, alpha), np.percentile(angles, 100 - alpha)
+    first = plane @ np.array([np.cos(min_angle), np.sin(min_angle)])
+    second = plane @ np.array([np.cos(max_angle), np.sin(max_angle)])
+    # haematoxylin has the larger red component
+    stains = np.array([first, second] if first[0] > second[0] else [second, first], dtype=np.float32)
+    stains *= np.sign(stains.sum(axis=1, keepdims=True))
+    stains /= np.linalg.norm(stains, axis=1, keepdims=True)
+    concentrations = od @ np.linalg.pinv(stains)
+    max_concentrations = np.percentile(concentrations, 99, axis=0).astype(np.float32)
+    return stains, max_concentrations
+
+
+def compute_slide_stats(slide_path, thumbnail_width=2048, background_threshold=220, percentiles=(1, 99)):
+    """
+    Per-slide colour statistics, computed once from a low-resolution thumbnail of the tissue.
+    """
+    thumbnail = pyvips.Image.thumbnail(slide_path, thumbnail_width)
+    array = np.ndarray(buffer=thumbnail.write_to_memory(), dtype=np.uint8,
+                       shape=[thumbnail.height, thumbnail.width, thumbnail.bands])
+    alpha = array[..., 3] if array.shape[2] == 4 else None
+    rgb = np.ascontiguousarray(array[..., :3])
+    pixels = tissue_pixels(rgb, alpha, background_threshold)
+    if len(pixels) == 0:
+        raise ValueError(f"No tissue found in the thumbnail of {slide_path}")
+
+    lab = cv.cvtColor(pixels.reshape(-1, 1, 3), cv.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float32)
+    stats = {
+        "percentile_low": np.percentile(pixels, percentiles[0], axis=0).astype(np.float32),
+        "percentile_high": np.percentile(pixels, percentiles[1], axis=0).astype(np.float32),
+        "lab_mean": lab.mean(axis=0),
+        "lab_std": lab.std(axis=0),
+    }
+    try:
+        stats["stains"], stats["max_concentrations"] = macenko_stains(pixels)
+    except ValueError:
+        stats["stains"], stats["max_concentrations"] = None, None
+    return stats
+
+
+class Normalizer:
+    """
+    Colour normalization applied to every tile of one slide.
+
+    Everything that depends only on the slide statistics (LUTs, stain pseudo-inverse)
+    is built in __init__, so __call__ is a few vectorized NumPy / cv.LUT passes.
+    method is "gamma", "percentile", "reinhard" or "macenko".
+    """
+
+    def __init__(self, method, stats=None, target_stats=None, gamma=1.0):
+        self.method = method
+        self.gamma = gamma
+        if method == "gamma":
+            self.lut = gamma_lut(gamma)
+        elif method == "percentile":
+            low, high = stats["percentile_low"], stats["percentile_high"]
+            scale = 255.0 / np.maximum(high - low, 1.0)
+            self.lut = np.stack([affine_lut(scale[c], -low[c] * scale[c]) for c in range(3)], axis=1).reshape(1, 256, 3)
+        elif method == "reinhard":
+            if target_stats is None:
+                raise ValueError("Reinhard normalization needs target_stats from a reference slide")
+            scale = target_stats["lab_std"] / np.maximum(stats["lab_std"], 1e-3)
+            offset = target_stats["lab_mean"] - stats["lab_mean"] * scale
+            self.lut = np.stack([affine_lut(scale[c], offset[c]) for c in range(3)], axis=1).reshape(1, 256, 3)
+        elif method == "macenko":
+            if stats.get("stains") is None:
+                raise ValueError("Slide statistics have no stain vectors; use another method for this slide")
+            target_stains = MACENKO_REFERENCE_STAINS
+            target_max = MACENKO_REFERENCE_MAX_CONCENTRATIONS
+            if target_stats is not None and target_stats.get("stains") is not None:
+                target_stains, target_max = target_stats["stains"], target_stats["max_concentrations"]
+            self.od_lut = optical_density_lut()
+            scale = (target_max / np.maximum(stats["max_concentrations"], 1e-6)).astype(np.float32)
+            # od -> concentrations -> rescaled concentrations -> target od as a single 3x3 matrix
+            self.od_transform = (np.linalg.pinv(stats["stains"]) * scale) @ target_stains
+            self.od_transform = self.od_transform.astype(np.float32)
+        else:
+            raise ValueError(f"Unknown normalization method: {method}")
+
+    def normalize_rgb(self, rgb):
+        if self.method == "gamma":
+            return cv.LUT(rgb, self.lut)
+        if self.method == "percentile":
+            return cv.LUT(rgb, self.lut)
+        if self.method == "reinhard":
+            lab = cv.cvtColor(rgb, cv.COLOR_RGB2LAB)
+            return cv.cvtColor(cv.LUT(lab, self.lut), cv.COLOR_LAB2RGB)
+        od = self.od_lut[rgb].reshape(-1, 3) @ self.od_transform
+        out = LIGHT_INTENSITY * np.exp(-od)
+        return np.clip(out, 0, 255).astype(np.uint8).reshape(rgb.shape)
+
+    def __call__(self, tile_array):
+        if tile_array.shape[2] == 4:
+            rgb = self.normalize_rgb(np.ascontiguousarray(tile_array[..., :3]))
+            return np.dstack([rgb, tile_array[..., 3]])
+        return self.normalize_rgb(np.ascontiguousarray(tile_array))
+
+
+def slide_normalizer(slide_path, method, reference_slide_path=None, gamma=1.0, thumbnail_width=2048):
+    if method == "gamma":
+        return Normalizer("gamma", gamma=gamma)
+    stats = compute_slide_stats(slide_path, thumbnail_width)
+    target_stats = compute_slide_stats(reference_slide_path, thumbnail_width) if reference_slide_path else None
+    return Normalizer(method, stats, target_stats, gamma)
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pyvips
+from tqdm import tqdm
+
+from normalization import slide_normalizer
+
+MANIFEST_FILE = "manifest.tsv"
+SETTINGS_FILE = "run_settings.json"
+
+_slides = {}
+_write_slots = None
+
+
+def pyvips_to_numpy(vips_image):
+    return np.ndarray(buffer=vips_image.write_to_memory(),
+                      dtype=np.uint8,
+                      shape=[vips_image.height, vips_image.width, vips_image.bands])
+
+
+def slide_output_dir(output_root, slide_file, patch_size_w, patch_size_h):
+    return os.path.join(output_root, f"Tiles_{patch_size_h}_{patch_size_w}_{slide_file}")
+
+
+def read_manifest(output_dir):
+    """
+    Return {(x, y): (status, bytes)} for every tile already finished in output_dir.
+    """
+    done = {}
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return done
+    existing = set(os.listdir(output_dir))
+    with open(manifest_path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4:
+                continue  # partially written last line after a crash
+            x, y, status, size = int(parts[0]), int(parts[1]), parts[2], int(parts[3])
+            if status == "written" and f"tile_{x}_{y}.png" not in existing:
+                continue
+            done[(x, y)] = (status, size)
+    return done
+
+
+def check_settings(output_dir, settings, restart=False):
+    """
+    Record the settings a slide is tiled with, so a resume never mixes tiles made with
+    different ones. If output_dir holds a run with other settings, raise ValueError, or with
+    restart clear its manifest and tiles and start over.
+    """
+    settings_path = os.path.join(output_dir, SETTINGS_FILE)
+    previous = settings
+    if os.path.exists(settings_path):
+        with open(settings_path, "r") as f:
+            previous = json.load(f)
+    elif os.path.exists(os.path.join(output_dir, MANIFEST_FILE)):
+        previous = {}  # tiled before settings were recorded, so they are unknown
+    if previous != settings:
+        if not restart:
+            changed = sorted(key for key in set(previous) | set(settings) if previous.get(key) != settings.get(key))
+            raise ValueError(f"{output_dir} was tiled with different settings ({', '.join(changed)}); "
+                             f"pass restart=True to discard it")
+        for name in os.listdir(output_dir):
+            if name == MANIFEST_FILE or (name.startswith("tile_") and name.endswith((".png", ".png.part"))):
+                os.remove(os.path.join(output_dir, name))
+    temp_path = settings_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(settings, f, indent=1, sort_keys=True)
+    os.replace(temp_path, settings_path)
+
+
+def init_worker(write_slots, vips_threads):
+    global _write_slots
+    _write_slots = write_slots
+    pyvips.concurrency_set(vips_threads)
+
+
+def get_slide(slide_path):
+    slide = _slides.get(slide_path)
+    if slide is None:
+        slide = pyvips.Image.new_from_file(slide_path)
+        _slides[slide_path] = slide
+    return slide
+
+
+def process_rows(slide_path, output_dir, y_values, patch_size_w, patch_size_h,
+                 lower_bnd_intensity, upper_bnd_intensity, compression, done_keys, normalizer=None):
+    """
+    Tile one band of rows. Decoding runs freely in every worker process; encoding and
+    writing a PNG only happens while holding one of the shared write slots.
+    """
+    slide = get_slide(slide_path)
+    width, height = slide.width, slide.height
+    completed = []
+    for y in y_values:
+        for x in range(0, width, patch_size_w):
+            if (x, y) in done_keys:
+                continue
+            actual_patch_w = min(patch_size_w, width - x)
+            actual_patch_h = min(patch_size_h, height - y)
+            tile = slide.crop(x, y, actual_patch_w, actual_patch_h)
+            tile_array = pyvips_to_numpy(tile)
+            # background is judged on the raw tile; normalization can pull white glass into the tissue range
+            mean_value = np.mean(tile_array)
+            if lower_bnd_intensity < mean_value <= upper_bnd_intensity:
+                completed.append((x, y, "background", 0))
+                continue
+            if normalizer is not None:
+                tile_array = normalizer(tile_array)
+
+            tile = pyvips.Image.new_from_memory(tile_array.data, actual_patch_w, actual_patch_h, tile_array.shape[2], "uchar")
+            output_filename = os.path.join(output_dir, f"tile_{x}_{y}.png")
+            temp_filename = output_filename + ".part"
+            with _write_slots:
+                tile.pngsave(temp_filename, compression=compression)
+                os.replace(temp_filename, output_filename)
+            completed.append((x, y, "written", os.path.getsize(output_filename)))
+    return completed
+
+
+def schedule_slides(slide_paths, output_root, patch_size_w=1637, patch_size_h=1018,
+                    lower_bnd_intensity=240, upper_bnd_intensity=255, compression=9,
+                    decode_workers=None, write_workers=2, rows_per_job=1, vips_threads=1,
+                    normalization=None, reference_slide_path=None, gamma=1.0, restart=False):
+    """
+    Tile several slides at once across worker processes, resuming from each slide's manifest.
+
+    Every finished tile is appended to <output_dir>/manifest.tsv as soon as its job returns,
+    so an interrupted run only redoes the jobs that were in flight. A slide is only resumed
+    with the settings in its run_settings.json (see check_settings). Returns per-slide stats.
+    normalization optionally names a method from normalization.py; its slide statistics are
+    computed once here and shipped to the workers with each job.
+    """
+    decode_workers = decode_workers or os.cpu_count()
+    context = multiprocessing.get_context("spawn")
+    write_slots = context.BoundedSemaphore(write_workers)
+
+    stats = {}
+    manifests = {}
+    jobs = []
+    for slide_path in slide_paths:
+        slide_file = os.path.basename(slide_path)
+        output_dir = slide_output_dir(output_root, slide_file, patch_size_w, patch_size_h)
+        os.makedirs(output_dir, exist_ok=True)
+        check_settings(output_dir, {
+            "patch_size_w": patch_size_w, "patch_size_h": patch_size_h,
+            "lower_bnd_intensity": lower_bnd_intensity, "upper_bnd_intensity": upper_bnd_intensity,
+            "compression": compression, "normalization": normalization,
+            "reference_slide": os.path.abspath(reference_slide_path) if reference_slide_path else None,
+            "gamma": gamma,
+        }, restart)
+        slide = pyvips.Image.new_from_file(slide_path)
+        done = read_manifest(output_dir)
+        total = len(range(0, slide.width, patch_size_w)) * len(range(0, slide.height, patch_size_h))
+        stats[slide_path] = {
+            "slide": slide_file,
+            "output_dir": output_dir,
+            "total_tiles": total,
+            "resumed_tiles": len(done),
+            "written": 0,
+            "background": 0,
+            "bytes_written": 0,
+            "start": None,
+            "seconds": 0.0,
+        }
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        manifests[slide_path] = open(manifest_path, "a")
+        if manifests[slide_path].tell() > 0:
+            with open(manifest_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    manifests[slide_path].write("\n")
+        normalizer = None
+        if normalization is not None:
+            normalizer = slide_normalizer(slide_path, normalization, reference_slide_path, gamma)
+        done_keys = set(done)
+        rows = list(range(0, slide.height, patch_size_h))
+        for i in range(0, len(rows), rows_per_job):
+            y_values = rows[i:i + rows_per_job]
+            job_done = {key for key in done_keys if key[1] in y_values}
+            if len(job_done) == len(range(0, slide.width, patch_size_w)) * len(y_values):
+                continue
+            jobs.append((slide_path, output_dir, y_values, job_done, normalizer))
+
+    try:
+        with ProcessPoolExecutor(max_workers=decode_workers, mp_context=context,
+                                 initializer=init_worker, initargs=(write_slots, vips_threads)) as executor:
+            futures = {}
+            for slide_path, output_dir, y_values, job_done, normalizer in jobs:
+                if stats[slide_path]["start"] is None:
+                    stats[slide_path]["start"] = time.time()
+                future = executor.submit(process_rows, slide_path, output_dir, y_values, patch_size_w, patch_size_h,
+                                         lower_bnd_intensity, upper_bnd_intensity, compression, job_done, normalizer)
+                futures[future] = slide_path
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Tiling .mrxs files"):
+                slide_path = futures[future]
+                manifest = manifests[slide_path]
+                slide_stats = stats[slide_path]
+                for x, y, status, size in future.result():
+                    manifest.write(f"{x}\t{y}\t{status}\t{size}\n")
+                    slide_stats[status] += 1
+                    slide_stats["bytes_written"] += size
+                manifest.flush()
+                slide_stats["seconds"] = time.time() - slide_stats["start"]
+    finally:
+        for manifest in manifests.values():
+            manifest.close()
+
+    for slide_stats in stats.values():
+        processed = slide_stats["written"] + slide_stats["background"]
+        slide_stats["tiles_per_sec"] = processed / slide_stats["seconds"] if slide_stats["seconds"] > 0 else 0.0
+        del slide_stats["start"]
+    return list(stats.values())
+
+
+def print_report(stats):
+    for slide_stats in stats:
+        print(f"{slide_stats['slide']}: {slide_stats['written']} written, {slide_stats['background']} background, "
+              f"{slide_stats['resumed_tiles']} resumed of {slide_stats['total_tiles']} tiles, "
+              f"{slide_stats['tiles_per_sec']:.1f} tiles/sec, {slide_stats['bytes_written'] / 1e6:.1f} MB written")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable multi-slide tiling across worker processes.")
+    parser.add_argument("base_slide_path", help="Folder containing .mrxs slides")
+    parser.add_argument("output_root")
+    parser.add_argument("--patch-size-w", type=int, default=1637)
+    parser.add_argument("--patch-size-h", type=int, default=1018)
+    parser.add_argument("--lower-bnd-intensity", type=int, default=240)
+    parser.add_argument("--upper-bnd-intensity", type=int, default=255)
+    parser.add_argument("--compression", type=int, default=9)
+    parser.add_argument("--decode-workers", type=int, default=None, help="Worker processes reading the slides")
+    parser.add_argument("--write-workers", type=int, default=2, help="Tiles encoded and written at the same time")
+    parser.add_argument("--rows-per-job", type=int, default=1)
+    parser.add_argument("--normalization", choices=["gamma", "percentile", "reinhard", "macenko"], default=None)
+    parser.add_argument("--reference-slide", default=None, help="Reference slide for reinhard/macenko targets")
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--restart", action="store_true", help="Discard earlier output tiled with other settings")
+    args = parser.parse_args()
+
+    base_slide_path = os.path.expanduser(args.base_slide_path)
+    slide_paths = sorted(os.path.join(base_slide_path, f) for f in os.listdir(base_slide_path) if f.endswith(".mrxs"))
+    stats = schedule_slides(slide_paths, os.path.expanduser(args.output_root),
+                            patch_size_w=args.patch_size_w, patch_size_h=args.patch_size_h,
+                            lower_bnd_intensity=args.lower_bnd_intensity, upper_bnd_intensity=args.upper_bnd_intensity,
+                            compression=args.compression, decode_workers=args.decode_workers,
+                            write_workers=args.write_workers, rows_per_job=args.rows_per_job,
+                            normalization=args.normalization, reference_slide_path=args.reference_slide, gamma=args.gamma,
+                            restart=args.restart)
+    print_report(stats)
+
+
+if __name__ == "__main__":
+    main()
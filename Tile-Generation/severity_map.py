@@ -0,0 +1,255 @@
+import os
+import csv
+import json
+import argparse
+
+import cv2 as cv
+import numpy as np
+
+from tile_store import TileStoreReader, is_tile_store, parse_tile_name
+
+# Same cut points as get_label in the eval notebook: 0 -> 0, 1-4 -> 1, 5+ -> 2
+SEVERITY_BINS = [1, 5]
+NUM_LABELS = 3
+# Planes summed over the cells of each pyramid level
+PLANES = ["count", "scored", "label"] + [f"label_{k}" for k in range(NUM_LABELS)]
+
+
+def severity_labels(counts):
+    return np.digitize(np.asarray(counts), SEVERITY_BINS)
+
+
+def tile_keys(source):
+    """
+    (x, y) of every tile the tiler kept, i.e. the tissue tiles, from a tile folder or tile store.
+    """
+    if is_tile_store(source):
+        with TileStoreReader(source) as reader:
+            return list(reader.keys())
+    return [parse_tile_name(name) for name in os.listdir(source) if name.startswith("tile_") and name.endswith(".png")]
+
+
+def counts_from_detections(csv_path):
+    """
+    {(tile_x, tile_y): detections} from a slide_inference detection CSV.
+    """
+    counts = {}
+    with open(csv_path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            key = (int(row["tile_x"]), int(row["tile_y"]))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def counts_from_metrics(csv_path, column="predicted neutrophils"):
+    """
+    {(tile_x, tile_y): count} from an eval output_metrics CSV (one row per tile_<x>_<y>.png).
+    """
+    with open(csv_path, "r", newline="", encoding="utf-8-sig") as f:
+        return {parse_tile_name(row["name"]): int(row[column]) for row in csv.DictReader(f)}
+
+
+def summed_area_table(grid):
+    """
+    (h + 1, w + 1, planes) table with a zero first row and column, so any cell rectangle
+    sums with four lookups.
+    """
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1, grid.shape[2]))
+    np.cumsum(np.cumsum(grid, axis=0), axis=1, out=table[1:, 1:])
+    return table
+
+
+def downsample(grid):
+    h, w, planes = grid.shape
+    padded = np.zeros((h + h % 2, w + w % 2, planes))
+    padded[:h, :w] = grid
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, planes).sum(axis=(1, 3))
+
+
+class SeverityMap:
+    """
+    Per-slide raster of tile detection counts and severity labels on the tiler grid (one cell
+    per patch_size_w x patch_size_h tile), plus a pyramid where each level sums 2 x 2 cells of
+    the one below. Cells without a scored tile count as no tissue, so means are over tissue only.
+
+    Every level keeps a summed-area table, so the sum or mean over any rectangle is four lookups
+    per plane regardless of its size.
+    """
+
+    def __init__(self, width, height, patch_size_w=1637, patch_size_h=1018, slide=""):
+        self.width = width
+        self.height = height
+        self.patch_size_w = patch_size_w
+        self.patch_size_h = patch_size_h
+        self.slide = slide
+        grid_h = -(-height // patch_size_h)
+        grid_w = -(-width // patch_size_w)
+        self.levels = [np.zeros((grid_h, grid_w, len(PLANES)))]
+        while self.levels[-1].shape[0] > 1 or self.levels[-1].shape[1] > 1:
+            self.levels.append(downsample(self.levels[-1]))
+        self.tables = [summed_area_table(level) for level in self.levels]
+
+    def cell(self, tile_x, tile_y):
+        return tile_y // self.patch_size_h, tile_x // self.patch_size_w
+
+    def cell_values(self, counts):
+        counts = np.asarray(counts, dtype=float)
+        labels = severity_labels(counts)
+        values = np.zeros((len(counts), len(PLANES)))
+        values[:, 0] = counts
+        values[:, 1] = 1
+        values[:, 2] = labels
+        values[np.arange(len(counts)), 3 + labels] = 1
+        return values
+
+    def update(self, counts, cleared=()):
+        """
+        Set the count of the tiles in counts ({(tile_x, tile_y): count}) and mark the tiles in
+        cleared as unscored. Only the ancestors of the changed cells are recomputed.
+        """
+        keys = list(counts)
+        rows = np.array([self.cell(x, y)[0] for x, y in keys] + [self.cell(x, y)[0] for x, y in cleared], dtype=int)
+        cols = np.array([self.cell(x, y)[1] for x, y in keys] + [self.cell(x, y)[1] for x, y in cleared], dtype=int)
+        if not len(rows):
+            return
+        values = np.zeros((len(rows), len(PLANES)))
+        if keys:
+            values[:len(keys)] = self.cell_values([counts[key] for key in keys])
+        self.levels[0][rows, cols] = values
+
+        for level in range(1, len(self.levels)):
+            rows, cols = np.unique(np.stack([rows // 2, cols // 2]), axis=1)
+            below = self.levels[level - 1]
+            for r, c in zip(rows, cols):
+                self.levels[level][r, c] = below[2 * r:2 * r + 2, 2 * c:2 * c + 2].sum(axis=(0, 1))
+        # rebuilding a table is one cumsum over a grid of a few thousand cells at most
+        self.tables = [summed_area_table(level) for level in self.levels]
+
+    def region_sums(self, x1, y1, x2, y2, level=0):
+        """
+        Plane sums over the cells of a level touched by the slide rectangle (x1, y1)-(x2, y2).
+        """
+        scale = 2 ** level
+        grid_h, grid_w = self.levels[level].shape[:2]
+        c1 = min(max(int(x1 // (self.patch_size_w * scale)), 0), grid_w)
+        r1 = min(max(int(y1 // (self.patch_size_h * scale)), 0), grid_h)
+        c2 = min(max(int(-(-x2 // (self.patch_size_w * scale))), c1), grid_w)
+        r2 = min(max(int(-(-y2 // (self.patch_size_h * scale))), r1), grid_h)
+        table = self.tables[level]
+        sums = table[r2, c2] - table[r1, c2] - table[r2, c1] + table[r1, c1]
+        return dict(zip(PLANES, sums))
+
+    def query(self, x1=0, y1=0, x2=None, y2=None, level=0):
+        """
+        Tissue tiles, total and mean count, mean severity and the share of tiles at each label
+        inside a slide rectangle (the whole slide by default).
+        """
+        sums = self.region_sums(x1, y1, self.width if x2 is None else x2, self.height if y2 is None else y2, level)
+        tiles = sums["scored"]
+        result = {"tiles": int(tiles), "total_count": float(sums["count"])}
+        result["mean_count"] = float(sums["count"] / tiles) if tiles else float("nan")
+        result["mean_severity"] = float(sums["label"] / tiles) if tiles else float("nan")
+        for k in range(NUM_LABELS):
+            result[f"fraction_{k}"] = float(sums[f"label_{k}"] / tiles) if tiles else float("nan")
+        return result
+
+    def raster(self, level=0, plane="severity"):
+        """
+        Per-cell mean severity ("severity") or mean count ("density") of a level, nan where no tissue.
+        """
+        grid = self.levels[level]
+        numerator = grid[..., PLANES.index("label" if plane == "severity" else "count")]
+        scored = grid[..., PLANES.index("scored")]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(scored > 0, numerator / scored, np.nan)
+
+    def render(self, output_path, level=0, plane="severity", cell_pixels=8):
+        """
+        Colour map of a level (blue low, red high, white no tissue), cell_pixels per cell.
+        """
+        values = self.raster(level, plane)
+        top = NUM_LABELS - 1 if plane == "severity" else max(np.nanmax(values) if np.isfinite(values).any() else 1, 1)
+        scaled = np.nan_to_num(np.clip(values / top, 0, 1) * 255).astype(np.uint8)
+        image = cv.applyColorMap(scaled, cv.COLORMAP_JET)
+        image[np.isnan(values)] = 255
+        image = cv.resize(image, (image.shape[1] * cell_pixels, image.shape[0] * cell_pixels),
+                          interpolation=cv.INTER_NEAREST)
+        cv.imwrite(output_path, image)
+        return output_path
+
+    def save(self, path):
+        meta = {"slide": self.slide, "width": self.width, "height": self.height,
+                "patch_size_w": self.patch_size_w, "patch_size_h": self.patch_size_h, "planes": PLANES}
+        temp_path = path + ".part.npz"
+        np.savez_compressed(temp_path, meta=json.dumps(meta),
+                            **{f"level_{i}": level.astype(np.float32) for i, level in enumerate(self.levels)})
+        os.replace(temp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            severity_map = cls(meta["width"], meta["height"], meta["patch_size_w"], meta["patch_size_h"], meta["slide"])
+            severity_map.levels = [data[f"level_{i}"].astype(float) for i in range(len(severity_map.levels))]
+        severity_map.tables = [summed_area_table(level) for level in severity_map.levels]
+        return severity_map
+
+
+def build_severity_map(counts, tissue_tiles, width, height, patch_size_w=1637, patch_size_h=1018, slide=""):
+    """
+    SeverityMap of one slide. tissue_tiles are all scored tiles (tiles without detections
+    count as 0); counts only needs the tiles with detections.
+    """
+    severity_map = SeverityMap(width, height, patch_size_w, patch_size_h, slide)
+    severity_map.update({key: counts.get(key, 0) for key in set(tissue_tiles) | set(counts)})
+    return severity_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a slide-level neutrophil severity pyramid.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("detections", help="slide_inference detection CSV, or an output_metrics CSV with --metrics")
+    build_parser.add_argument("output", help="Severity map .npz")
+    build_parser.add_argument("--tiles", default=None, help="Tile folder or tile store listing the tissue tiles")
+    build_parser.add_argument("--metrics", action="store_true")
+    build_parser.add_argument("--slide", default=None, help="Slide file, for its size (needs pyvips)")
+    build_parser.add_argument("--width", type=int, default=None)
+    build_parser.add_argument("--height", type=int, default=None)
+    build_parser.add_argument("--patch-width", type=int, default=1637)
+    build_parser.add_argument("--patch-height", type=int, default=1018)
+    build_parser.add_argument("--render", default=None, help="Also write the severity map as a PNG")
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("map")
+    query_parser.add_argument("--rect", type=int, nargs=4, default=None, metavar=("X1", "Y1", "X2", "Y2"))
+    query_parser.add_argument("--level", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        counts = counts_from_metrics(args.detections) if args.metrics else counts_from_detections(args.detections)
+        tissue_tiles = tile_keys(args.tiles) if args.tiles else list(counts)
+        width, height = args.width, args.height
+        if args.slide:
+            import pyvips
+            slide = pyvips.Image.new_from_file(args.slide)
+            width, height = slide.width, slide.height
+        if width is None or height is None:
+            width = max(x for x, _ in tissue_tiles) + args.patch_width
+            height = max(y for _, y in tissue_tiles) + args.patch_height
+        slide_name = os.path.basename(args.slide) if args.slide else os.path.basename(args.detections)
+        severity_map = build_severity_map(counts, tissue_tiles, width, height, args.patch_width, args.patch_height,
+                                          slide_name)
+        severity_map.save(args.output)
+        if args.render:
+            severity_map.render(args.render)
+        print(f"{len(severity_map.levels)} levels -> {args.output}")
+        print(severity_map.query())
+    else:
+        severity_map = SeverityMap.load(args.map)
+        rect = args.rect or (0, 0, None, None)
+        print(severity_map.query(*rect, level=args.level))
+
+
+if __name__ == "__main__":
+    main()
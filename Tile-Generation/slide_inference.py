@@ -0,0 +1,234 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyvips
+
+from scheduler import pyvips_to_numpy
+
+DETECTION_FIELDS = ["slide", "x1", "y1", "x2", "y2", "score", "class", "tile_x", "tile_y"]
+
+
+def slide_windows(width, height, patch_size_w=1637, patch_size_h=1018, overlap=128):
+    """
+    One window per tile of the tiler's grid, extended by overlap pixels to the right and bottom
+    so a cell cut by a tile border is whole in the neighbouring window. Yields (x, y, w, h).
+    """
+    for y in range(0, height, patch_size_h):
+        for x in range(0, width, patch_size_w):
+            yield x, y, min(patch_size_w + overlap, width - x), min(patch_size_h + overlap, height - y)
+
+
+def read_window(slide, window, lower_bnd_intensity=240, upper_bnd_intensity=255, patch_size_w=1637,
+                patch_size_h=1018):
+    """
+    RGB array of one window, or None when its tile is background by the tiler's mean-intensity
+    test. The test sees what the tiler sees: the tile without the overlap, with all its bands
+    (alpha included); alpha is only dropped for the detector.
+    """
+    x, y, w, h = window
+    region = pyvips_to_numpy(slide.crop(x, y, w, h))
+    mean_value = np.mean(region[:patch_size_h, :patch_size_w])
+    if lower_bnd_intensity < mean_value <= upper_bnd_intensity:
+        return None
+    return region[:, :, :3]
+
+
+class SpatialIndex:
+    """
+    Uniform grid over slide coordinates; each kept box is registered in every cell it touches.
+    """
+
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell_range(self, box):
+        x1, y1, x2, y2 = (int(v // self.cell_size) for v in box)
+        return ((cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1))
+
+    def add(self, index, box):
+        for cell in self.cell_range(box):
+            self.cells.setdefault(cell, []).append(index)
+
+    def query(self, box):
+        found = set()
+        for cell in self.cell_range(box):
+            found.update(self.cells.get(cell, ()))
+        return found
+
+
+def overlap_scores(box, boxes, metric="ios"):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == "ios":
+        # intersection over the smaller box: a cell cut at a window border lies inside its whole copy
+        return intersection / np.maximum(np.minimum(area, areas), 1e-9)
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def global_nms(boxes, scores, classes, threshold=0.5, metric="ios", cell_size=256, agnostic=False):
+    """
+    Greedy NMS over the whole slide, highest score first. Only boxes sharing a grid cell are
+    compared, so the cost grows with the number of detections, not with their square.
+    Returns the indices kept.
+    """
+    order = np.argsort(-scores, kind="stable")
+    index = SpatialIndex(cell_size)
+    keep = []
+    for i in order:
+        candidates = [j for j in index.query(boxes[i]) if agnostic or classes[j] == classes[i]]
+        if candidates and (overlap_scores(boxes[i], boxes[candidates], metric) > threshold).any():
+            continue
+        keep.append(i)
+        index.add(i, boxes[i])
+    return np.array(keep, dtype=np.int64)
+
+
+def onnx_detector(onnx_path, imgsz=1024, conf=0.25, iou=0.7, threads=None, batch_size=8):
+    """
+    Detector callable backed by Yolo/onnx_inference.OnnxDetector: list of RGB arrays -> list of
+    (boxes, scores, classes) in window pixels. Windows are squashed to imgsz x imgsz like the
+    training tiles.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Yolo"))
+    from onnx_inference import OnnxDetector, squashed
+
+    detector = OnnxDetector(onnx_path, imgsz, conf, iou, threads=threads, batch_size=batch_size)
+    detect = squashed(detector.predict, imgsz)
+    return lambda regions: detect([np.ascontiguousarray(region[:, :, ::-1]) for region in regions])
+
+
+def ultralytics_detector(weights_path, imgsz=1024, conf=0.25, iou=0.7, device=None):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Yolo"))
+    from onnx_inference import squashed
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+
+    def predict(images):
+        results = model.predict(source=list(images), imgsz=imgsz, conf=conf, iou=iou, device=device, verbose=False)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy().astype(int))
+                for r in results]
+
+    detect = squashed(predict, imgsz)
+    return lambda regions: detect([np.ascontiguousarray(region[:, :, ::-1]) for region in regions])
+
+
+def detect_slide(slide_path, detect, output_csv=None, patch_size_w=1637, patch_size_h=1018, overlap=128,
+                 batch_size=8, read_workers=4, prefetch=16, nms_threshold=0.5, nms_metric="ios",
+                 lower_bnd_intensity=240, upper_bnd_intensity=255):
+    """
+    Run detect over every non-background window of a slide and merge all detections with one
+    global NMS in slide coordinates.
+
+    Windows are read by read_workers threads at most prefetch ahead of the detector, so only
+    prefetch + batch_size windows are ever in memory. Writes one row per detection to output_csv
+    (tile_x, tile_y name the tiler tile holding the box centre) and returns (table, stats);
+    stats["tissue_tiles"] lists the (x, y) of every window that was not background.
+    """
+    slide = pyvips.Image.new_from_file(slide_path)
+    windows = list(slide_windows(slide.width, slide.height, patch_size_w, patch_size_h, overlap))
+    boxes, scores, classes = [], [], []
+    stats = {"windows": len(windows), "background": 0, "raw_detections": 0, "tissue_tiles": []}
+    start = time.time()
+
+    def flush(batch):
+        regions = [region for _, region in batch]
+        for ((x, y, _, _), _), (window_boxes, window_scores, window_classes) in zip(batch, detect(regions)):
+            if len(window_boxes):
+                boxes.append(np.asarray(window_boxes, dtype=float) + [x, y, x, y])
+                scores.append(np.asarray(window_scores, dtype=float))
+                classes.append(np.asarray(window_classes, dtype=int))
+
+    def read_ahead():
+        with ThreadPoolExecutor(max_workers=read_workers) as executor:
+            pending = deque()
+            for window in windows:
+                pending.append((window, executor.submit(read_window, slide, window, lower_bnd_intensity,
+                                                        upper_bnd_intensity, patch_size_w, patch_size_h)))
+                if len(pending) >= prefetch:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            while pending:
+                window, future = pending.popleft()
+                yield window, future.result()
+
+    batch = []
+    for window, region in read_ahead():
+        if region is None:
+            stats["background"] += 1
+            continue
+        stats["tissue_tiles"].append(window[:2])
+        batch.append((window, region))
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4))
+    scores = np.concatenate(scores) if scores else np.zeros(0)
+    classes = np.concatenate(classes) if classes else np.zeros(0, dtype=int)
+    stats["raw_detections"] = len(boxes)
+    keep = global_nms(boxes, scores, classes, nms_threshold, nms_metric)
+    boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    tile_x = (centers[:, 0] // patch_size_w * patch_size_w).astype(int)
+    tile_y = (centers[:, 1] // patch_size_h * patch_size_h).astype(int)
+    slide_file = os.path.basename(slide_path)
+    table = [[slide_file, *np.round(box, 1), round(float(score), 4), int(cls), tx, ty]
+             for box, score, cls, tx, ty in zip(boxes, scores, classes, tile_x, tile_y)]
+    if output_csv:
+        temp_path = output_csv + ".part"
+        with open(temp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(DETECTION_FIELDS)
+            writer.writerows(table)
+        os.replace(temp_path, output_csv)
+
+    stats["detections"] = len(table)
+    stats["seconds"] = time.time() - start
+    stats["windows_per_sec"] = (stats["windows"] - stats["background"]) / max(stats["seconds"], 1e-9)
+    return table, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect neutrophils over a whole slide with overlapping windows and global NMS.")
+    parser.add_argument("slide")
+    parser.add_argument("model", help="Exported .onnx model, or .pt weights (needs ultralytics)")
+    parser.add_argument("--output", default=None, help="Detection CSV (default: <slide>_detections.csv)")
+    parser.add_argument("--patch-width", type=int, default=1637)
+    parser.add_argument("--patch-height", type=int, default=1018)
+    parser.add_argument("--overlap", type=int, default=128)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--read-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.model.endswith(".onnx"):
+        detect = onnx_detector(args.model, conf=args.conf, threads=args.threads, batch_size=args.batch_size)
+    else:
+        detect = ultralytics_detector(args.model, conf=args.conf)
+    output = args.output or os.path.splitext(os.path.basename(args.slide))[0] + "_detections.csv"
+    _, stats = detect_slide(args.slide, detect, output, args.patch_width, args.patch_height, args.overlap,
+                            args.batch_size, args.read_workers)
+    print(f"{stats['detections']} detections ({stats['raw_detections']} before NMS) from "
+          f"{stats['windows'] - stats['background']} of {stats['windows']} windows, "
+          f"{stats['windows_per_sec']:.2f} windows/sec -> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import os
+import argparse
+
+import pyvips
+
+from tile_store import TileStoreReader, is_tile_store, parse_tile_name
+
+# RGB versions of the feature colours used by the annotation app
+FEATURE_COLORS = {
+    "Neutrophils": [0, 255, 0],
+    "Hyaline Membranes": [0, 0, 255],
+    "Proteinaceous Debris": [255, 0, 0],
+}
+
+
+def load_coordinates(coord_file_path):
+    boxes = []
+    with open(coord_file_path, "r") as file:
+        for line in file:
+            parts = line.strip().split(",")
+            if len(parts) >= 4:
+                x1, y1, x2, y2 = map(int, map(float, parts[:4]))
+                class_name = parts[4] if len(parts) >= 5 else "Neutrophils"
+                boxes.append((x1, y1, x2, y2, class_name))
+    return boxes
+
+
+def draw_boxes(tile, boxes, line_width=4):
+    # draw_rect works on a private in-memory copy, so only annotated tiles are ever decoded up front
+    for x1, y1, x2, y2, class_name in boxes:
+        color = FEATURE_COLORS.get(class_name, [0, 255, 0])
+        if tile.bands == 4:
+            color = color + [255]
+        x1, x2 = sorted((max(0, x1), min(tile.width - 1, x2)))
+        y1, y2 = sorted((max(0, y1), min(tile.height - 1, y2)))
+        for i in range(line_width):
+            if x2 - x1 <= 2 * i or y2 - y1 <= 2 * i:
+                break
+            tile = tile.draw_rect(color, x1 + i, y1 + i, x2 - x1 - 2 * i, y2 - y1 - 2 * i)
+    return tile
+
+
+def tile_sources(source):
+    """
+    Map (x, y) to a zero-argument loader returning a lazy pyvips image, for a folder or a tile store.
+    """
+    if is_tile_store(source):
+        reader = TileStoreReader(source)
+        def from_store(x, y):
+            # keep only the encoded bytes (or a view into the shard) alive until libvips needs the pixels
+            if reader.codec == "raw":
+                record = reader.index[reader.lookup[(x, y)]]
+                return pyvips.Image.new_from_memory(reader.read_view(x, y), int(record["width"]),
+                                                    int(record["height"]), int(record["bands"]), "uchar")
+            return pyvips.Image.new_from_buffer(reader.read_bytes(x, y), "")
+        return {key: (lambda key=key: from_store(*key)) for key in reader.keys()}
+
+    sources = {}
+    for tile_file in os.listdir(source):
+        if not tile_file.startswith("tile_") or not tile_file.endswith(".png"):
+            continue
+        path = os.path.join(source, tile_file)
+        sources[parse_tile_name(tile_file)] = lambda path=path: pyvips.Image.new_from_file(path)
+    return sources
+
+
+def stitch_tiles(source, width, height, patch_size_w, patch_size_h, output_path,
+                 coords_dir=None, output_format="dz", background=0, tile_size=256, quality=90):
+    """
+    Assemble tiles of a slide into a single pyramidal image with one arrayjoin.
+
+    source is a tile folder or tile store produced by generate_tiles. Skipped background
+    tiles are filled with `background`. output_format is "dz" (DeepZoom, output_path is
+    the base name) or "tiff" (pyramidal tiled TIFF). Returns the path written.
+    """
+    sources = tile_sources(source)
+    if not sources:
+        raise FileNotFoundError(f"No tiles found in {source}")
+
+    columns = (width + patch_size_w - 1) // patch_size_w
+    rows = (height + patch_size_h - 1) // patch_size_h
+    bands = sources[next(iter(sources))]().bands
+
+    boxes_by_tile = {}
+    if coords_dir is not None:
+        for coord_file in os.listdir(coords_dir):
+            if coord_file.endswith("_coords.txt"):
+                boxes_by_tile[parse_tile_name(coord_file)] = load_coordinates(os.path.join(coords_dir, coord_file))
+
+    filler = pyvips.Image.black(patch_size_w, patch_size_h, bands=bands) + background
+    filler = filler.cast("uchar")
+    grid = []
+    for row in range(rows):
+        for column in range(columns):
+            x, y = column * patch_size_w, row * patch_size_h
+            loader = sources.pop((x, y), None)
+            if loader is None:
+                grid.append(filler)
+                continue
+            tile = loader()
+            if tile.bands != bands:
+                tile = tile.extract_band(0, n=bands) if tile.bands > bands else tile.bandjoin_const([255] * (bands - tile.bands))
+            if (x, y) in boxes_by_tile:
+                tile = draw_boxes(tile, boxes_by_tile[(x, y)])
+            grid.append(tile)
+
+    if sources:
+        raise ValueError(f"{len(sources)} tiles are not on the {patch_size_w}x{patch_size_h} grid, e.g. {next(iter(sources))}")
+
+    full_image = pyvips.Image.arrayjoin(grid, across=columns, background=[background] * bands)
+    full_image = full_image.crop(0, 0, width, height)
+    if full_image.bands == 4:
+        full_image = full_image.flatten(background=[background] * 3)
+
+    if output_format == "dz":
+        full_image.dzsave(output_path, tile_size=tile_size, overlap=0, suffix=f".jpg[Q={quality}]")
+        return output_path + ".dzi"
+    if output_format == "tiff":
+        full_image.tiffsave(output_path, tile=True, tile_width=tile_size, tile_height=tile_size, pyramid=True,
+                            compression="jpeg", Q=quality, bigtiff=True)
+        return output_path
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stitch slide tiles into a DeepZoom or pyramidal TIFF image.")
+    parser.add_argument("source", help="Tile folder or tile store")
+    parser.add_argument("output_path")
+    parser.add_argument("--slide", help="Slide file used to read the full width and height")
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--patch-size-w", type=int, default=1637)
+    parser.add_argument("--patch-size-h", type=int, default=1018)
+    parser.add_argument("--coords-dir", help="Folder of tile_{x}_{y}_coords.txt annotations to overlay")
+    parser.add_argument("--format", choices=["dz", "tiff"], default="dz")
+    parser.add_argument("--background", type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = args.width, args.height
+    if args.slide:
+        slide = pyvips.Image.new_from_file(args.slide)
+        width, height = slide.width, slide.height
+    if width is None or height is None:
+        parser.error("either --slide or both --width and --height are required")
+
+    output = stitch_tiles(args.source, width, height, args.patch_size_w, args.patch_size_h, args.output_path,
+                          coords_dir=args.coords_dir, output_format=args.format, background=args.background)
+    print(f"Saved: {output}")
+
+
+if __name__ == "__main__":
+    main()
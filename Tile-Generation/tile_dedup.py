@@ -0,0 +1,310 @@
+import os
+import csv
+import json
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from tile_store import TileStoreReader, is_tile_store, parse_tile_name, TILE_NAME_PATTERN
+
+INDEX_NAME = "dedup_index.npz"
+TILE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+HASH_BANDS = 4
+BAND_BITS = 64 // HASH_BANDS
+# tiles flatter than this (grey level std) hash to noise, so they are only matched by coordinates
+MIN_HASH_STD = 2.0
+
+
+def difference_hash(tile_array):
+    """
+    64-bit dHash of a tile: whether each pixel of a 9 x 8 grey thumbnail is brighter than its
+    right neighbour. Robust to re-encoding, small shifts and the app's 1280x512 resize.
+    None for near-uniform tiles.
+    """
+    tile_array = np.asarray(tile_array)
+    if tile_array.ndim == 3:
+        grey = tile_array[..., :3].mean(axis=2, dtype=np.float32) if tile_array.shape[2] >= 3 else tile_array[..., 0]
+    else:
+        grey = tile_array
+    grey = np.asarray(grey, dtype=np.float32)
+    if grey.std() < MIN_HASH_STD:
+        return None
+    thumbnail = cv.resize(grey, (9, 8), interpolation=cv.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def overlap_fraction(a, b):
+    """
+    Intersection of two (x, y, w, h) rectangles over the smaller one's area, so a tile lying
+    inside a bigger one counts as a full duplicate.
+    """
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    return w * h / min(a[2] * a[3], b[2] * b[3])
+
+
+class TileIndex:
+    """
+    Duplicate lookup over tiles from any number of slides.
+
+    Coordinates: every tile rectangle is registered in the cells of a uniform grid (cell_size
+    slide pixels) of its group, the slide it was cut from, so an overlap query only looks at
+    the tiles sharing a cell with it. Appearance: the 64-bit dHash is split into HASH_BANDS
+    16-bit bands, each with its own table. Two hashes within max_distance bits differ in at
+    most max_distance // HASH_BANDS bits in one of their bands, so a hash query only probes
+    the band values that close to its own and compares the few tiles found there.
+    """
+
+    def __init__(self, cell_size=1024, min_overlap=0.5, max_distance=6):
+        self.cell_size = cell_size
+        self.min_overlap = min_overlap
+        self.max_distance = max_distance
+        self.names = []
+        self.ids = {}
+        self.groups = []
+        self.rects = []
+        self.hashes = []
+        self.grid = {}
+        self.bands = [{} for _ in range(HASH_BANDS)]
+        radius = max_distance // HASH_BANDS
+        self.probes = [sum(1 << bit for bit in bits)
+                       for r in range(radius + 1) for bits in itertools.combinations(range(BAND_BITS), r)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def cells(self, group, rect):
+        x, y, w, h = rect
+        for row in range(y // self.cell_size, (y + h - 1) // self.cell_size + 1):
+            for col in range(x // self.cell_size, (x + w - 1) // self.cell_size + 1):
+                yield group, row, col
+
+    def band_keys(self, phash):
+        return [(phash >> (BAND_BITS * band)) & ((1 << BAND_BITS) - 1) for band in range(HASH_BANDS)]
+
+    def add(self, name, group, rect, phash=None):
+        tile_id = len(self.names)
+        self.names.append(name)
+        self.ids[name] = tile_id
+        self.groups.append(group)
+        self.rects.append(tuple(rect) if rect is not None else None)
+        self.hashes.append(phash)
+        if rect is not None:
+            for cell in self.cells(group, rect):
+                self.grid.setdefault(cell, []).append(tile_id)
+        if phash is not None:
+            for table, key in zip(self.bands, self.band_keys(phash)):
+                table.setdefault(key, []).append(tile_id)
+        return tile_id
+
+    def query_overlap(self, group, rect):
+        """
+        [(tile id, overlap fraction)] of the indexed tiles of group overlapping rect by at least min_overlap.
+        """
+        candidates = set()
+        for cell in self.cells(group, rect):
+            candidates.update(self.grid.get(cell, ()))
+        matches = [(tile_id, overlap_fraction(rect, self.rects[tile_id])) for tile_id in sorted(candidates)]
+        return [(tile_id, overlap) for tile_id, overlap in matches if overlap >= self.min_overlap]
+
+    def query_hash(self, phash):
+        """
+        [(tile id, Hamming distance)] of the indexed tiles within max_distance bits of phash.
+        """
+        candidates = set()
+        for table, key in zip(self.bands, self.band_keys(phash)):
+            for probe in self.probes:
+                candidates.update(table.get(key ^ probe, ()))
+        matches = [(tile_id, hamming(phash, self.hashes[tile_id])) for tile_id in sorted(candidates)]
+        return [(tile_id, distance) for tile_id, distance in matches if distance <= self.max_distance]
+
+    def find_duplicate(self, group, rect, phash=None):
+        """
+        (tile id, reason, overlap, distance) of the first indexed tile this one duplicates, or None.
+        Coordinate overlap is checked first since it is exact.
+        """
+        if rect is not None:
+            matches = self.query_overlap(group, rect)
+            if matches:
+                tile_id, overlap = max(matches, key=lambda match: match[1])
+                return tile_id, "overlap", overlap, None
+        if phash is not None:
+            matches = self.query_hash(phash)
+            if matches:
+                tile_id, distance = min(matches, key=lambda match: match[1])
+                return tile_id, "phash", None, distance
+        return None
+
+    def save(self, path):
+        meta = {"cell_size": self.cell_size, "min_overlap": self.min_overlap, "max_distance": self.max_distance,
+                "names": self.names, "groups": self.groups}
+        rects = np.array([rect if rect is not None else (-1, -1, 0, 0) for rect in self.rects], dtype=np.int64)
+        hashes = np.array([phash if phash is not None else 0 for phash in self.hashes], dtype=np.uint64)
+        has_hash = np.array([phash is not None for phash in self.hashes], dtype=bool)
+        temp_path = path + ".part.npz"
+        np.savez_compressed(temp_path, meta=json.dumps(meta), rects=rects.reshape(-1, 4), hashes=hashes,
+                            has_hash=has_hash)
+        os.replace(temp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            rects, hashes, has_hash = data["rects"], data["hashes"], data["has_hash"]
+        index = cls(meta["cell_size"], meta["min_overlap"], meta["max_distance"])
+        for i, (name, group) in enumerate(zip(meta["names"], meta["groups"])):
+            rect = tuple(int(v) for v in rects[i]) if rects[i][2] > 0 else None
+            index.add(name, group, rect, int(hashes[i]) if has_hash[i] else None)
+        return index
+
+
+def image_size(path):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def tile_rect(name, width, height):
+    if TILE_NAME_PATTERN.search(os.path.basename(name)) is None:
+        return None
+    x, y = parse_tile_name(name)
+    return x, y, width, height
+
+
+def folder_tiles(root, group_by="parent"):
+    """
+    (path, group) of every tile image under root. group_by "parent" takes the folder holding
+    the tile as its slide (Tiles/<observer>/<mouse>/ -> mouse), "none" puts every tile in one slide.
+    """
+    tiles = []
+    for dirpath, _, filenames in os.walk(root):
+        group = os.path.basename(dirpath) if group_by == "parent" else ""
+        for name in sorted(filenames):
+            if name.lower().endswith(TILE_EXTENSIONS):
+                tiles.append((os.path.join(dirpath, name), group))
+    return sorted(tiles)
+
+
+def describe_file(path):
+    tile_array = cv.imread(path, cv.IMREAD_GRAYSCALE)
+    if tile_array is None:
+        raise FileNotFoundError(path)
+    height, width = tile_array.shape[:2]
+    return tile_rect(path, width, height), difference_hash(tile_array)
+
+
+def scan(sources, index=None, group_by="parent", workers=None, use_hash=True):
+    """
+    Insert the tiles of the given tile folders and tile stores into index in a fixed order and
+    return one record per tile: the first tile seen is kept, later ones point at it.
+    """
+    index = index if index is not None else TileIndex()
+    records = []
+    for source in sources:
+        if is_tile_store(source):
+            group = os.path.basename(os.path.normpath(source)) if group_by == "parent" else ""
+            with TileStoreReader(source) as reader:
+                sizes = {(int(r["x"]), int(r["y"])): (int(r["width"]), int(r["height"])) for r in reader.index}
+                keys = reader.keys()
+
+                def describe_stored(key):
+                    rect = (key[0], key[1]) + sizes[key]
+                    return rect, difference_hash(reader.get(*key)) if use_hash else None
+
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    described = list(executor.map(describe_stored, keys))
+            entries = [(os.path.join(source, f"tile_{x}_{y}.png"), group) for x, y in keys]
+        else:
+            entries = folder_tiles(source, group_by)
+            if use_hash:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    described = list(executor.map(describe_file, [path for path, _ in entries]))
+            else:
+                described = [(tile_rect(path, *image_size(path)), None) for path, _ in entries]
+
+        for (path, group), (rect, phash) in zip(entries, described):
+            if path in index:
+                # indexed by an earlier run
+                records.append({"name": path, "group": group, "duplicate_of": "", "reason": "", "overlap": "",
+                                "distance": ""})
+                continue
+            match = index.find_duplicate(group, rect, phash)
+            record = {"name": path, "group": group, "duplicate_of": "", "reason": "", "overlap": "", "distance": ""}
+            if match is not None:
+                tile_id, reason, overlap, distance = match
+                record.update(duplicate_of=index.names[tile_id], reason=reason,
+                              overlap="" if overlap is None else round(overlap, 3),
+                              distance="" if distance is None else distance)
+            else:
+                index.add(path, group, rect, phash)
+            records.append(record)
+    return index, records
+
+
+def write_report(records, report_path):
+    with open(report_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["name", "group", "duplicate_of", "reason", "overlap", "distance"])
+        writer.writeheader()
+        writer.writerows(record for record in records if record["duplicate_of"])
+    return report_path
+
+
+def drop_duplicates(records, dry_run=False):
+    """
+    Delete the duplicate tile files (tile stores are append-only and are left as they are).
+    """
+    dropped = []
+    for record in records:
+        if record["duplicate_of"] and os.path.isfile(record["name"]):
+            if not dry_run:
+                os.remove(record["name"])
+            dropped.append(record["name"])
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find tiles that overlap or look like an earlier tile.")
+    parser.add_argument("sources", nargs="+", help="Tile folders (searched recursively) or tile stores, in priority order")
+    parser.add_argument("--report", default="duplicates.csv")
+    parser.add_argument("--index", default=None, help=f"Index to extend and save, e.g. {INDEX_NAME}")
+    parser.add_argument("--group-by", choices=["parent", "none"], default="parent",
+                        help="Slide of a tile: its folder, or one slide for all sources")
+    parser.add_argument("--cell-size", type=int, default=1024)
+    parser.add_argument("--min-overlap", type=float, default=0.5)
+    parser.add_argument("--max-distance", type=int, default=6, help="dHash bits")
+    parser.add_argument("--no-hash", action="store_true", help="Coordinates only, without decoding tiles")
+    parser.add_argument("--drop", action="store_true", help="Delete duplicate tile files")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.index and os.path.exists(args.index):
+        index = TileIndex.load(args.index)
+    else:
+        index = TileIndex(args.cell_size, args.min_overlap, args.max_distance)
+    index, records = scan(args.sources, index, args.group_by, args.workers, not args.no_hash)
+    write_report(records, args.report)
+    duplicates = sum(1 for record in records if record["duplicate_of"])
+    print(f"{duplicates} of {len(records)} tiles duplicate an earlier tile -> {args.report}")
+    if args.drop:
+        print(f"Dropped {len(drop_duplicates(records))} tile files")
+    if args.index:
+        index.save(args.index)
+
+
+if __name__ == "__main__":
+    main()
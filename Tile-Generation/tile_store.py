@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import mmap
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+INDEX_FILE = "index.npy"
+META_FILE = "meta.json"
+SHARD_NAME = "shard_{:05d}.bin"
+
+INDEX_DTYPE = np.dtype([
+    ("x", np.int64),
+    ("y", np.int64),
+    ("width", np.int32),
+    ("height", np.int32),
+    ("bands", np.int32),
+    ("shard", np.int32),
+    ("offset", np.int64),
+    ("length", np.int64),
+])
+
+TILE_NAME_PATTERN = re.compile(r"tile_(\d+)_(\d+)")
+
+
+def parse_tile_name(name):
+    match = TILE_NAME_PATTERN.search(os.path.basename(name))
+    if match is None:
+        raise ValueError(f"Not a tile name: {name}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def is_tile_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE)) and os.path.isfile(os.path.join(path, META_FILE))
+
+
+def encode_tile(tile_array, codec, level):
+    if codec == "raw":
+        return np.ascontiguousarray(tile_array, dtype=np.uint8).tobytes()
+    if tile_array.ndim == 3 and tile_array.shape[2] == 3:
+        tile_array = cv.cvtColor(tile_array, cv.COLOR_RGB2BGR)
+    elif tile_array.ndim == 3 and tile_array.shape[2] == 4:
+        tile_array = cv.cvtColor(tile_array, cv.COLOR_RGBA2BGRA)
+    if codec == "png":
+        ok, buffer = cv.imencode(".png", tile_array, [cv.IMWRITE_PNG_COMPRESSION, level])
+    elif codec == "jpeg":
+        ok, buffer = cv.imencode(".jpg", tile_array, [cv.IMWRITE_JPEG_QUALITY, level])
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+    if not ok:
+        raise RuntimeError(f"Failed to encode tile with codec {codec}")
+    return buffer.tobytes()
+
+
+def decode_tile(buffer, codec, width, height, bands):
+    if codec == "raw":
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, bands)
+    tile_array = cv.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv.IMREAD_UNCHANGED)
+    if tile_array is None:
+        raise RuntimeError("Failed to decode tile")
+    if tile_array.ndim == 2:
+        return tile_array[..., np.newaxis]
+    if tile_array.shape[2] == 3:
+        return cv.cvtColor(tile_array, cv.COLOR_BGR2RGB)
+    return cv.cvtColor(tile_array, cv.COLOR_BGRA2RGBA)
+
+
+class TileStoreWriter:
+    """
+    Appends encoded tiles to a few large shard files instead of one PNG per tile.
+    Encoding runs in the calling thread so a ThreadPoolExecutor keeps all cores busy;
+    only the append to the current shard is serialized.
+    """
+
+    def __init__(self, store_dir, codec="png", level=1, shard_bytes=1 << 30, metadata=None):
+        if codec not in ("png", "jpeg", "raw"):
+            raise ValueError(f"Unknown codec: {codec}")
+        if is_tile_store(store_dir):
+            raise FileExistsError(f"Tile store already exists: {store_dir}")
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.codec = codec
+        self.level = level
+        self.shard_bytes = shard_bytes
+        self.metadata = metadata or {}
+        self.records = []
+        self.keys = set()
+        self.lock = threading.Lock()
+        self.shard_index = -1
+        self.shard_file = None
+        self.shard_offset = 0
+        self.bytes_written = 0
+        self.open_next_shard()
+
+    def open_next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_index += 1
+        self.shard_file = open(os.path.join(self.store_dir, SHARD_NAME.format(self.shard_index)), "wb")
+        self.shard_offset = 0
+
+    def add(self, x, y, tile_array):
+        if tile_array.ndim == 2:
+            tile_array = tile_array[..., np.newaxis]
+        height, width, bands = tile_array.shape
+        buffer = encode_tile(tile_array, self.codec, self.level)
+        with self.lock:
+            if (x, y) in self.keys:
+                raise KeyError(f"Tile ({x}, {y}) already written")
+            if self.shard_offset > 0 and self.shard_offset + len(buffer) > self.shard_bytes:
+                self.open_next_shard()
+            self.shard_file.write(buffer)
+            self.records.append((x, y, width, height, bands, self.shard_index, self.shard_offset, len(buffer)))
+            self.keys.add((x, y))
+            self.shard_offset += len(buffer)
+            self.bytes_written += len(buffer)
+        return len(buffer)
+
+    def close(self):
+        with self.lock:
+            if self.shard_file is None:
+                return
+            self.shard_file.close()
+            self.shard_file = None
+            index = np.array(self.records, dtype=INDEX_DTYPE)
+            np.save(os.path.join(self.store_dir, INDEX_FILE), index)
+            meta = dict(self.metadata)
+            meta.update({
+                "codec": self.codec,
+                "level": self.level,
+                "num_tiles": len(index),
+                "num_shards": self.shard_index + 1,
+                "bytes_written": self.bytes_written,
+            })
+            with open(os.path.join(self.store_dir, META_FILE), "w") as f:
+                json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class TileStoreReader:
+    """
+    Random access to a tile store by slide coordinates.
+    Shards are memory-mapped, so get(x, y) is a dict lookup plus one decode.
+    """
+
+    def __init__(self, store_dir):
+        if not is_tile_store(store_dir):
+            raise FileNotFoundError(f"Not a tile store: {store_dir}")
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.codec = self.meta["codec"]
+        self.index = np.load(os.path.join(store_dir, INDEX_FILE))
+        self.lookup = {(int(x), int(y)): i for i, (x, y) in enumerate(zip(self.index["x"], self.index["y"]))}
+        self.shards = {}
+
+    def shard(self, shard_index):
+        shard_map = self.shards.get(shard_index)
+        if shard_map is None:
+            with open(os.path.join(self.store_dir, SHARD_NAME.format(shard_index)), "rb") as f:
+                shard_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.shards[shard_index] = shard_map
+        return shard_map
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return tuple(key) in self.lookup
+
+    def keys(self):
+        return [(int(x), int(y)) for x, y in zip(self.index["x"], self.index["y"])]
+
+    def names(self):
+        return [f"tile_{x}_{y}.png" for x, y in self.keys()]
+
+    def read_view(self, x, y):
+        record = self.index[self.lookup[(x, y)]]
+        start = int(record["offset"])
+        return memoryview(self.shard(int(record["shard"])))[start:start + int(record["length"])]
+
+    def read_bytes(self, x, y):
+        return bytes(self.read_view(x, y))
+
+    def get(self, x, y):
+        record = self.index[self.lookup[(x, y)]]
+        return decode_tile(self.read_bytes(x, y), self.codec,
+                           int(record["width"]), int(record["height"]), int(record["bands"]))
+
+    def get_by_name(self, name):
+        return self.get(*parse_tile_name(name))
+
+    def items(self):
+        order = np.lexsort((self.index["offset"], self.index["shard"]))
+        for i in order:
+            x, y = int(self.index["x"][i]), int(self.index["y"][i])
+            yield (x, y), self.get(x, y)
+
+    def close(self):
+        for shard_map in self.shards.values():
+            try:
+                shard_map.close()
+            except BufferError:
+                # views handed out with read_view are still alive; the mapping is freed with them
+                pass
+        self.shards = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_tile(source, name):
+    """
+    Load a tile as an RGB(A) uint8 array from either a tile store or a folder of tile PNGs.
+    """
+    if isinstance(source, TileStoreReader):
+        return source.get_by_name(name)
+    tile_array = cv.imread(os.path.join(source, name), cv.IMREAD_UNCHANGED)
+    if tile_array is None:
+        raise FileNotFoundError(os.path.join(source, name))
+    if tile_array.ndim == 3 and tile_array.shape[2] == 4:
+        return cv.cvtColor(tile_array, cv.COLOR_BGRA2RGBA)
+    if tile_array.ndim == 3:
+        return cv.cvtColor(tile_array, cv.COLOR_BGR2RGB)
+    return tile_array[..., np.newaxis]
+
+
+def export_png(store_dir, output_dir, compression=3, workers=None):
+    os.makedirs(output_dir, exist_ok=True)
+    with TileStoreReader(store_dir) as reader:
+        def export_one(key):
+            x, y = key
+            if reader.codec == "png":
+                data = reader.read_bytes(x, y)
+            else:
+                data = encode_tile(reader.get(x, y), "png", compression)
+            output_filename = os.path.join(output_dir, f"tile_{x}_{y}.png")
+            with open(output_filename, "wb") as f:
+                f.write(data)
+            return output_filename
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(export_one, reader.keys()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or export a sharded tile store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="Print store metadata")
+    info_parser.add_argument("store_dir")
+    export_parser = subparsers.add_parser("export", help="Write every tile back out as tile_{x}_{y}.png")
+    export_parser.add_argument("store_dir")
+    export_parser.add_argument("output_dir")
+    export_parser.add_argument("--compression", type=int, default=3)
+    export_parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        with TileStoreReader(args.store_dir) as reader:
+            print(json.dumps(reader.meta, indent=2))
+    elif args.command == "export":
+        files = export_png(args.store_dir, args.output_dir, args.compression, args.workers)
+        print(f"Exported {len(files)} tiles to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
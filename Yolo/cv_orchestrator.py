@@ -0,0 +1,414 @@
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+
+LEDGER_FILE = "cv_ledger.json"
+ARGS_FILE = "cv_args.json"
+SUMMARY_FILE = "cv_summary.csv"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+METRIC_KEYS = ["metrics/precision(B)", "metrics/recall(B)", "metrics/mAP50(B)", "metrics/mAP50-95(B)", "fitness"]
+
+
+def args_hash(train_args):
+    """
+    Hash of a fold's training arguments; the device is left out since any slot may run the fold.
+    """
+    args = {key: value for key, value in train_args.items() if key != "device"}
+    return hashlib.sha1(json.dumps(args, sort_keys=True).encode()).hexdigest()
+
+
+def fold_yaml(base_data_path, fold):
+    return os.path.join(base_data_path, f"dataset_fold_{fold}", f"neutrophils_fold_{fold}.yaml")
+
+
+def dataset_images(yaml_path):
+    """
+    Absolute image paths of every split of a fold YAML, whether the split is a folder or a
+    train.txt / test.txt list as written by folds.write_folds.
+    """
+    with open(yaml_path, "r") as f:
+        data = yaml.safe_load(f)
+    root = data.get("path") or os.path.dirname(os.path.abspath(yaml_path))
+    paths = set()
+    for split in ("train", "val", "test"):
+        entry = data.get(split)
+        if not entry:
+            continue
+        entry = entry if os.path.isabs(entry) else os.path.join(root, entry)
+        if entry.endswith(".txt"):
+            with open(entry, "r") as f:
+                paths.update(line.strip() for line in f if line.strip())
+        else:
+            for folder, _, files in os.walk(entry):
+                paths.update(os.path.join(folder, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(os.path.abspath(path) for path in paths)
+
+
+def cache_image(image_path):
+    """
+    Decode one image into the .npy ultralytics reads with cache="disk" (BGR, full size, next to
+    the image). Written under a temporary name and renamed, so a reader never sees a partial file.
+    """
+    import cv2
+
+    cache_path = os.path.splitext(image_path)[0] + ".npy"
+    if os.path.exists(cache_path):
+        return False
+    temp_path = f"{cache_path}.{os.getpid()}.part.npy"
+    np.save(temp_path, cv2.imread(image_path))
+    os.replace(temp_path, cache_path)
+    return True
+
+
+def warm_cache(yaml_paths, workers=8):
+    """
+    Decode every image of all folds once before training. The folds share the same image files,
+    so afterwards each fold only reads the cache and no two jobs ever write it.
+    """
+    image_paths = sorted(set(path for yaml_path in yaml_paths for path in dataset_images(yaml_path)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        written = sum(executor.map(cache_image, image_paths))
+    return len(image_paths), written
+
+
+class JobLedger:
+    """
+    One entry per fold in cv_ledger.json: status (pending, running, done, failed), attempts,
+    pid, run directory, training arguments and their hash, timings and final metrics. Only the orchestrator writes it, always
+    through a temporary file and a rename, so a killed run leaves a readable ledger behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.jobs = {int(fold): job for fold, job in json.load(f).items()}
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({str(fold): job for fold, job in sorted(self.jobs.items())}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def add(self, fold, job):
+        """
+        Register a fold, or start it over when its training arguments differ from the ledger's.
+        """
+        digest = args_hash(job["train_args"])
+        if fold not in self.jobs or self.jobs[fold].get("args_hash") != digest:
+            self.jobs[fold] = dict(job, args_hash=digest, status="pending", attempts=0, pid=None, started=None,
+                                   finished=None, metrics=None, error=None)
+
+    def update(self, fold, **fields):
+        self.jobs[fold].update(fields)
+        self.save()
+
+    def recover(self):
+        """
+        Jobs left "running" by a dead orchestrator go back to pending, unless their process is
+        still training; those folds are returned so the caller waits for them.
+        """
+        alive = []
+        for fold, job in sorted(self.jobs.items()):
+            if job["status"] != "running":
+                continue
+            if pid_alive(job["pid"], job.get("pid_started")):
+                alive.append(fold)
+            else:
+                job["status"] = "pending"
+        self.save()
+        return alive
+
+    def runnable(self, max_attempts):
+        return [fold for fold, job in sorted(self.jobs.items())
+                if job["status"] == "pending" or (job["status"] == "failed" and job["attempts"] < max_attempts)]
+
+
+def process_stat(pid):
+    """
+    (state, start time in clock ticks since boot) of a process from Linux /proc, None where unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # the command name may hold spaces, so count fields from its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        return fields[0], int(fields[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def process_start_time(pid):
+    stat = process_stat(pid)
+    return stat[1] if stat else None
+
+
+def pid_alive(pid, started=None):
+    """
+    Whether pid is running; with the start time recorded at launch, a reused pid does not count.
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    stat = process_stat(pid)
+    if stat is None:
+        return True
+    return stat[0] != "Z" and (started is None or stat[1] == started)
+
+
+def limit_memory(memory_gb):
+    def apply():
+        import resource
+        limit = int(memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return apply
+
+
+def launch(job, device, threads=None, memory_gb=None, log_path=None):
+    """
+    Start one fold in its own Python process. A GPU device is exposed as the only visible one;
+    threads caps the BLAS/OpenMP and torch thread pools; memory_gb caps the address space
+    (meant for CPU folds, CUDA reserves far more virtual memory than it uses).
+    """
+    env = dict(os.environ)
+    train_device = device
+    if device != "cpu":
+        env["CUDA_VISIBLE_DEVICES"] = str(device)
+        train_device = "0"
+    if threads:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[name] = str(threads)
+    spec = dict(job["train_args"], device=train_device)
+    command = [sys.executable, os.path.abspath(__file__), "run-fold", json.dumps(spec)]
+    if threads:
+        command += ["--threads", str(threads)]
+    log_file = open(log_path, "a") if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                               preexec_fn=limit_memory(memory_gb) if memory_gb and os.name == "posix" else None)
+    if log_path:
+        log_file.close()
+    return process
+
+
+def training_finished(last_path):
+    """
+    Whether last.pt is the checkpoint of a completed run: ultralytics strips the optimizer and
+    sets the epoch to -1 once training ends, after which resume=True refuses to start.
+    """
+    from ultralytics.nn.tasks import torch_safe_load
+
+    checkpoint, _ = torch_safe_load(last_path)
+    return checkpoint.get("epoch", -1) == -1
+
+
+def run_fold(spec, threads=None):
+    """
+    Train one fold (inside the job process). Resumes from weights/last.pt when a previous attempt
+    with the same arguments left one, only validates best.pt when that run already completed, and
+    writes the final validation metrics to fold_metrics.json in the run directory.
+    """
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from ultralytics import YOLO
+
+    spec = dict(spec)
+    run_dir = os.path.join(spec["project"], spec["name"])
+    last_path = os.path.join(run_dir, "weights", "last.pt")
+    best_path = os.path.join(run_dir, "weights", "best.pt")
+    args_path = os.path.join(run_dir, ARGS_FILE)
+    previous = None
+    if os.path.exists(args_path):
+        with open(args_path, "r") as f:
+            previous = json.load(f).get("args_hash")
+    same_args = previous == args_hash(spec)
+    if not same_args:
+        # a run directory from other arguments is trained over from scratch, never resumed
+        metrics_path = os.path.join(run_dir, "fold_metrics.json")
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+        os.makedirs(run_dir, exist_ok=True)
+        with open(args_path, "w") as f:
+            json.dump({"args_hash": args_hash(spec), "train_args": spec}, f, indent=2)
+
+    if same_args and os.path.exists(last_path) and training_finished(last_path):
+        model = YOLO(best_path if os.path.exists(best_path) else last_path)
+        results = model.val(data=spec["data"], imgsz=spec.get("imgsz", 640), batch=spec.get("batch", 16),
+                            device=spec["device"], project=run_dir, name="val", exist_ok=True)
+    elif same_args and os.path.exists(last_path):
+        model = YOLO(last_path)
+        results = model.train(resume=True, device=spec["device"], workers=spec.get("workers", 8))
+    else:
+        model = YOLO(spec.pop("model"))
+        results = model.train(exist_ok=True, **spec)
+    metrics = getattr(results, "results_dict", None) or getattr(model.trainer, "metrics", None) or {}
+    metrics = {key: float(value) for key, value in metrics.items()}
+    with open(os.path.join(run_dir, "fold_metrics.json"), "w") as f:
+        json.dump(metrics, f, indent=2)
+    return metrics
+
+
+def read_fold_metrics(run_dir):
+    path = os.path.join(run_dir, "fold_metrics.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_summary(ledger, summary_path):
+    """
+    One row per finished fold plus mean and std rows over the folds.
+    """
+    done = [(fold, job) for fold, job in sorted(ledger.jobs.items()) if job["status"] == "done" and job["metrics"]]
+    keys = [key for key in METRIC_KEYS if any(key in job["metrics"] for _, job in done)]
+    keys += sorted(set(key for _, job in done for key in job["metrics"]) - set(keys))
+    rows = [dict({"fold": fold, "seconds": round(job["finished"] - job["started"], 1)}, **job["metrics"])
+            for fold, job in done]
+    for name, reduce in (("mean", np.mean), ("std", np.std)):
+        if rows:
+            rows.append(dict({"fold": name}, **{key: float(reduce([row[key] for row in rows[:len(done)] if key in row]))
+                                                for key in keys}))
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["fold", "seconds"] + keys)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def run_cv(yaml_paths, project, model="yolo11s.pt", devices=("cpu",), jobs_per_device=1, threads=None, memory_gb=None,
+           max_attempts=2, poll_seconds=5, name="yolov11s_1024_fold_{fold}_ep100_Noaug_b16", cache=True,
+           cache_workers=8, **train_args):
+    """
+    Train every fold in yaml_paths ({fold: data YAML}) as an independent job, at most
+    jobs_per_device at a time on each device, and collect the metrics in cv_summary.csv.
+
+    Progress is kept in <project>/cv_ledger.json: running the same call again skips finished
+    folds, restarts folds that died (resuming from their last.pt) and retries failed folds up
+    to max_attempts. A fold whose training arguments changed starts over from scratch. With cache=True the images are decoded once into ultralytics' disk cache
+    and every fold trains with cache="disk" against it.
+    """
+    project = os.path.abspath(project)
+    os.makedirs(os.path.join(project, "logs"), exist_ok=True)
+    ledger = JobLedger(os.path.join(project, LEDGER_FILE))
+    for fold, yaml_path in sorted(yaml_paths.items()):
+        run_name = name.format(fold=fold)
+        args = dict(train_args, model=model, data=os.path.abspath(yaml_path), project=project, name=run_name)
+        if cache:
+            args["cache"] = "disk"
+        ledger.add(fold, {"run_dir": os.path.join(project, run_name), "train_args": args})
+    # folds still training from an earlier orchestrator hold their device slot until they exit
+    alive = ledger.recover()
+
+    if cache:
+        total, written = warm_cache(yaml_paths.values(), cache_workers)
+        print(f"Disk cache: {written} of {total} images decoded, the rest already cached")
+
+    slots = [device for device in devices for _ in range(jobs_per_device)]
+    adopted = {}
+    for fold in alive:
+        held = [slot for slot in slots if str(slot) == ledger.jobs[fold].get("device")]
+        adopted[fold] = slots.pop(slots.index(held[0])) if held else None
+        print(f"Fold {fold} is still running as pid {ledger.jobs[fold]['pid']}, waiting for it")
+    running = {}
+    while True:
+        for fold in list(adopted):
+            job = ledger.jobs[fold]
+            if pid_alive(job["pid"], job.get("pid_started")):
+                continue
+            slot = adopted.pop(fold)
+            if slot is not None:
+                slots.append(slot)
+            metrics = read_fold_metrics(job["run_dir"])
+            if metrics is not None:
+                ledger.update(fold, status="done", finished=time.time(), metrics=metrics, pid=None, error=None)
+                print(f"Fold {fold} done")
+            else:
+                ledger.update(fold, status="failed", finished=time.time(), pid=None,
+                              error="exited while no orchestrator was watching")
+                print(f"Fold {fold} failed while no orchestrator was watching, see logs/fold_{fold}.log")
+        for fold, (process, device) in list(running.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del running[fold]
+            slots.append(device)
+            metrics = read_fold_metrics(ledger.jobs[fold]["run_dir"])
+            if code == 0 and metrics is not None:
+                ledger.update(fold, status="done", finished=time.time(), metrics=metrics, pid=None, error=None)
+                print(f"Fold {fold} done on {device}")
+            else:
+                ledger.update(fold, status="failed", finished=time.time(), pid=None, error=f"exit code {code}")
+                print(f"Fold {fold} failed on {device} (exit code {code}), see logs/fold_{fold}.log")
+
+        pending = [fold for fold in ledger.runnable(max_attempts) if fold not in running]
+        while pending and slots:
+            fold = pending.pop(0)
+            device = slots.pop(0)
+            job = ledger.jobs[fold]
+            process = launch(job, device, threads, memory_gb, os.path.join(project, "logs", f"fold_{fold}.log"))
+            running[fold] = (process, device)
+            ledger.update(fold, status="running", attempts=job["attempts"] + 1, pid=process.pid,
+                          pid_started=process_start_time(process.pid), started=time.time(), device=str(device))
+            print(f"Fold {fold} started on {device} (attempt {job['attempts']})")
+
+        if not running and not pending and not adopted:
+            break
+        time.sleep(poll_seconds)
+
+    rows = write_summary(ledger, os.path.join(project, SUMMARY_FILE))
+    failed = [fold for fold, job in ledger.jobs.items() if job["status"] != "done"]
+    if failed:
+        print(f"Folds not finished after {max_attempts} attempts: {failed}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train k-fold YOLO splits as parallel, resumable jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    cv_parser = subparsers.add_parser("run")
+    cv_parser.add_argument("--data", default="Data/YOLO_7CV", help="Folder with dataset_fold_<k>/neutrophils_fold_<k>.yaml")
+    cv_parser.add_argument("--folds", type=int, nargs="+", default=list(range(1, 8)))
+    cv_parser.add_argument("--project", default="runs/cv")
+    cv_parser.add_argument("--model", default="yolo11s.pt", help="e.g. yolo11n.yaml for a from-scratch CPU check")
+    cv_parser.add_argument("--devices", nargs="+", default=["cpu"], help="cpu, or GPU indices such as 0 1")
+    cv_parser.add_argument("--jobs-per-device", type=int, default=1)
+    cv_parser.add_argument("--threads", type=int, default=None, help="CPU threads per fold")
+    cv_parser.add_argument("--memory-gb", type=float, default=None, help="Address-space limit per fold (CPU folds)")
+    cv_parser.add_argument("--max-attempts", type=int, default=2)
+    cv_parser.add_argument("--epochs", type=int, default=100)
+    cv_parser.add_argument("--imgsz", type=int, default=1024)
+    cv_parser.add_argument("--batch", type=int, default=16)
+    cv_parser.add_argument("--workers", type=int, default=8, help="Dataloader workers per fold")
+    cv_parser.add_argument("--name", default="yolov11s_1024_fold_{fold}_ep100_Noaug_b16")
+    cv_parser.add_argument("--no-cache", action="store_true")
+    fold_parser = subparsers.add_parser("run-fold", help="Internal: train one fold from a JSON spec")
+    fold_parser.add_argument("spec")
+    fold_parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "run-fold":
+        run_fold(json.loads(args.spec), args.threads)
+        return
+    yaml_paths = {fold: fold_yaml(args.data, fold) for fold in args.folds}
+    rows = run_cv(yaml_paths, args.project, args.model, args.devices, args.jobs_per_device, args.threads,
+                  args.memory_gb, args.max_attempts, name=args.name, cache=not args.no_cache, epochs=args.epochs,
+                  imgsz=args.imgsz, batch=args.batch, workers=args.workers)
+    for row in rows:
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
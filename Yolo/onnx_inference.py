@@ -0,0 +1,332 @@
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+PAD_VALUE = 114
+MAX_WH = 7680  # per-class box offset for batched NMS, as in ultralytics
+MAX_NMS = 30000
+
+
+def list_images(images_dir):
+    return sorted(os.path.join(images_dir, f) for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def letterbox(image, imgsz=1024):
+    """
+    Resize keeping the aspect ratio and pad to imgsz x imgsz with gray, centred, the same way
+    ultralytics prepares images for an exported model. Returns the padded image, gain and (pad_x, pad_y).
+    """
+    height, width = image.shape[:2]
+    gain = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * gain)), int(round(height * gain))
+    pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+    if (width, height) != (new_width, new_height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    return image, gain, (left, top)
+
+
+def squash(image, imgsz=1024):
+    """
+    Resize to imgsz x imgsz ignoring the aspect ratio, with the same PIL resize that
+    convert_coords.process_file used to make the training tiles.
+    """
+    if image.shape[:2] == (imgsz, imgsz):
+        return image
+    return np.asarray(Image.fromarray(np.ascontiguousarray(image)).resize((imgsz, imgsz)))
+
+
+def squashed(detect, imgsz=1024):
+    """
+    Wrap a detector (list of images -> list of (boxes, scores, classes)) so it sees every image
+    squashed to imgsz x imgsz like the training tiles, not letterboxed at its native aspect
+    ratio; boxes are scaled back to the original image.
+    """
+    def detect_squashed(images):
+        results = detect([squash(image, imgsz) for image in images])
+        scaled = []
+        for image, (boxes, scores, classes) in zip(images, results):
+            height, width = image.shape[:2]
+            boxes = np.asarray(boxes, dtype=float).reshape(-1, 4) * ([width / imgsz, height / imgsz] * 2)
+            scaled.append((boxes, scores, classes))
+        return scaled
+
+    return detect_squashed
+
+
+def preprocess(images, imgsz=1024):
+    """
+    BGR uint8 images -> (B, 3, imgsz, imgsz) float32 RGB in [0, 1], plus per-image (gain, pad).
+    """
+    batch = np.empty((len(images), 3, imgsz, imgsz), dtype=np.float32)
+    transforms = []
+    for i, image in enumerate(images):
+        padded, gain, pad = letterbox(image, imgsz)
+        batch[i] = padded[:, :, ::-1].transpose(2, 0, 1) / np.float32(255.0)
+        transforms.append((gain, pad))
+    return batch, transforms
+
+
+def box_iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    Greedy non-maximum suppression; boxes must already be sorted by descending score.
+    """
+    keep = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed[i + 1:] |= box_iou(boxes[i], boxes[i + 1:]) > iou_threshold
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(output, transforms, shapes, conf=0.25, iou=0.7, max_det=300, agnostic=False):
+    """
+    Raw YOLOv8/11 output (B, 4 + classes, anchors) -> per image (boxes xyxy in original pixels,
+    scores, classes), with the confidence filter, class-offset NMS and box rescaling of ultralytics.
+    """
+    detections = []
+    for prediction, (gain, (pad_x, pad_y)), (height, width) in zip(output, transforms, shapes):
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        keep = scores > conf
+        xywh, scores, classes = prediction[keep, :4], scores[keep], classes[keep]
+        order = np.argsort(-scores, kind="stable")[:MAX_NMS]
+        xywh, scores, classes = xywh[order], scores[order], classes[order]
+        boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        offsets = 0 if agnostic else classes[:, None] * MAX_WH
+        keep = nms(boxes + offsets, scores, iou)[:max_det]
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+        boxes = (boxes - [pad_x, pad_y, pad_x, pad_y]) / gain
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        detections.append((boxes.astype(float), scores.astype(float), classes.astype(int)))
+    return detections
+
+
+class OnnxDetector:
+    """
+    CPU ONNX Runtime session for an exported detector, with batched letterbox preprocessing
+    and NumPy NMS. threads sets the intra-op thread count (None lets ONNX Runtime decide).
+    """
+
+    def __init__(self, model_path, imgsz=1024, conf=0.25, iou=0.7, max_det=300, threads=None, batch_size=8):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # a model exported without dynamic=True only takes its fixed batch size
+        self.batch_size = batch_size if not isinstance(model_input.shape[0], int) else model_input.shape[0]
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+    def predict(self, images):
+        detections = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            batch, transforms = preprocess(chunk, self.imgsz)
+            if len(chunk) < self.batch_size and not self.dynamic_batch:
+                batch = np.concatenate([batch, np.zeros((self.batch_size - len(chunk),) + batch.shape[1:], batch.dtype)])
+            output = self.session.run(None, {self.input_name: batch})[0][:len(chunk)]
+            detections.extend(postprocess(output, transforms, [image.shape[:2] for image in chunk],
+                                          self.conf, self.iou, self.max_det))
+        return detections
+
+    @property
+    def dynamic_batch(self):
+        return not isinstance(self.session.get_inputs()[0].shape[0], int)
+
+    def predict_paths(self, image_paths):
+        """
+        {image name: (boxes, scores, (height, width))}, the form used by the Eval prediction tools.
+        """
+        predictions = {}
+        for start in range(0, len(image_paths), self.batch_size):
+            paths = image_paths[start:start + self.batch_size]
+            images = [cv2.imread(path) for path in paths]
+            for path, image, (boxes, scores, _) in zip(paths, images, self.predict(images)):
+                predictions[os.path.basename(path)] = (boxes, scores, image.shape[:2])
+        return predictions
+
+
+def export_onnx(weights_path, imgsz=1024, dynamic=True, simplify=True):
+    """
+    Export best_*.pt to ONNX next to the weights with the ultralytics exporter. Returns the path.
+    """
+    from ultralytics import YOLO
+
+    return YOLO(weights_path).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=simplify, device="cpu")
+
+
+class TileCalibrationReader:
+    """
+    Feeds letterboxed tiles to the static INT8 quantizer.
+    """
+
+    def __init__(self, input_name, image_paths, imgsz=1024):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        path = next(self.image_paths, None)
+        if path is None:
+            return None
+        batch, _ = preprocess([cv2.imread(path)], self.imgsz)
+        return {self.input_name: batch}
+
+
+def quantize_int8(onnx_path, int8_path=None, calibration_dir=None, calibration_count=32, imgsz=1024):
+    """
+    INT8 copy of an exported model. With calibration tiles the activations are quantized
+    statically (QDQ, per channel); without, only the weights are (dynamic quantization).
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    int8_path = int8_path or os.path.splitext(onnx_path)[0] + "_int8.onnx"
+    if calibration_dir is None:
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+        return int8_path
+    input_name = onnx.load(onnx_path, load_external_data=False).graph.input[0].name
+    reader = TileCalibrationReader(input_name, list_images(calibration_dir)[:calibration_count], imgsz)
+    quantize_static(onnx_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax)
+    return int8_path
+
+
+def torch_predict_paths(weights_path, image_paths, imgsz=1024, conf=0.25, iou=0.7, batch_size=8):
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+    predictions = {}
+    for start in range(0, len(image_paths), batch_size):
+        results = model.predict(source=image_paths[start:start + batch_size], imgsz=imgsz, conf=conf, iou=iou,
+                                device="cpu", verbose=False)
+        for result in results:
+            predictions[os.path.basename(result.path)] = (result.boxes.xyxy.numpy().astype(float),
+                                                          result.boxes.conf.numpy().astype(float),
+                                                          tuple(result.orig_shape[:2]))
+    return predictions
+
+
+def drift(reference, predictions, iou_threshold=0.5):
+    """
+    How far predictions are from reference on the same tiles: mean absolute count difference,
+    share of reference boxes matched at IoU > iou_threshold, and mean score difference of matches.
+    """
+    count_errors, matched, total, score_errors = [], 0, 0, []
+    for name, (ref_boxes, ref_scores, _) in reference.items():
+        boxes, scores, _ = predictions[name]
+        count_errors.append(abs(len(boxes) - len(ref_boxes)))
+        total += len(ref_boxes)
+        used = np.zeros(len(boxes), dtype=bool)
+        for ref_box, ref_score in zip(ref_boxes, ref_scores):
+            if not len(boxes):
+                break
+            ious = np.where(used, 0.0, box_iou(ref_box, boxes))
+            best = int(np.argmax(ious))
+            if ious[best] > iou_threshold:
+                used[best] = True
+                matched += 1
+                score_errors.append(abs(scores[best] - ref_score))
+    return {
+        "count_mae": float(np.mean(count_errors)) if count_errors else 0.0,
+        "box_match": matched / total if total else 1.0,
+        "score_mae": float(np.mean(score_errors)) if score_errors else 0.0,
+    }
+
+
+def benchmark(weights_path, images_dir, onnx_paths, imgsz=1024, conf=0.25, iou=0.7, threads=None, batch_size=8,
+              limit=None, reference=True):
+    """
+    Tiles/sec of each ONNX model on CPU and its drift from the PyTorch model (also run on CPU).
+    """
+    image_paths = list_images(images_dir)[:limit]
+    rows = []
+    torch_predictions = None
+    if reference:
+        start = time.perf_counter()
+        torch_predictions = torch_predict_paths(weights_path, image_paths, imgsz, conf, iou, batch_size)
+        elapsed = time.perf_counter() - start
+        rows.append({"engine": "pytorch-cpu", "tiles_per_sec": len(image_paths) / elapsed})
+    for onnx_path in onnx_paths:
+        detector = OnnxDetector(onnx_path, imgsz, conf, iou, threads=threads, batch_size=batch_size)
+        detector.predict_paths(image_paths[:1])  # warm-up
+        start = time.perf_counter()
+        predictions = detector.predict_paths(image_paths)
+        elapsed = time.perf_counter() - start
+        row = {"engine": os.path.basename(onnx_path), "tiles_per_sec": len(image_paths) / elapsed}
+        if torch_predictions is not None:
+            row.update(drift(torch_predictions, predictions))
+        rows.append(row)
+    for row in rows:
+        print(", ".join(f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}" for k, v in row.items()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the detector to ONNX and run or benchmark it on CPU.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="best_*.pt -> .onnx (and _int8.onnx)")
+    export_parser.add_argument("weights")
+    export_parser.add_argument("--imgsz", type=int, default=1024)
+    export_parser.add_argument("--int8", action="store_true")
+    export_parser.add_argument("--calibration-dir", default=None, help="Tiles for static INT8 calibration")
+
+    bench_parser = subparsers.add_parser("benchmark")
+    bench_parser.add_argument("weights")
+    bench_parser.add_argument("onnx", nargs="+")
+    bench_parser.add_argument("--images", default="../Eval/images")
+    bench_parser.add_argument("--imgsz", type=int, default=1024)
+    bench_parser.add_argument("--conf", type=float, default=0.25)
+    bench_parser.add_argument("--threads", type=int, default=None)
+    bench_parser.add_argument("--batch-size", type=int, default=8)
+    bench_parser.add_argument("--limit", type=int, default=None)
+    bench_parser.add_argument("--no-reference", action="store_true", help="Skip the PyTorch run and drift")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        onnx_path = export_onnx(args.weights, args.imgsz)
+        print(f"Exported {onnx_path}")
+        if args.int8:
+            print(f"Quantized {quantize_int8(onnx_path, calibration_dir=args.calibration_dir, imgsz=args.imgsz)}")
+    else:
+        benchmark(args.weights, args.images, args.onnx, args.imgsz, args.conf, threads=args.threads,
+                  batch_size=args.batch_size, limit=args.limit, reference=not args.no_reference)
+
+
+if __name__ == "__main__":
+    main()